@@ -0,0 +1,304 @@
+"""全量用户的离线批量推荐
+
+    python batch_recommend.py --top-k 5 --chunk-size 1024 --workers 4
+    python batch_recommend.py --resume <run_id>
+
+从向量库载入全部商单向量，以 business_orders 中每个用户的商单向量均值作为用户向量，
+分块矩阵乘法求出每个用户最相似的 k 个他人商单，结果写入 user.db 供线上直接读取。
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from order_record import OrderRecord
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_K = 5
+# 每个任务处理的用户数
+DEFAULT_CHUNK_SIZE = 1024
+# 每次矩阵乘法参与的商单数，限制 (用户块 × 商单块) 得分矩阵的内存
+DEFAULT_BLOCK_SIZE = 65536
+
+def init_batch_tables(db_path="user.db"):
+    """初始化批量推荐结果表"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batch_recommendation_runs (
+            run_id TEXT PRIMARY KEY,
+            collection TEXT NOT NULL,
+            orders INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            top_k INTEGER NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batch_recommendation_chunks (
+            run_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            finished_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_id, chunk_index)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batch_recommendations (
+            run_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            order_user_id TEXT NOT NULL,
+            wish_title TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (run_id, user_id, rank)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+def load_order_embeddings(collections, page_size=5000):
+    """分页读取一个或多个集合（分片）中的全部商单向量，返回 (归一化向量矩阵, [(商单所属用户, 标题)])
+
+    同一商单重复出现时只保留第一条。
+    """
+    vectors = []
+    keys = []
+    seen = set()
+    for collection in collections if isinstance(collections, (list, tuple)) else [collections]:
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+            if not page['ids']:
+                break
+            for embedding, metadata in zip(page['embeddings'], page['metadatas']):
+                record = OrderRecord.from_metadata(metadata)
+                key = (str(record.user_id), record.wish_title)
+                if key in seen:
+                    continue
+                seen.add(key)
+                keys.append(key)
+                vectors.append(embedding)
+            offset += len(page['ids'])
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms, keys
+
+def load_user_orders(db_path="user.db"):
+    """从 business_orders 读取 {user_id: [标题, ...]}"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT user_id, wish_title FROM business_orders WHERE search_only = 0 ORDER BY user_id, id').fetchall()
+    conn.close()
+    user_orders = {}
+    for user_id, wish_title in rows:
+        user_orders.setdefault(str(user_id), []).append(wish_title)
+    return user_orders
+
+def build_user_vectors(embeddings, keys, user_orders):
+    """以用户已入库商单向量的均值作为用户向量，返回 (用户 id 列表, 用户向量矩阵, 每个商单所属用户的编号)"""
+    index = {key: i for i, key in enumerate(keys)}
+    user_ids = []
+    rows = []
+    for user_id in sorted(user_orders):
+        positions = [index[(user_id, title)] for title in user_orders[user_id] if (user_id, title) in index]
+        if positions:
+            user_ids.append(user_id)
+            rows.append(embeddings[positions].mean(axis=0))
+    vectors = np.asarray(rows, dtype=np.float32).reshape(len(rows), embeddings.shape[1])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    # 商单所属用户映射为用户编号（不在用户列表中的记为 -1），用于排除用户自己的商单
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+    owners = np.array([user_index.get(owner, -1) for owner, _ in keys], dtype=np.int64)
+    return user_ids, vectors / norms, owners
+
+def top_k_chunk(user_vectors, user_offset, embeddings, owners, k, block_size=DEFAULT_BLOCK_SIZE):
+    """计算一块用户的 top-k 他人商单，返回 (商单下标, 得分)，均为 (用户数, k)
+
+    按商单分块做矩阵乘法，每块用 argpartition 取出候选后与已有候选合并，内存占用为 O(用户数 × block_size)。
+    """
+    n_users = user_vectors.shape[0]
+    k = min(k, embeddings.shape[0])
+    best_idx = np.full((n_users, 0), -1, dtype=np.int64)
+    best_scores = np.full((n_users, 0), -np.inf, dtype=np.float32)
+    user_numbers = np.arange(user_offset, user_offset + n_users)[:, None]
+
+    for start in range(0, embeddings.shape[0], block_size):
+        block = embeddings[start:start + block_size]
+        scores = user_vectors @ block.T
+        scores[owners[start:start + block_size][None, :] == user_numbers] = -np.inf
+        kk = min(k, scores.shape[1])
+        candidates = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+
+        merged_idx = np.concatenate([best_idx, candidates + start], axis=1)
+        merged_scores = np.concatenate([best_scores, candidate_scores], axis=1)
+        if merged_scores.shape[1] > k:
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_idx = np.take_along_axis(merged_idx, keep, axis=1)
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        else:
+            best_idx, best_scores = merged_idx, merged_scores
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+def _save_chunk(conn, run_id, chunk_index, user_ids, keys, indices, scores):
+    rows = []
+    for user_id, user_indices, user_scores in zip(user_ids, indices, scores):
+        rank = 0
+        for i, score in zip(user_indices, user_scores):
+            # 他人商单不足 k 个时剩余位置为 -inf
+            if not np.isfinite(score):
+                break
+            rows.append((run_id, user_id, rank, keys[i][0], keys[i][1], float(score)))
+            rank += 1
+    c = conn.cursor()
+    c.execute('BEGIN')
+    try:
+        c.executemany(
+            'DELETE FROM batch_recommendations WHERE run_id = ? AND user_id = ?',
+            [(run_id, user_id) for user_id in user_ids]
+        )
+        c.executemany('''
+            INSERT INTO batch_recommendations (run_id, user_id, rank, order_user_id, wish_title, score)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        c.execute('''
+            INSERT OR REPLACE INTO batch_recommendation_chunks (run_id, chunk_index, users)
+            VALUES (?, ?, ?)
+        ''', (run_id, chunk_index, len(user_ids)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def run_batch(collection, collection_name, top_k=DEFAULT_TOP_K, chunk_size=DEFAULT_CHUNK_SIZE,
+              block_size=DEFAULT_BLOCK_SIZE, workers=4, run_id=None, db_path="user.db"):
+    """执行（或续跑）一次批量推荐，返回统计信息
+
+    续跑时跳过已完成的用户块；用户按 id 排序后分块，同一份数据的分块方式保持不变。
+    """
+    init_batch_tables(db_path)
+    start = time.perf_counter()
+    embeddings, keys = load_order_embeddings(collection)
+    user_ids, user_vectors, owners = build_user_vectors(embeddings, keys, load_user_orders(db_path))
+    logger.info(f"Loaded {len(keys)} order embeddings and {len(user_ids)} users")
+
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        if run_id is None:
+            run_id = time.strftime('%Y%m%d%H%M%S')
+            conn.execute('''
+                INSERT INTO batch_recommendation_runs (run_id, collection, orders, users, top_k, chunk_size, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'running')
+            ''', (run_id, collection_name, len(keys), len(user_ids), top_k, chunk_size))
+            conn.commit()
+            done = set()
+        else:
+            run = conn.execute(
+                'SELECT users, top_k, chunk_size FROM batch_recommendation_runs WHERE run_id = ?', (run_id,)
+            ).fetchone()
+            if run is None:
+                raise ValueError(f"Unknown batch run: {run_id}")
+            if run != (len(user_ids), top_k, chunk_size):
+                raise ValueError(f"Batch run {run_id} was started with different data or parameters: {run}")
+            done = {row[0] for row in conn.execute(
+                'SELECT chunk_index FROM batch_recommendation_chunks WHERE run_id = ?', (run_id,)
+            )}
+
+        chunks = [
+            (index, offset) for index, offset in enumerate(range(0, len(user_ids), chunk_size))
+            if index not in done
+        ]
+        logger.info(f"Batch run {run_id}: {len(chunks)} chunks to compute, {len(done)} already done")
+
+        # 矩阵乘法期间释放 GIL，线程池即可利用多核；结果在主线程中逐块写入
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(top_k_chunk, user_vectors[offset:offset + chunk_size], offset,
+                                embeddings, owners, top_k, block_size): (index, offset)
+                for index, offset in chunks
+            }
+            for future in as_completed(futures):
+                index, offset = futures[future]
+                indices, scores = future.result()
+                _save_chunk(conn, run_id, index, user_ids[offset:offset + chunk_size], keys, indices, scores)
+
+        conn.execute(
+            "UPDATE batch_recommendation_runs SET status = 'finished', finished_at = CURRENT_TIMESTAMP WHERE run_id = ?",
+            (run_id,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "run_id": run_id,
+        "orders": len(keys),
+        "users": len(user_ids),
+        "chunks": len(chunks),
+        "skipped_chunks": len(done),
+        "elapsed_seconds": round(elapsed, 3),
+        "users_per_second": round(len(user_ids) / elapsed, 1) if elapsed else None
+    }
+    logger.info(f"Batch recommendation finished: {stats}")
+    return stats
+
+def get_batch_recommendations(user_id, run_id=None, db_path="user.db"):
+    """读取用户的批量推荐结果（默认取最近一次完成的批次），返回 [{user_id, wish_title, score}, ...]"""
+    try:
+        conn = sqlite3.connect(db_path)
+        if run_id is None:
+            row = conn.execute('''
+                SELECT run_id FROM batch_recommendation_runs
+                WHERE status = 'finished' ORDER BY finished_at DESC LIMIT 1
+            ''').fetchone()
+            if row is None:
+                conn.close()
+                return []
+            run_id = row[0]
+        rows = conn.execute('''
+            SELECT order_user_id, wish_title, score FROM batch_recommendations
+            WHERE run_id = ? AND user_id = ? ORDER BY rank
+        ''', (run_id, str(user_id))).fetchall()
+        conn.close()
+        return [{"user_id": order_user_id, "wish_title": wish_title, "score": score}
+                for order_user_id, wish_title, score in rows]
+    except Exception as e:
+        logger.error(f"Error getting batch recommendations for user {user_id}: {str(e)}")
+        return []
+
+def main():
+    parser = argparse.ArgumentParser(description="全量用户的离线批量推荐")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每个任务处理的用户数")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="每次矩阵乘法参与的商单数")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--resume", default=None, metavar="RUN_ID", help="续跑未完成的批次")
+    args = parser.parse_args()
+
+    import chromadb
+    from business_vector_db import VECTOR_DB_PATH, VECTOR_SHARD_MODE, _load_active_collection
+    collection_name = _load_active_collection()
+    client = chromadb.PersistentClient(path=VECTOR_DB_PATH)
+    if VECTOR_SHARD_MODE:
+        names = sorted(getattr(c, "name", c) for c in client.list_collections())
+        collection = [client.get_collection(name=name) for name in names if name.startswith(f"{collection_name}__")]
+    else:
+        collection = client.get_collection(name=collection_name)
+    run_batch(collection, collection_name, top_k=args.top_k, chunk_size=args.chunk_size,
+              block_size=args.block_size, workers=args.workers, run_id=args.resume)
+
+if __name__ == '__main__':
+    main()
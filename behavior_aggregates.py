@@ -0,0 +1,236 @@
+import sqlite3
+import math
+import time
+import logging
+import threading
+from datetime import datetime
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 参与度按指数衰减，半衰期为 7 天
+ENGAGEMENT_HALF_LIFE = 7 * 24 * 3600
+# 各交互类型对参与度的贡献
+INTERACTION_WEIGHTS = {
+    'view': 1.0,
+    'view_detail': 1.0,
+    'click': 2.0,
+    'like': 3.0,
+    'collect': 3.0,
+    'comment': 3.0,
+    'share': 4.0,
+    'dislike': -2.0
+}
+TOTAL_KEY = ('total', '')
+# 已计入聚合的操作日志位置，记录在 batch_watermarks 中
+OPERATIONS_WATERMARK = "behavior_aggregates_operations"
+
+def _decay(seconds):
+    return math.exp(-math.log(2) * max(seconds, 0.0) / ENGAGEMENT_HALF_LIFE)
+
+def _parse_time(value):
+    """将操作日志中的时间（字符串或时间戳）转换为时间戳"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def operation_category(op):
+    """从操作日志的 detail 中提取内容类型
+
+    与 /feedback 事件的 content_type 是同一含义（操作日志中记为 business_type），
+    两条写入路径的聚合因此落在同一组键上。
+    """
+    detail = op.get('detail') or {}
+    if isinstance(detail, dict):
+        return detail.get('content_type') or detail.get('business_type') or ''
+    return ''
+
+class BehaviorAggregates:
+    """按用户维护的滚动行为聚合
+
+    对每个用户记录各交互类型、各内容类型以及总体的次数、衰减参与度和最后出现时间。
+    每次交互只更新固定的三行，代价为 O(1)，与历史长度无关。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 保证同一段操作日志只被计入一次
+        self._catch_up_lock = threading.Lock()
+        # user_id -> {(dimension, key): [count, engagement(截至 last_seen), last_seen]}
+        self._users = {}
+        # 已计入聚合的最后一条操作日志的 seq
+        self.operations_seq = 0
+
+    def init(self):
+        """建表并将已有聚合载入内存"""
+        try:
+            conn = sqlite3.connect("user.db")
+            c = conn.cursor()
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS user_behavior_aggregates (
+                    user_id TEXT NOT NULL,
+                    dimension TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    engagement REAL NOT NULL,
+                    last_seen REAL NOT NULL,
+                    PRIMARY KEY (user_id, dimension, key)
+                )
+            ''')
+            # 旧版本按 detail.category 分类，与 /feedback 的 content_type 不一致；清空后由操作日志重新回填
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS batch_watermarks (
+                    name TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL
+                )
+            ''')
+            c.execute("SELECT 1 FROM user_behavior_aggregates WHERE dimension = 'category' LIMIT 1")
+            if c.fetchone() is not None:
+                c.execute('DELETE FROM user_behavior_aggregates')
+                c.execute('DELETE FROM batch_watermarks WHERE name = ?', (OPERATIONS_WATERMARK,))
+                logger.info("Dropped behavior aggregates keyed by legacy category, will rebuild")
+            c.execute('SELECT seq FROM batch_watermarks WHERE name = ?', (OPERATIONS_WATERMARK,))
+            row = c.fetchone()
+            if row is None:
+                # 没有水位线的旧版本聚合已由当时的全部操作日志回填，从日志末尾继续；空聚合从头回填
+                c.execute('SELECT EXISTS (SELECT 1 FROM user_behavior_aggregates)')
+                seq = 0
+                if c.fetchone()[0]:
+                    try:
+                        seq = c.execute('SELECT MAX(seq) FROM user_operation_log').fetchone()[0] or 0
+                    except sqlite3.OperationalError:
+                        seq = 0
+                c.execute('INSERT INTO batch_watermarks (name, seq) VALUES (?, ?)', (OPERATIONS_WATERMARK, seq))
+                row = (seq,)
+            conn.commit()
+            self.operations_seq = row[0]
+            c.execute('SELECT user_id, dimension, key, count, engagement, last_seen FROM user_behavior_aggregates')
+            users = {}
+            for user_id, dimension, key, count, engagement, last_seen in c.fetchall():
+                users.setdefault(user_id, {})[(dimension, key)] = [count, engagement, last_seen]
+            conn.close()
+            with self._lock:
+                self._users = users
+            logger.info(f"Loaded behavior aggregates for {len(users)} users")
+        except Exception as e:
+            logger.error(f"Error initializing behavior aggregates: {str(e)}")
+
+    def is_empty(self):
+        return not self._users
+
+    def _apply(self, user_id, action, content_type, timestamp):
+        """更新内存中的聚合，返回被修改的行"""
+        weight = INTERACTION_WEIGHTS.get(action, 1.0)
+        changed = []
+        user_rows = self._users.setdefault(user_id, {})
+        for dimension, key in (TOTAL_KEY, ('action', action), ('content_type', content_type or '')):
+            row = user_rows.get((dimension, key))
+            if row is None:
+                row = user_rows[(dimension, key)] = [0, 0.0, timestamp]
+            row[0] += 1
+            if timestamp >= row[2]:
+                row[1] = row[1] * _decay(timestamp - row[2]) + weight
+                row[2] = timestamp
+            else:
+                # 乱序到达的旧事件，按其距今的衰减计入
+                row[1] += weight * _decay(row[2] - timestamp)
+            changed.append((user_id, dimension, key, row[0], row[1], row[2]))
+        return changed
+
+    def record_many(self, events, operations_seq=None):
+        """批量记录交互事件 (user_id, action, content_type, timestamp)，一次事务写回
+
+        events 来自操作日志时传入其中最大的 seq，与聚合在同一事务中推进操作日志水位线。
+        """
+        changed = {}
+        with self._lock:
+            for user_id, action, content_type, timestamp in events:
+                for row in self._apply(str(user_id), action, content_type, _parse_time(timestamp)):
+                    changed[row[:3]] = row
+        if not changed and operations_seq is None:
+            return True
+        try:
+            conn = sqlite3.connect("user.db")
+            c = conn.cursor()
+            c.executemany('''
+                INSERT INTO user_behavior_aggregates (user_id, dimension, key, count, engagement, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, dimension, key) DO UPDATE SET
+                    count = excluded.count,
+                    engagement = excluded.engagement,
+                    last_seen = excluded.last_seen
+            ''', list(changed.values()))
+            if operations_seq is not None:
+                c.execute('''
+                    INSERT INTO batch_watermarks (name, seq) VALUES (?, ?)
+                    ON CONFLICT (name) DO UPDATE SET seq = excluded.seq
+                ''', (OPERATIONS_WATERMARK, operations_seq))
+            conn.commit()
+            conn.close()
+            return True
+        except Exception as e:
+            logger.error(f"Error saving behavior aggregates: {str(e)}")
+            return False
+
+    def record(self, user_id, action, content_type, timestamp=None):
+        """记录一次交互"""
+        return self.record_many([(user_id, action, content_type, timestamp)])
+
+    def catch_up(self, read_operations, batch_size=5000):
+        """将操作日志中水位线之后的新记录计入聚合，返回计入的条数
+
+        read_operations(after_seq) 按 seq 顺序返回带 seq 的操作记录；首次启用时即为全量回填，
+        之后每次导入操作日志文件后调用，新导入的记录会改变聚合，缓存随之失效。
+        """
+        with self._catch_up_lock:
+            batch = []
+            total = 0
+            last_seq = self.operations_seq
+            for op in read_operations(self.operations_seq):
+                batch.append((op['user_id'], op['action'], operation_category(op), op.get('time')))
+                last_seq = op['seq']
+                if len(batch) >= batch_size:
+                    if not self.record_many(batch, operations_seq=last_seq):
+                        return total
+                    self.operations_seq = last_seq
+                    total += len(batch)
+                    batch = []
+            if batch and self.record_many(batch, operations_seq=last_seq):
+                self.operations_seq = last_seq
+                total += len(batch)
+        if total:
+            logger.info(f"Added {total} operations to behavior aggregates (up to seq {self.operations_seq})")
+        return total
+
+    def get(self, user_id, now=None):
+        """获取用户的聚合摘要，参与度衰减到 now；无记录时返回 None"""
+        user_id = str(user_id)
+        now = time.time() if now is None else now
+        with self._lock:
+            user_rows = self._users.get(user_id)
+            if not user_rows:
+                return None
+            rows = [(dimension, key, list(row)) for (dimension, key), row in user_rows.items()]
+
+        def summarize(row):
+            count, engagement, last_seen = row
+            return {
+                'count': count,
+                'engagement': round(engagement * _decay(now - last_seen), 4),
+                'last_seen': datetime.fromtimestamp(last_seen).strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+        summary = {'actions': {}, 'content_types': {}}
+        for dimension, key, row in rows:
+            if dimension == 'total':
+                summary.update(summarize(row))
+            else:
+                summary['actions' if dimension == 'action' else 'content_types'][key] = summarize(row)
+        summary['total_events'] = summary.pop('count')
+        return summary
@@ -0,0 +1,392 @@
+"""Quart 应用的流量回放压测
+
+在本进程内用 hypercorn 启动应用（编码模型和 LLM 使用 benchmarks.stubs 中的替身），
+数据文件复制到临时目录中，不会改动仓库中的 user.db 和向量库。
+
+    python -m benchmarks.load_test --app business --concurrency 32 --duration 60
+    python -m benchmarks.load_test --app web --mix feedback=90,analyze=10 --output web_load.json
+"""
+import argparse
+import ast
+import asyncio
+import importlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+from benchmarks.stubs import install_stubs
+from benchmarks.synthetic_orders import OrderGenerator
+from benchmarks.run_benchmarks import REPO_ROOT, git_revision, summarize
+
+APP_MODULES = {"business": "business_web_app", "web": "web_app"}
+# 压测前复制到临时目录的数据文件（存在时）
+DATA_FILES = ("orders.json", "user_orders.json", "user.db", "shqp_rag.txt",
+              os.path.join("cache", "user_operations.json"))
+DEFAULT_MIXES = {
+    "business": {"user_orders": 80, "create_order": 20},
+    "web": {"feedback": 85, "analyze": 15},
+}
+# 事件循环被阻塞超过该时长记为一次卡顿
+STALL_THRESHOLD = 0.05
+# 请求出错（连接被拒绝、服务端断开）后的重试等待，连续出错时指数增长
+ERROR_BACKOFF = 0.05
+MAX_ERROR_BACKOFF = 1.0
+
+class TrafficSource:
+    """请求生成：用户 id 取自 user_orders.json 和 user_operations.json，交互反馈回放操作日志"""
+
+    def __init__(self, workdir, seed=42):
+        self.random = random.Random(seed)
+        with open(os.path.join(workdir, "user_orders.json"), 'r', encoding='utf-8') as f:
+            self.order_user_ids = sorted({str(order["user_id"]) for order in json.load(f)})
+        operations_file = os.path.join(workdir, "cache", "user_operations.json")
+        self.operations = []
+        if os.path.exists(operations_file):
+            with open(operations_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.operations = data["operations"] if isinstance(data, dict) else data
+        self.operation_user_ids = sorted({str(op["user_id"]) for op in self.operations}) or self.order_user_ids
+        self.order_generator = OrderGenerator.from_files(
+            [os.path.join(workdir, name) for name in ("orders.json", "user_orders.json")], seed=seed
+        )
+        self._new_orders = self.order_generator.generate(10 ** 9)
+
+    def user_orders(self):
+        user_id = self.random.choice(self.order_user_ids)
+        return "GET", f"/api/business/orders/{user_id}", None
+
+    def create_order(self):
+        order = next(self._new_orders)
+        order["user_id"] = self.random.choice(self.order_user_ids)
+        return "POST", "/api/business/orders", order
+
+    def feedback(self):
+        if self.operations:
+            op = self.random.choice(self.operations)
+            detail = op.get("detail") if isinstance(op.get("detail"), dict) else {}
+            body = {
+                "user_id": str(op["user_id"]),
+                "item_id": str(detail.get("business_id") or self.random.randint(1, 10000)),
+                "interaction_type": op["action"],
+                "content_type": detail.get("business_type") or "Article"
+            }
+        else:
+            body = {
+                "user_id": self.random.choice(self.operation_user_ids),
+                "item_id": str(self.random.randint(1, 10000)),
+                "interaction_type": self.random.choice(["view_detail", "like", "collect"]),
+                "content_type": "Article"
+            }
+        return "POST", "/feedback", body
+
+    def analyze(self):
+        return "POST", "/analyze", {"user_id": self.random.choice(self.operation_user_ids)}
+
+class HttpConnection:
+    """最小的 HTTP/1.1 keep-alive 客户端，只用于压测"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        """发送请求并读完响应体，返回状态码"""
+        if self.writer is None:
+            await self._connect()
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else b""
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n"
+        )
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        self.writer.write(head.encode('latin-1') + b"\r\n" + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            self.close()
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status
+
+class LoopLagMonitor:
+    """定时休眠并测量实际唤醒延迟，衡量事件循环被阻塞的时间"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self.recording = False
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            if self.recording:
+                self.samples.append(max(loop.time() - start - self.interval, 0.0))
+
+    def report(self):
+        if not self.samples:
+            return {"samples": 0}
+        lags = np.array(self.samples)
+        stalls = lags[lags > STALL_THRESHOLD]
+        return {
+            "samples": len(lags),
+            "mean_lag_ms": round(float(lags.mean()) * 1000, 3),
+            "p99_lag_ms": round(float(np.percentile(lags, 99)) * 1000, 3),
+            "max_lag_ms": round(float(lags.max()) * 1000, 3),
+            "stalls": len(stalls),
+            "blocked_seconds": round(float(stalls.sum()), 3)
+        }
+
+class ServerThread(threading.Thread):
+    """在独立线程的事件循环中运行 hypercorn，压测客户端不占用应用的事件循环"""
+
+    def __init__(self, app, host, port):
+        super().__init__(name="load-test-server", daemon=True)
+        self.app = app
+        self.host = host
+        self.port = port
+        self.lag_monitor = LoopLagMonitor()
+        self.loop = None
+        self._shutdown = None
+        self.error = None
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            self.error = e
+        finally:
+            self.loop.close()
+
+    async def _serve(self):
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+        config = Config()
+        config.bind = [f"{self.host}:{self.port}"]
+        config.accesslog = None
+        config.errorlog = None
+        self._shutdown = asyncio.Event()
+        lag_task = asyncio.get_running_loop().create_task(self.lag_monitor.run())
+        try:
+            await serve(self.app, config, shutdown_trigger=self._shutdown.wait)
+        finally:
+            lag_task.cancel()
+
+    def wait_ready(self, timeout=300):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.is_alive():
+                raise RuntimeError(f"Server exited during startup: {self.error}")
+            try:
+                with socket.create_connection((self.host, self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise TimeoutError(f"Server did not start within {timeout}s")
+
+    def stop(self):
+        if self.loop is not None and self._shutdown is not None:
+            self.loop.call_soon_threadsafe(self._shutdown.set)
+        self.join(timeout=30)
+
+def missing_modules(module_name):
+    """返回应用模块顶层导入中当前环境找不到的模块（替身模块除外），不执行应用模块本身"""
+    with open(os.path.join(REPO_ROOT, f"{module_name}.py"), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return sorted(name for name in names if name not in sys.modules and importlib.util.find_spec(name) is None)
+
+def parse_mix(text, app_name):
+    if not text:
+        return DEFAULT_MIXES[app_name]
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+async def run_load(source, mix, host, port, concurrency, duration, warmup, lag_monitor):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    generators = {name: getattr(source, name) for name in names}
+    results = {name: {"latencies": [], "statuses": {}, "errors": 0} for name in names}
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + warmup
+    deadline = measure_from + duration
+
+    async def worker():
+        connection = HttpConnection(host, port)
+        backoff = ERROR_BACKOFF
+        while loop.time() < deadline:
+            name = source.random.choices(names, weights)[0]
+            method, path, body = generators[name]()
+            start = time.perf_counter()
+            try:
+                status = await connection.request(method, path, body)
+            except Exception:
+                connection.close()
+                if loop.time() >= measure_from:
+                    results[name]["errors"] += 1
+                # 服务不可用时退避重试，避免空转占满 CPU
+                await asyncio.sleep(min(backoff, max(deadline - loop.time(), 0)))
+                backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+                continue
+            backoff = ERROR_BACKOFF
+            elapsed = time.perf_counter() - start
+            if loop.time() >= measure_from:
+                results[name]["latencies"].append(elapsed)
+                results[name]["statuses"][status] = results[name]["statuses"].get(status, 0) + 1
+        connection.close()
+
+    async def start_recording():
+        await asyncio.sleep(warmup)
+        lag_monitor.recording = True
+
+    recorder = loop.create_task(start_recording())
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    lag_monitor.recording = False
+    recorder.cancel()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Quart 应用流量回放压测")
+    parser.add_argument("--app", choices=sorted(APP_MODULES), default="business")
+    parser.add_argument("--mix", default=None, help="流量配比，如 user_orders=80,create_order=20")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="计入统计的压测时长（秒）")
+    parser.add_argument("--warmup", type=float, default=5.0, help="预热时长（秒），不计入统计")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--encoder-latency", type=float, default=0.0, help="替身编码模型每条文本的模拟耗时（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="替身 LLM 每次调用的模拟耗时（秒）")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix, args.app)
+    unknown = [name for name in mix if not hasattr(TrafficSource, name)]
+    if unknown:
+        parser.error(f"Unknown traffic types: {unknown}")
+
+    install_stubs(encoder_latency=args.encoder_latency, llm_latency=args.llm_latency)
+    sys.path.insert(0, REPO_ROOT)
+    # 在复制数据和启动服务之前检查依赖，缺少模块时直接给出原因
+    missing = missing_modules(APP_MODULES[args.app])
+    if missing:
+        parser.error(f"--app {args.app} cannot be started: {APP_MODULES[args.app]} imports modules "
+                     f"that are not available: {', '.join(missing)}")
+    workdir = tempfile.mkdtemp(prefix="business_load_")
+    for name in DATA_FILES:
+        source_path = os.path.join(REPO_ROOT, name)
+        if os.path.exists(source_path):
+            os.makedirs(os.path.dirname(os.path.join(workdir, name)), exist_ok=True)
+            shutil.copy2(source_path, os.path.join(workdir, name))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    server = None
+    results = None
+    wall_seconds = 0.0
+    try:
+        source = TrafficSource(workdir, seed=args.seed)
+        app = importlib.import_module(APP_MODULES[args.app]).app
+        server = ServerThread(app, "127.0.0.1", args.port)
+        server.start()
+        server.wait_ready()
+
+        start = time.perf_counter()
+        results = asyncio.run(run_load(source, mix, "127.0.0.1", args.port, args.concurrency,
+                                       args.duration, args.warmup, server.lag_monitor))
+        wall_seconds = time.perf_counter() - start - args.warmup
+    finally:
+        if server is not None:
+            server.stop()
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if results is None:
+        sys.exit("Load test did not produce results")
+
+    all_latencies = [latency for result in results.values() for latency in result["latencies"]]
+    report = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "app": args.app,
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "encoder_latency": args.encoder_latency,
+            "llm_latency": args.llm_latency
+        },
+        "throughput_rps": round(len(all_latencies) / wall_seconds, 1) if wall_seconds > 0 else None,
+        "overall": summarize(all_latencies),
+        "endpoints": {
+            name: {
+                **summarize(result["latencies"]),
+                "statuses": {str(status): count for status, count in sorted(result["statuses"].items())},
+                "errors": result["errors"]
+            }
+            for name, result in results.items()
+        },
+        "event_loop": server.lag_monitor.report()
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""离线基准测试：合成商单 + 确定性编码模型/LLM 替身，结果以 JSON 输出
+
+    python -m benchmarks.run_benchmarks --orders 100000 --output benchmark_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from benchmarks.stubs import StubEncoder, install_stubs
+from benchmarks.synthetic_orders import OrderGenerator, write_orders
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def summarize(latencies):
+    """延迟统计（毫秒）"""
+    if not latencies:
+        return {"count": 0}
+    values = np.array(latencies) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+        "ops_per_second": round(len(values) / (values.sum() / 1000), 1) if values.sum() else None
+    }
+
+def timed(func, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def bench_sqlite(orders_file, user_ids, queries):
+    from business_db import init_business_db, bulk_load_orders, iter_orders_from_json, get_business_orders_by_user
+    init_business_db()
+    load = bulk_load_orders(iter_orders_from_json(orders_file))
+    # 再次导入相同数据，衡量幂等导入（全部命中冲突）的开销
+    reload = bulk_load_orders(iter_orders_from_json(orders_file))
+    by_user = timed(get_business_orders_by_user, [(user_id,) for user_id in user_ids[:queries]])
+    return {
+        "bulk_load": load,
+        "bulk_reload": reload,
+        "get_business_orders_by_user": summarize(by_user)
+    }
+
+def bench_vector(orders, orders_file, query_orders, queries, llm):
+    try:
+        from business_vector_db import BusinessVectorDB
+    except ImportError as e:
+        return {"skipped": f"vector store unavailable: {str(e)}"}
+
+    results = {}
+    model = StubEncoder()
+    vector_db = BusinessVectorDB("bench_add_orders", model=model)
+    start = time.perf_counter()
+    vector_db.add_orders(orders)
+    elapsed = time.perf_counter() - start
+    results["add_orders"] = {
+        "orders": len(orders),
+        "elapsed_seconds": round(elapsed, 3),
+        "orders_per_second": round(len(orders) / elapsed, 1) if elapsed else None
+    }
+
+    json_db = BusinessVectorDB("bench_load_json", model=model)
+    start = time.perf_counter()
+    json_db.load_orders_from_json(orders_file)
+    elapsed = time.perf_counter() - start
+    results["load_orders_from_json"] = {
+        "orders": json_db.count(),
+        "elapsed_seconds": round(elapsed, 3),
+        "orders_per_second": round(json_db.count() / elapsed, 1) if elapsed else None
+    }
+
+    for mode in ("vector", "hybrid"):
+        llm.calls = 0
+        latencies = timed(vector_db.find_similar_orders,
+                          [(order, 5, mode) for order in query_orders[:queries]])
+        # 只带角色的查询走 LLM 重排路径
+        role_only = [{"Corresponding role": order["Corresponding role"]} for order in query_orders[:queries]]
+        role_latencies = timed(vector_db.find_similar_orders, [(order, 5, mode) for order in role_only])
+        results[f"find_similar_orders_{mode}"] = summarize(latencies)
+        results[f"find_similar_orders_{mode}_role_only"] = summarize(role_latencies)
+        results[f"find_similar_orders_{mode}_llm_calls"] = llm.calls
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="商单检索与存储的离线基准测试")
+    parser.add_argument("--orders", type=int, default=10000, help="合成商单数量")
+    parser.add_argument("--vector-orders", type=int, default=None,
+                        help="写入向量库的商单数量，默认与 --orders 相同（上限 20000）")
+    parser.add_argument("--queries", type=int, default=200, help="每项查询基准的请求数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--encoder-latency", type=float, default=0.0, help="替身编码模型每条文本的模拟耗时（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="替身 LLM 每次调用的模拟耗时（秒）")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    llm = install_stubs(encoder_latency=args.encoder_latency, llm_latency=args.llm_latency)
+    sys.path.insert(0, REPO_ROOT)
+
+    generator = OrderGenerator.from_files(
+        [os.path.join(REPO_ROOT, name) for name in ("orders.json", "user_orders.json")], seed=args.seed
+    )
+    workdir = tempfile.mkdtemp(prefix="business_bench_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        orders_file = os.path.join(workdir, "synthetic_orders.json")
+        start = time.perf_counter()
+        write_orders(generator.generate(args.orders), orders_file)
+        generate_seconds = time.perf_counter() - start
+
+        # 查询样本：按商单抽样，热门用户被抽中的概率更高，与线上访问分布一致
+        rng = random.Random(args.seed)
+        with open(orders_file, 'r', encoding='utf-8') as f:
+            all_orders = json.load(f)
+        sample = [all_orders[rng.randrange(len(all_orders))] for _ in range(args.queries)]
+        user_ids = [order["user_id"] for order in sample]
+
+        vector_count = min(args.vector_orders or min(args.orders, 20000), args.orders)
+        vector_orders = all_orders[:vector_count]
+        vector_file = os.path.join(workdir, "vector_orders.json")
+        write_orders(vector_orders, vector_file)
+        del all_orders
+
+        results = {
+            "meta": {
+                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__,
+                "orders": args.orders,
+                "vector_orders": vector_count,
+                "queries": args.queries,
+                "seed": args.seed,
+                "encoder_latency": args.encoder_latency,
+                "llm_latency": args.llm_latency,
+                "generate_seconds": round(generate_seconds, 3)
+            },
+            "sqlite": bench_sqlite(orders_file, user_ids, args.queries),
+            "vector": bench_vector(vector_orders, vector_file, sample, args.queries, llm)
+        }
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""确定性的编码模型和 LLM 替身
+
+基准测试和压测不依赖 text2vec-large-chinese 权重和千帆接口：在导入业务模块之前调用
+install_stubs()，以替身替换 sentence_transformers 和 my_qianfan_llm。
+"""
+import hashlib
+import json
+import re
+import sys
+import time
+import types
+import numpy as np
+
+STUB_DIMENSION = 256
+
+class StubEncoder:
+    """按字符二元组哈希到固定维度的词袋向量，相同文本总是得到相同向量，文本越相近向量越相近"""
+
+    def __init__(self, model_name_or_path=None, dimension=STUB_DIMENSION, latency=0.0):
+        self.model_name_or_path = model_name_or_path
+        self.dimension = dimension
+        # 每条文本的模拟编码耗时（秒）
+        self.latency = latency
+
+    def _bucket(self, token):
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dimension, 1.0 if value >> 63 else -1.0
+
+    def _encode_one(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for i in range(max(len(text) - 1, 1)):
+            bucket, sign = self._bucket(text[i:i + 2])
+            vector[bucket] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        if self.latency:
+            time.sleep(self.latency * (1 if isinstance(sentences, str) else len(sentences)))
+        if isinstance(sentences, str):
+            return self._encode_one(sentences)
+        vectors = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        for i, text in enumerate(sentences):
+            vectors[i] = self._encode_one(text)
+        return vectors
+
+class StubLLM:
+    """按 BusinessVectorDB._analyze_with_llm 要求的 JSON 格式返回确定性评分"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        order_ids = re.findall(r'"order_id":\s*"([^"]+)"', prompt)
+        analysis = [
+            {
+                "order_id": order_id,
+                "score": int(hashlib.md5(order_id.encode('utf-8')).hexdigest()[:4], 16) / 0xFFFF,
+                "reason": "stub"
+            }
+            for order_id in order_ids
+        ]
+        return json.dumps({"analysis": analysis}, ensure_ascii=False)
+
+    def __call__(self, prompt):
+        return self.invoke(prompt)
+
+def install_stubs(encoder_latency=0.0, llm_latency=0.0):
+    """注册替身模块，必须在导入 business_vector_db 等模块之前调用；返回 LLM 替身"""
+    sentence_transformers = types.ModuleType('sentence_transformers')
+    sentence_transformers.SentenceTransformer = lambda *args, **kwargs: StubEncoder(
+        *args[:1], latency=encoder_latency
+    )
+    sys.modules['sentence_transformers'] = sentence_transformers
+
+    llm = StubLLM(latency=llm_latency)
+    qianfan = types.ModuleType('my_qianfan_llm')
+    qianfan.llm = llm
+    sys.modules['my_qianfan_llm'] = qianfan
+    return llm
@@ -0,0 +1,104 @@
+"""按 orders.json 的分布生成任意规模的合成商单
+
+    python -m benchmarks.synthetic_orders --count 100000 --output synthetic_orders.json
+"""
+import argparse
+import json
+import random
+from itertools import accumulate
+from collections import Counter, defaultdict
+
+SEED_FILES = ("orders.json", "user_orders.json")
+# 用户 id 服从 Zipf 分布：第 i 个用户的权重为 1 / i^s
+USER_ZIPF_EXPONENT = 1.2
+
+class OrderGenerator:
+    """以种子商单的角色、分类分布和各分类下的标题、详情片段为素材生成商单
+
+    每个分类下的标题由两个种子标题拼接而成，详情从该分类的详情行中抽取 2~4 行；
+    用户 id 在 1..users 上服从 Zipf 分布，少数用户拥有大量商单。相同 seed 总是生成相同的数据。
+    """
+
+    def __init__(self, seed_orders, seed=42, users=None):
+        self.random = random.Random(seed)
+        self.users = users
+        roles = Counter()
+        classifications = Counter()
+        self.titles = defaultdict(list)
+        self.detail_lines = defaultdict(list)
+        for order in seed_orders:
+            role = order.get("Corresponding role") or ""
+            classification = order.get("Classification of wishes") or ""
+            roles[role] += 1
+            classifications[classification] += 1
+            if order.get("Wish title"):
+                self.titles[classification].append(order["Wish title"])
+            for line in (order.get("Details of the wish") or "").split("\n"):
+                if line.strip():
+                    self.detail_lines[classification].append(line.strip())
+        if not classifications:
+            raise ValueError("No seed orders to learn distributions from")
+        self.roles, self.role_weights = zip(*roles.items())
+        self.classifications, self.classification_weights = zip(*classifications.items())
+
+    @classmethod
+    def from_files(cls, json_files=SEED_FILES, **kwargs):
+        seed_orders = []
+        for json_file in json_files:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                seed_orders.extend(json.load(f))
+        return cls(seed_orders, **kwargs)
+
+    def _title(self, classification, index):
+        titles = self.titles.get(classification) or [classification]
+        first, second = self.random.choice(titles), self.random.choice(titles)
+        half = len(second) // 2
+        # 序号保证 (user_id, 标题) 唯一
+        return f"{first[:max(len(first) // 2, 1)]}{second[half:]}-{index}"
+
+    def _details(self, classification):
+        lines = self.detail_lines.get(classification) or [classification]
+        return "\n".join(self.random.choice(lines) for _ in range(self.random.randint(2, 4)))
+
+    def generate(self, count):
+        """逐条生成 count 条商单"""
+        users = self.users or max(count // 5, 1)
+        user_ids = range(1, users + 1)
+        user_weights = list(accumulate(1.0 / i ** USER_ZIPF_EXPONENT for i in user_ids))
+        for index in range(count):
+            classification = self.random.choices(self.classifications, self.classification_weights)[0]
+            yield {
+                "user_id": str(self.random.choices(user_ids, cum_weights=user_weights)[0]),
+                "Corresponding role": self.random.choices(self.roles, self.role_weights)[0],
+                "Classification of wishes": classification,
+                "Wish title": self._title(classification, index),
+                "Details of the wish": self._details(classification)
+            }
+
+def write_orders(orders, output_file):
+    """以 JSON 数组格式流式写出商单，返回写出的条数"""
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("[\n")
+        for order in orders:
+            if count:
+                f.write(",\n")
+            f.write(json.dumps(order, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成商单数据")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--output", default="synthetic_orders.json")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=None, help="用户数，默认为商单数的 1/5")
+    args = parser.parse_args()
+
+    generator = OrderGenerator.from_files(seed=args.seed, users=args.users)
+    count = write_orders(generator.generate(args.count), args.output)
+    print(f"Wrote {count} orders to {args.output}")
+
+if __name__ == '__main__':
+    main()
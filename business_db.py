@@ -1,12 +1,71 @@
 import sqlite3
 import json
+import re
+import time
 from datetime import datetime
 import logging
+from order_record import OrderRecord
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 中文按单字写入索引、按相邻二字短语检索，英文和数字按词切分，用于 FTS5 关键词检索
+_FTS_TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]+|[0-9A-Za-z]+')
+
+def cjk_ngrams(text, n=2):
+    """将文本切分为检索词：中文连续片段取字符 n 元组，英文/数字取小写单词"""
+    tokens = []
+    for run in _FTS_TOKEN_RE.findall(text or ''):
+        if run.isascii():
+            tokens.append(run.lower())
+        elif len(run) <= n:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+def fts_terms(text):
+    """生成写入 FTS 索引的内容：中文逐字以空格分隔，英文/数字取小写单词
+
+    索引只存单字，二元组查询以相邻单字短语匹配，索引体积和写入量约为同时存单字和二元组的一半，
+    单字查询也能直接命中。
+    """
+    return ' '.join(run.lower() if run.isascii() else ' '.join(run) for run in _FTS_TOKEN_RE.findall(text or ''))
+
+def _fts_match(query):
+    """将查询切分为检索词并拼成 FTS5 MATCH 表达式（各词之间为 OR），无检索词时返回 None"""
+    phrases = []
+    for token in dict.fromkeys(cjk_ngrams(query)):
+        # 中文二元组对应索引中相邻的两个单字
+        phrases.append(f'"{token}"' if token.isascii() else f'"{" ".join(token)}"')
+    return ' OR '.join(phrases) or None
+
+_CREATE_FTS_TABLE = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS business_orders_fts
+    USING fts5(wish_title, wish_details, tokenize='unicode61')
+'''
+
+def _connect(db_path="user.db"):
+    """打开数据库连接，并注册同步全文索引所需的 fts_terms() 函数"""
+    conn = sqlite3.connect(db_path)
+    conn.create_function("fts_terms", 1, fts_terms, deterministic=True)
+    return conn
+
+def _sync_fts(c):
+    """将待同步队列中的商单写入 FTS 索引，检索词取自 business_orders 中的当前内容
+
+    队列由 business_orders 上的触发器在插入或修改标题/详情时写入，只包含确实发生变化的商单；
+    调用方负责提交事务。
+    """
+    c.execute('''
+        INSERT OR REPLACE INTO business_orders_fts (rowid, wish_title, wish_details)
+        SELECT o.id, fts_terms(o.wish_title), fts_terms(o.wish_details)
+        FROM business_orders_fts_pending p
+        JOIN business_orders o ON o.id = p.id
+    ''')
+    c.execute('DELETE FROM business_orders_fts_pending')
+
 def init_business_db():
     """初始化商单相关的数据库表"""
     try:
@@ -22,34 +81,122 @@ def init_business_db():
                 classification TEXT NOT NULL,
                 wish_title TEXT NOT NULL,
                 wish_details TEXT NOT NULL,
+                search_only INTEGER NOT NULL DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # search_only = 1 的商单只来自向量库语料（orders.json），仅用于关键词检索，不出现在商单列表中
+        c.execute('PRAGMA table_info(business_orders)')
+        if 'search_only' not in [column[1] for column in c.fetchall()]:
+            c.execute('ALTER TABLE business_orders ADD COLUMN search_only INTEGER NOT NULL DEFAULT 0')
+        
+        # 为 (user_id, wish_title) 建立唯一索引，保证重复加载商单时幂等
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_business_orders_user_title'")
+        if c.fetchone() is None:
+            # 清理历史遗留的重复商单（保留最早的一条），否则无法建立唯一索引
+            c.execute('''
+                DELETE FROM business_orders
+                WHERE id NOT IN (
+                    SELECT MIN(id) FROM business_orders GROUP BY user_id, wish_title
+                )
+            ''')
+            if c.rowcount:
+                logger.info(f"Removed {c.rowcount} duplicate business orders")
+            c.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_business_orders_user_title
+                ON business_orders (user_id, wish_title)
+            ''')
+        
+        # 向量索引发件箱：与商单在同一事务中写入，由后台任务批量写入向量库
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS vector_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_vector_outbox_status ON vector_outbox (status, id)')
+        
+        # 标题和详情的全文索引（内容为 fts_terms() 切分好的检索词）
+        c.execute(_CREATE_FTS_TABLE)
+        
+        # 待同步到全文索引的商单 id，由触发器在插入或修改标题/详情时写入
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'business_orders_fts_pending'")
+        upgrading = c.fetchone() is None
+        c.execute('CREATE TABLE IF NOT EXISTS business_orders_fts_pending (id INTEGER PRIMARY KEY)')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS business_orders_fts_insert AFTER INSERT ON business_orders
+            BEGIN
+                INSERT OR IGNORE INTO business_orders_fts_pending (id) VALUES (new.id);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS business_orders_fts_update
+            AFTER UPDATE OF wish_title, wish_details ON business_orders
+            BEGIN
+                INSERT OR IGNORE INTO business_orders_fts_pending (id) VALUES (new.id);
+            END
+        ''')
+        
         conn.commit()
+        
+        # 旧版本的索引按二元组存储，升级时或索引条数与商单不一致时全量重建；
+        # 否则只补齐上次异常退出时遗留的待同步商单
+        c.execute('SELECT (SELECT COUNT(*) FROM business_orders_fts), (SELECT COUNT(*) FROM business_orders)')
+        fts_count, order_count = c.fetchone()
         conn.close()
+        if upgrading or fts_count != order_count:
+            rebuild_business_orders_fts()
+        else:
+            sync_business_orders_fts()
         logger.info("Business database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing business database: {str(e)}")
 
-def save_business_order(order_data):
-    """保存商单信息到数据库"""
+def save_business_order(order_data, enqueue_vector=False):
+    """保存商单信息到数据库
+
+    enqueue_vector 为 True 时，在同一事务中写入向量索引发件箱，由后台任务异步写入向量库；
+    重复提交内容未变化的商单不会产生发件箱记录。
+    """
     try:
-        conn = sqlite3.connect("user.db")
+        record = OrderRecord.from_dict(order_data)
+        row = record.to_row()
+        conn = _connect()
         c = conn.cursor()
         
+        # 同一用户重复提交同名商单时更新原记录，而不是插入重复行；内容未变化时不做任何修改。
+        # 提交与仅用于检索的语料商单同名时，该商单转为正式商单
         c.execute('''
             INSERT INTO business_orders 
             (user_id, corresponding_role, classification, wish_title, wish_details)
             VALUES (?, ?, ?, ?, ?)
-        ''', (
-            order_data['user_id'],
-            order_data['Corresponding role'],
-            order_data['Classification of wishes'],
-            order_data['Wish title'],
-            order_data['Details of the wish']
-        ))
+            ON CONFLICT (user_id, wish_title) DO UPDATE SET
+                corresponding_role = excluded.corresponding_role,
+                classification = excluded.classification,
+                wish_details = excluded.wish_details,
+                search_only = 0,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE corresponding_role IS NOT excluded.corresponding_role
+               OR classification IS NOT excluded.classification
+               OR wish_details IS NOT excluded.wish_details
+               OR search_only = 1
+        ''', row)
+        changed = c.rowcount > 0
+        if changed:
+            _sync_fts(c)
+        if enqueue_vector and changed:
+            # 发件箱中保存规范字段名的商单
+            c.execute(
+                'INSERT INTO vector_outbox (payload) VALUES (?)',
+                (json.dumps(record.to_dict(), ensure_ascii=False),)
+            )
         
         conn.commit()
         conn.close()
@@ -58,13 +205,16 @@ def save_business_order(order_data):
         logger.error(f"Error saving business order: {str(e)}")
         return False
 
+# 商单列表返回的字段（不含内部使用的 search_only）
+_LISTED_COLUMNS = "id, user_id, corresponding_role, classification, wish_title, wish_details, created_at, updated_at"
+
 def get_all_business_orders():
     """获取所有商单信息"""
     try:
         conn = sqlite3.connect("user.db")
         c = conn.cursor()
         
-        c.execute('SELECT * FROM business_orders ORDER BY created_at DESC')
+        c.execute(f'SELECT {_LISTED_COLUMNS} FROM business_orders WHERE search_only = 0 ORDER BY created_at DESC')
         orders = c.fetchall()
         
         # 将查询结果转换为字典列表
@@ -86,7 +236,11 @@ def get_business_orders_by_user(user_id):
         conn = sqlite3.connect("user.db")
         c = conn.cursor()
         
-        c.execute('SELECT * FROM business_orders WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+        c.execute(f'''
+            SELECT {_LISTED_COLUMNS} FROM business_orders
+            WHERE user_id = ? AND search_only = 0
+            ORDER BY created_at DESC
+        ''', (user_id,))
         orders = c.fetchall()
         
         # 将查询结果转换为字典列表
@@ -102,32 +256,287 @@ def get_business_orders_by_user(user_id):
         logger.error(f"Error getting business orders for user {user_id}: {str(e)}")
         return []
 
-def load_orders_from_json(json_file="user_orders.json"):
-    """从JSON文件加载商单数据到数据库"""
+def fetch_outbox_batch(limit=32):
+    """获取一批待写入向量库的发件箱记录，返回 (id, 商单, 已尝试次数) 列表"""
     try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            orders = json.load(f)
-            
         conn = sqlite3.connect("user.db")
         c = conn.cursor()
-        
-        for order in orders:
-            c.execute('''
-                INSERT INTO business_orders 
-                (user_id, corresponding_role, classification, wish_title, wish_details)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                order['user_id'],
-                order['Corresponding role'],
-                order['Classification of wishes'],
-                order['Wish title'],
-                order['Details of the wish']
-            ))
-        
+        c.execute('''
+            SELECT id, payload, attempts FROM vector_outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?
+        ''', (time.time(), limit))
+        entries = [(entry_id, json.loads(payload), attempts) for entry_id, payload, attempts in c.fetchall()]
+        conn.close()
+        return entries
+    except Exception as e:
+        logger.error(f"Error fetching vector outbox: {str(e)}")
+        return []
+
+def complete_outbox_entries(entry_ids):
+    """删除已成功写入向量库的发件箱记录"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        c.executemany('DELETE FROM vector_outbox WHERE id = ?', [(entry_id,) for entry_id in entry_ids])
         conn.commit()
         conn.close()
-        logger.info(f"Successfully loaded orders from {json_file}")
         return True
     except Exception as e:
-        logger.error(f"Error loading orders from JSON: {str(e)}")
-        return False 
\ No newline at end of file
+        logger.error(f"Error completing vector outbox entries: {str(e)}")
+        return False
+
+def fail_outbox_entries(entry_ids, error, max_attempts=5, retry_backoff=2.0):
+    """记录写入失败，按指数退避安排重试；超过最大次数后标记为 failed"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        c.executemany('''
+            UPDATE vector_outbox SET
+                attempts = attempts + 1,
+                last_error = ?,
+                next_attempt_at = ? * (1 << MIN(attempts, 10)) + ?,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+            WHERE id = ?
+        ''', [(error, retry_backoff, time.time(), max_attempts, entry_id) for entry_id in entry_ids])
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error recording vector outbox failure: {str(e)}")
+        return False
+
+def get_outbox_stats():
+    """统计发件箱积压情况：待处理/失败数量及最早待处理记录的延迟（秒）"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        c.execute('''
+            SELECT
+                SUM(status = 'pending'),
+                SUM(status = 'failed'),
+                (julianday('now') - julianday(MIN(CASE WHEN status = 'pending' THEN created_at END))) * 86400
+            FROM vector_outbox
+        ''')
+        pending, failed, lag = c.fetchone()
+        conn.close()
+        return {
+            "pending": pending or 0,
+            "failed": failed or 0,
+            "lag_seconds": round(lag, 3) if lag is not None else 0.0
+        }
+    except Exception as e:
+        logger.error(f"Error getting vector outbox stats: {str(e)}")
+        return None
+
+def rebuild_business_orders_fts():
+    """根据 business_orders 全量重建全文索引"""
+    try:
+        conn = _connect()
+        c = conn.cursor()
+        # 删除并重建索引表，比逐行删除旧索引内容快得多
+        c.execute('DROP TABLE IF EXISTS business_orders_fts')
+        c.execute(_CREATE_FTS_TABLE)
+        c.execute('''
+            INSERT INTO business_orders_fts (rowid, wish_title, wish_details)
+            SELECT id, fts_terms(wish_title), fts_terms(wish_details) FROM business_orders
+        ''')
+        c.execute('DELETE FROM business_orders_fts_pending')
+        conn.commit()
+        conn.close()
+        logger.info("Rebuilt business order full-text index")
+        return True
+    except Exception as e:
+        logger.error(f"Error rebuilding business order full-text index: {str(e)}")
+        return False
+
+def sync_business_orders_fts(db_path="user.db"):
+    """将待同步队列中的商单写入全文索引"""
+    try:
+        conn = _connect(db_path)
+        _sync_fts(conn.cursor())
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error syncing business order full-text index: {str(e)}")
+        return False
+
+def search_business_orders_fts(query, limit=50):
+    """使用 FTS5 关键词检索商单，按 BM25 相关度排序（bm25 越小越相关），返回 OrderRecord 列表
+
+    中文按相邻二字短语匹配，单字查询直接匹配单字；结果包含仅用于检索的语料商单。
+    """
+    match = _fts_match(query)
+    if match is None:
+        return []
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        
+        c.execute('''
+            SELECT o.user_id, o.wish_title, o.corresponding_role, o.classification, o.wish_details
+            FROM business_orders_fts
+            JOIN business_orders o ON o.id = business_orders_fts.rowid
+            WHERE business_orders_fts MATCH ?
+            ORDER BY bm25(business_orders_fts)
+            LIMIT ?
+        ''', (match, limit))
+        orders_list = [OrderRecord(*row) for row in c.fetchall()]
+        
+        conn.close()
+        return orders_list
+    except Exception as e:
+        logger.error(f"Error searching business orders: {str(e)}")
+        return []
+
+def iter_orders_from_json(json_file, chunk_size=1 << 20):
+    """流式读取JSON数组（或每行一个对象的JSON Lines）中的商单，避免一次性载入整个文件"""
+    decoder = json.JSONDecoder()
+    with open(json_file, 'r', encoding='utf-8-sig') as f:
+        buf = ''
+        pos = 0
+        eof = False
+        in_array = None
+        while True:
+            # 跳过空白和分隔符，必要时继续读取
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    if in_array:
+                        # 文件在数组闭合前结束，通常是写入被截断
+                        raise json.JSONDecodeError("Unterminated JSON array: expecting ']'", buf, len(buf))
+                    break
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            if in_array is None:
+                in_array = buf[pos] == '['
+                if in_array:
+                    pos += 1
+                    continue
+            if in_array and buf[pos] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # 记录跨越了缓冲区边界，读入下一块后重试
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            pos = end
+            yield record
+
+def bulk_load_orders(orders, batch_size=5000, on_conflict="update", db_path="user.db", search_only=False):
+    """批量幂等写入商单
+
+    以 executemany 分批写入，每批一个事务；已存在的 (user_id, wish_title)
+    在 on_conflict="update" 时更新有变化的字段，在 on_conflict="ignore" 时跳过。
+    search_only=True 时写入的新商单只用于关键词检索，不出现在商单列表中，此时只能使用 "ignore"，
+    不会覆盖已有商单。全文索引在全部批次写入后一次性同步，只包含实际插入或更新的商单。
+    返回 inserted/updated/skipped 计数以及耗时和吞吐量。
+    """
+    if on_conflict not in ("update", "ignore"):
+        raise ValueError(f"Unsupported on_conflict mode: {on_conflict}")
+    if search_only and on_conflict != "ignore":
+        raise ValueError("search_only loads must use on_conflict='ignore'")
+
+    stats = {"inserted": 0, "updated": 0, "skipped": 0, "invalid": 0, "total": 0}
+    start = time.perf_counter()
+    conn = _connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        c = conn.cursor()
+        # 正式导入时，同名的检索语料商单转为正式商单
+        promote = not search_only and c.execute(
+            'SELECT EXISTS (SELECT 1 FROM business_orders WHERE search_only = 1)'
+        ).fetchone()[0]
+
+        def flush(rows):
+            # rowcount 只统计语句本身修改的行，不含触发器写入的待同步记录
+            c.executemany('''
+                INSERT INTO business_orders
+                (user_id, corresponding_role, classification, wish_title, wish_details, search_only)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, wish_title) DO NOTHING
+            ''', [row + (int(search_only),) for row in rows])
+            inserted = c.rowcount
+            updated = 0
+            if on_conflict == "update":
+                # 只更新内容确实发生变化的记录，刚插入的行不会被计入
+                c.executemany('''
+                    UPDATE business_orders SET
+                        corresponding_role = ?2,
+                        classification = ?3,
+                        wish_details = ?5,
+                        search_only = 0,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ?1 AND wish_title = ?4
+                      AND (corresponding_role IS NOT ?2
+                           OR classification IS NOT ?3
+                           OR wish_details IS NOT ?5
+                           OR search_only = 1)
+                ''', rows)
+                updated = c.rowcount
+            elif promote:
+                c.executemany(
+                    'UPDATE business_orders SET search_only = 0 WHERE user_id = ? AND wish_title = ? AND search_only = 1',
+                    [(row[0], row[3]) for row in rows]
+                )
+            conn.commit()
+            stats["inserted"] += inserted
+            stats["updated"] += updated
+            stats["skipped"] += len(rows) - inserted - updated
+
+        batch = []
+        for order in orders:
+            stats["total"] += 1
+            try:
+                batch.append(OrderRecord.from_dict(order).to_row())
+            except (KeyError, TypeError):
+                stats["invalid"] += 1
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        # 触发器已记录本次插入或修改的商单；中途失败时队列保留，下次同步或启动时补齐
+        if stats["inserted"] or stats["updated"]:
+            _sync_fts(c)
+            conn.commit()
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["total"] / elapsed, 1) if elapsed > 0 else 0.0
+    return stats
+
+def bulk_load_orders_from_json(json_file="user_orders.json", batch_size=5000, on_conflict="update"):
+    """从JSON文件流式批量加载商单，返回统计信息；失败时返回 None"""
+    try:
+        stats = bulk_load_orders(iter_orders_from_json(json_file), batch_size=batch_size, on_conflict=on_conflict)
+        logger.info(
+            f"Loaded orders from {json_file}: inserted={stats['inserted']}, updated={stats['updated']}, "
+            f"skipped={stats['skipped']}, invalid={stats['invalid']}, "
+            f"{stats['rows_per_second']} rows/s in {stats['elapsed_seconds']}s"
+        )
+        return stats
+    except Exception as e:
+        logger.error(f"Error bulk loading orders from {json_file}: {str(e)}")
+        return None
+
+def load_orders_from_json(json_file="user_orders.json"):
+    """从JSON文件加载商单数据到数据库"""
+    return bulk_load_orders_from_json(json_file) is not None
@@ -1,72 +1,225 @@
 import chromadb
 from chromadb.config import Settings
+import hashlib
+import heapq
 import json
 import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import List, Dict, Any, Tuple
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import traceback
 from my_qianfan_llm import llm  # 导入千帆模型
+from business_db import search_business_orders_fts, bulk_load_orders
+from near_duplicates import NearDuplicateIndex, first_per_cluster
+from order_record import OrderRecord
+from index_snapshot import SNAPSHOT_DIR, write_snapshot, import_snapshot
+import metrics
 
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-FIELD_MAP = {
-    "user_id": ["user_id", "User ID"],
-    "wish_title": ["wish_title", "Wish title"],
-    "corresponding_role": ["corresponding_role", "Corresponding role"],
-    "classification": ["classification", "Classification of wishes"],
-    "wish_details": ["wish_details", "Details of the wish"],
-}
+VECTOR_DB_PATH = "business_vector_db"
+MODEL_PATH = "./text2vec-large-chinese"
+DEFAULT_COLLECTION = "business_orders"
+# 记录当前提供服务的集合名称，重启后沿用重建后的集合
+ACTIVE_COLLECTION_FILE = os.path.join(VECTOR_DB_PATH, "active_collection.json")
+# 向量库初始化时依次加载的商单文件
+ORDER_JSON_FILES = ("orders.json", "user_orders.json")
 
-def _get_field(order, key):
-    for k in FIELD_MAP.get(key, [key]):
-        if k in order:
-            return order[k]
-    return None
+# 检索模式：纯向量检索，或 BM25 关键词检索与向量检索的混合
+SEARCH_MODES = ("vector", "hybrid")
+# 倒数排名融合 (RRF) 的平滑常数
+RRF_K = 60
+
+# 分片模式：按分类（每个分类一个集合）或按商单哈希分布到固定数量的集合；未设置时使用单个集合
+SHARD_MODES = ("classification", "hash")
+VECTOR_SHARD_MODE = os.getenv("VECTOR_SHARD_MODE") or None
+VECTOR_SHARDS = int(os.getenv("VECTOR_SHARDS", "8"))
+# 配置错误时在导入阶段退回单个集合，而不是让向量库初始化失败
+if VECTOR_SHARD_MODE and VECTOR_SHARD_MODE not in SHARD_MODES:
+    logger.warning(f"Unsupported VECTOR_SHARD_MODE {VECTOR_SHARD_MODE!r} (expected one of {SHARD_MODES}), "
+                   f"using a single collection")
+    VECTOR_SHARD_MODE = None
+if VECTOR_SHARDS < 1:
+    logger.warning(f"Invalid VECTOR_SHARDS {VECTOR_SHARDS}, using 8")
+    VECTOR_SHARDS = 8
+
+def _classification_where(classification: str) -> Dict[str, Any]:
+    # 同时匹配旧版集合中按原始字段名存储的元数据，重建索引后只剩规范字段名
+    return {"$or": [{"Classification of wishes": classification}, {"classification": classification}]}
+
+def _new_ids(n: int) -> List[str]:
+    """新记录的 ID；按商单更新会删除旧记录，不能再以集合大小作为起始 ID"""
+    return [uuid.uuid4().hex for _ in range(n)]
+
+def _key_where(record: OrderRecord) -> Dict[str, Any]:
+    """匹配同一商单 (user_id, wish_title) 的元数据，兼容旧版集合中的原始字段名"""
+    return {"$and": [
+        {"user_id": record.user_id},
+        {"$or": [{"wish_title": record.wish_title}, {"Wish title": record.wish_title}]}
+    ]}
+
+def _and_where(*clauses) -> Dict[str, Any]:
+    clauses = [clause for clause in clauses if clause]
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
 
 class BusinessVectorDB:
-    def __init__(self, collection_name: str = "business_orders"):
-        """初始化向量数据库"""
-        self.client = chromadb.PersistentClient(path="business_vector_db")
+    def __init__(self, collection_name: str = DEFAULT_COLLECTION, model: SentenceTransformer = None,
+                 client=None, embedding_cache: Dict[str, List[float]] = None):
+        """初始化向量数据库
+
+        重建索引时可传入已加载的 model/client 以及 {文本: 向量} 缓存，避免重复加载模型和重复编码。
+        未传入 model 时在首次编码时才加载，从快照导入等不需要编码的场景不加载模型。
+        """
+        self.client = client or chromadb.PersistentClient(path=VECTOR_DB_PATH)
         self.collection_name = collection_name
-        self.model = SentenceTransformer('./text2vec-large-chinese')
-        
+        self._model = model
+        self._model_lock = threading.Lock()
+        # 导入快照时记录的向量维度，在模型加载时核对
+        self._expected_dimension = None
+        self.embedding_cache = embedding_cache
+        # 近似重复检测索引，首次写入时由集合中已有的商单构建
+        self.duplicates = None
+        self._duplicates_lock = threading.Lock()
+        self._open_collections()
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """编码模型，首次使用时加载"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    model = SentenceTransformer(MODEL_PATH)
+                    self._check_dimension(model, self._expected_dimension)
+                    self._model = model
+        return self._model
+
+    @staticmethod
+    def _check_dimension(model, dimension):
+        if dimension is not None and int(model.get_sentence_embedding_dimension()) != dimension:
+            raise ValueError(f"Model {MODEL_PATH} produces vectors of dimension "
+                             f"{model.get_sentence_embedding_dimension()}, collection expects {dimension}")
+
+    def expect_dimension(self, dimension: int):
+        """登记集合中已有向量的维度；模型已加载时立即核对，否则在首次加载模型时核对，不为此提前加载模型"""
+        with self._model_lock:
+            if self._model is not None:
+                self._check_dimension(self._model, dimension)
+            self._expected_dimension = dimension
+
+    def _open_collections(self):
         try:
-            self.collection = self.client.get_collection(name=collection_name)
+            self.collection = self.client.get_collection(name=self.collection_name)
         except:
-            self.collection = self.client.create_collection(name=collection_name)
-            logger.info(f"Created new collection: {collection_name}")
+            self.collection = self.client.create_collection(name=self.collection_name)
+            logger.info(f"Created new collection: {self.collection_name}")
+
+    def count(self) -> int:
+        """集合中的商单数量"""
+        return self.collection.count()
+
+    def drop(self):
+        """删除集合"""
+        self.client.delete_collection(self.collection_name)
+
+    def _stored_entries(self) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """集合中全部记录的 (文本, 元数据)"""
+        results = self.collection.get(include=["documents", "metadatas"])
+        return results["documents"] or [], results["metadatas"] or []
+
+    def _duplicate_index(self) -> NearDuplicateIndex:
+        """近似重复检测索引；已持久化在元数据中的规范 id 直接沿用"""
+        if self.duplicates is None:
+            with self._duplicates_lock:
+                if self.duplicates is None:
+                    index = NearDuplicateIndex()
+                    for document, metadata in zip(*self._stored_entries()):
+                        record = OrderRecord.from_metadata(metadata)
+                        index.add(record.key, document, canonical=record.canonical_id)
+                    logger.info(f"Built near-duplicate index for {self.collection_name}: {index.stats()}")
+                    self.duplicates = index
+        return self.duplicates
+
+    def _assign_canonical_ids(self, records: List[OrderRecord], texts: List[str]):
+        """为待写入的商单查找近似重复，记录所属簇的规范 id（随元数据一起存储）"""
+        index = self._duplicate_index()
+        for record, text in zip(records, texts):
+            record.canonical_id = index.add(record.key, text, canonical=record.canonical_id)
+
+    def _canonical_key(self, record: OrderRecord) -> str:
+        if record.canonical_id:
+            return record.canonical_id
+        return self.duplicates.canonical_of(record.key) if self.duplicates is not None else record.key
+
+    def _fetch_size(self, n_results: int) -> int:
+        """存在近似重复时多取一些候选，折叠重复后仍能凑满 n_results"""
+        if self.duplicates is not None and self.duplicates.duplicates:
+            return n_results + (n_results + 1) // 2
+        return n_results
+
+    def _collapse_duplicates(self, orders: List[OrderRecord], n_results: int,
+                             exclude_user_id: str = None) -> List[OrderRecord]:
+        """同一簇的商单只保留排名最靠前的一条
+
+        exclude_user_id 的商单在折叠前排除，不会挤掉同簇中其他用户的近似重复商单。
+        """
+        skip = None
+        if exclude_user_id is not None:
+            skip = lambda order: str(order.user_id) == str(exclude_user_id)
+        return first_per_cluster(orders, self._canonical_key, limit=n_results, skip=skip)
+
+    def duplicate_stats(self) -> Dict[str, Any]:
+        return self.duplicates.stats() if self.duplicates is not None else {"orders": 0, "duplicates": 0}
 
     def _get_embedding(self, text: str) -> List[float]:
         """获取文本的向量表示"""
-        return self.model.encode(text).tolist()
+        with metrics.timed("embedding"):
+            return self.model.encode(text).tolist()
 
-    def _prepare_order_text(self, order: Dict[str, Any]) -> str:
+    def _encode_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量获取文本向量，命中缓存的文本不再重复编码"""
+        cache = self.embedding_cache if self.embedding_cache is not None else {}
+        missing = [text for text in dict.fromkeys(texts) if text not in cache]
+        if missing:
+            with metrics.timed("embedding_batch"):
+                vectors = self.model.encode(missing, batch_size=32)
+            embeddings = dict(zip(missing, (vector.tolist() for vector in vectors)))
+            if self.embedding_cache is not None:
+                self.embedding_cache.update(embeddings)
+        else:
+            embeddings = {}
+        return [embeddings[text] if text in embeddings else cache[text] for text in texts]
+
+    def _prepare_order_text(self, order: OrderRecord) -> str:
         """将商单信息转换为文本格式"""
         text_parts = []
         
         # 角色信息（如果有）
-        role = _get_field(order, 'corresponding_role')
-        if role:
-            text_parts.append(f"角色: {role}")
+        if order.corresponding_role:
+            text_parts.append(f"角色: {order.corresponding_role}")
         
         # 分类信息（如果有）
-        classification = _get_field(order, 'classification')
-        if classification:
-            text_parts.append(f"分类: {classification}")
+        if order.classification:
+            text_parts.append(f"分类: {order.classification}")
         
         # 标题信息（如果有）
-        title = _get_field(order, 'wish_title')
-        if title:
-            text_parts.append(f"标题: {title}")
+        if order.wish_title:
+            text_parts.append(f"标题: {order.wish_title}")
         
         # 详情信息（如果有）
-        details = _get_field(order, 'wish_details')
-        if details:
-            text_parts.append(f"详情: {details}")
+        if order.wish_details:
+            text_parts.append(f"详情: {order.wish_details}")
         
         return "\n".join(text_parts)
 
@@ -80,7 +233,7 @@ class BusinessVectorDB:
         3. 优先推荐与该角色核心业务相关的商单
         """
 
-    def _analyze_with_llm(self, role: str, orders: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], float]]:
+    def _analyze_with_llm(self, role: str, orders: List[OrderRecord]) -> List[Tuple[OrderRecord, float]]:
         """使用千帆模型分析商单并返回带权重的商单列表"""
         try:
             # 准备提示词
@@ -93,7 +246,7 @@ class BusinessVectorDB:
             4. 发展潜力：该商单对{role}未来发展的潜在价值
 
             商单列表：
-            {json.dumps(orders, ensure_ascii=False, indent=2)}
+            {json.dumps([dict(order.to_dict(), order_id=order.key) for order in orders], ensure_ascii=False, indent=2)}
 
             请以JSON格式返回分析结果，格式如下：
             {{
@@ -108,7 +261,8 @@ class BusinessVectorDB:
             """
 
             # 调用千帆模型
-            response = llm.invoke(prompt)
+            with metrics.timed("llm_rerank"):
+                response = llm.invoke(prompt)
             
             # 解析响应
             analysis = json.loads(response)
@@ -116,27 +270,27 @@ class BusinessVectorDB:
             # 将分析结果与原始商单合并
             scored_orders = []
             for item in analysis["analysis"]:
-                order = next((o for o in orders if str(o.get("id", "")) == item["order_id"]), None)
+                order = next((o for o in orders if o.key == item["order_id"]), None)
                 if order:
                     scored_orders.append((order, item["score"]))
             
             return scored_orders
         except Exception as e:
             logger.error(f"Error in LLM analysis: {str(e)}")
+            metrics.LLM_FALLBACKS.inc(operation="analyze_orders")
             return [(order, 0.5) for order in orders]  # 发生错误时返回默认分数
 
     def add_orders(self, orders: List[Dict[str, Any]]):
-        """添加商单到向量数据库"""
+        """添加商单到向量数据库（商单字典或 OrderRecord）"""
         try:
-            # 获取当前集合中的最大ID
-            current_ids = self.collection.get()['ids']
-            start_id = len(current_ids) if current_ids else 0
-            
             # 准备数据
-            ids = [str(i + start_id) for i in range(len(orders))]
-            texts = [self._prepare_order_text(order) for order in orders]
-            embeddings = [self._get_embedding(text) for text in texts]
-            metadatas = orders  # 存储完整的商单信息
+            records = [OrderRecord.from_dict(order) for order in orders]
+            ids = _new_ids(len(records))
+            texts = [self._prepare_order_text(record) for record in records]
+            embeddings = self._encode_texts(texts)
+            # 以规范字段名存储商单信息以及近似重复簇的规范 id
+            self._assign_canonical_ids(records, texts)
+            metadatas = [record.to_metadata() for record in records]
 
             # 添加到集合
             self.collection.add(
@@ -149,45 +303,127 @@ class BusinessVectorDB:
             return True
         except Exception as e:
             logger.error(f"Error adding orders to vector database: {str(e)}")
+            # 写入失败的商单已登记到近似重复索引，下次写入时按集合内容重建
+            self.duplicates = None
+            return False
+
+    def _delete_orders(self, records: List[OrderRecord]):
+        for record in records:
+            self.collection.delete(where=_key_where(record))
+
+    def upsert_orders(self, orders: List[Dict[str, Any]]):
+        """按 (user_id, wish_title) 写入商单：已存在的商单先删除旧记录，避免同一商单出现多条向量"""
+        try:
+            # 同一批中重复出现的商单只保留最后一次的内容
+            records = list({record.key: record for record in map(OrderRecord.from_dict, orders)}.values())
+            # 内容可能已修改，按新内容重新归簇，不沿用传入的规范 id
+            for record in records:
+                record.canonical_id = None
+            self._delete_orders(records)
+        except Exception as e:
+            logger.error(f"Error deleting existing orders from vector database: {str(e)}")
             return False
+        return self.add_orders(records)
+
+    def _vector_candidates(self, query_text: str, n_results: int, where: Dict[str, Any] = None,
+                           classification: str = None, exclude_user_id: str = None) -> List[OrderRecord]:
+        """按向量相似度检索候选商单，可限定分类、排除指定用户的商单"""
+        query_embedding = self._get_embedding(query_text)
+        if classification:
+            where = _and_where(where, _classification_where(classification))
+        with metrics.timed("vector_query"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=self._fetch_size(n_results),
+                where=where
+            )
+        metadatas = results['metadatas'][0] if results and results['metadatas'] else []
+        return self._collapse_duplicates([OrderRecord.from_metadata(metadata) for metadata in metadatas], n_results,
+                                         exclude_user_id=exclude_user_id)
+
+    def _hybrid_candidates(self, query_text: str, keyword_text: str, n_results: int,
+                           prefilter: bool = False, classification: str = None,
+                           exclude_user_id: str = None) -> List[OrderRecord]:
+        """融合 BM25 关键词检索与向量检索的结果（倒数排名融合）
+
+        prefilter 为 True 且关键词命中足够多时，只对关键词候选做向量打分。
+        """
+        with metrics.timed("keyword_query"):
+            keyword_hits = search_business_orders_fts(keyword_text, limit=n_results * 4)
+        if classification:
+            keyword_hits = [hit for hit in keyword_hits if hit.classification == classification]
+        if exclude_user_id is not None:
+            keyword_hits = [hit for hit in keyword_hits if str(hit.user_id) != str(exclude_user_id)]
+        where = None
+        if prefilter and len(keyword_hits) >= n_results:
+            titles = list({hit.wish_title for hit in keyword_hits})
+            where = {"$or": [{"Wish title": {"$in": titles}}, {"wish_title": {"$in": titles}}]}
+        vector_hits = self._vector_candidates(query_text, n_results if where is None else len(keyword_hits), where,
+                                              classification=classification, exclude_user_id=exclude_user_id)
+
+        scores = {}
+        orders_by_key = {}
+        for hits in (vector_hits, keyword_hits):
+            for rank, hit in enumerate(hits):
+                # 同一近似重复簇的商单合并计分
+                key = self._canonical_key(hit)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+                # 优先保留向量库中的元数据
+                orders_by_key.setdefault(key, hit)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:n_results]
+        return [orders_by_key[key] for key in ranked]
+
+    def search_orders(self, query: str, n_results: int = 5, mode: str = "hybrid",
+                      prefilter: bool = False, classification: str = None) -> List[OrderRecord]:
+        """按自由文本检索商单，可限定分类"""
+        try:
+            if mode == "hybrid":
+                return self._hybrid_candidates(query, query, n_results, prefilter=prefilter,
+                                               classification=classification)
+            return self._vector_candidates(query, n_results, classification=classification)
+        except Exception as e:
+            logger.error(f"Error searching orders: {str(e)}")
+            return []
 
-    def find_similar_orders(self, order: Dict[str, Any], n_results: int = 5) -> List[Dict[str, Any]]:
-        """查找相似的商单"""
+    def find_similar_orders(self, order: Dict[str, Any], n_results: int = 5, mode: str = "vector",
+                            exclude_user_id: str = None) -> List[OrderRecord]:
+        """查找相似的商单（输入为商单字典或 OrderRecord），可排除指定用户自己的商单"""
         logger.info(f"find_similar_orders input order: {order}")
         
         try:
+            order = OrderRecord.from_dict(order)
             # 检查输入数据完整性
-            has_role = bool(_get_field(order, 'corresponding_role'))
-            has_title = bool(_get_field(order, 'wish_title'))
-            has_details = bool(_get_field(order, 'wish_details'))
-            has_classification = bool(_get_field(order, 'classification'))
+            has_role = bool(order.corresponding_role)
+            has_title = bool(order.wish_title)
+            has_details = bool(order.wish_details)
+            has_classification = bool(order.classification)
             
             # 如果只有角色信息，使用角色匹配策略
             if has_role and not (has_title or has_details or has_classification):
                 logger.info("Using role-based matching strategy")
-                role = _get_field(order, 'corresponding_role')
+                role = order.corresponding_role
                 role_prompt = self._get_role_prompt(role)
                 query_text = f"{role_prompt}\n角色: {role}"
             else:
                 # 使用完整的文本匹配策略
-                query_text = self._prepare_order_text(order)
+                with metrics.timed("text_prep"):
+                    query_text = self._prepare_order_text(order)
             
             logger.info(f"prepared text: {query_text}")
-            query_embedding = self._get_embedding(query_text)
             
-            # 获取相似商单
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results * 2  # 获取更多结果用于后续分析
-            )
+            # 获取相似商单（获取更多结果用于后续分析）
+            if mode == "hybrid" and (has_title or has_details):
+                keyword_text = " ".join(filter(None, [order.wish_title, order.wish_details]))
+                orders = self._hybrid_candidates(query_text, keyword_text, n_results * 2,
+                                                 exclude_user_id=exclude_user_id)
+            else:
+                orders = self._vector_candidates(query_text, n_results * 2, exclude_user_id=exclude_user_id)
             
             similar_orders = []
-            if results and results['metadatas']:
-                orders = results['metadatas'][0]
-                
+            if orders:
                 if has_role:
                     # 使用千帆模型进行深度分析
-                    scored_orders = self._analyze_with_llm(_get_field(order, 'corresponding_role'), orders)
+                    scored_orders = self._analyze_with_llm(order.corresponding_role, orders)
                     # 按LLM分析分数排序
                     scored_orders.sort(key=lambda x: x[1], reverse=True)
                     similar_orders = [order for order, _ in scored_orders[:n_results]]
@@ -200,20 +436,33 @@ class BusinessVectorDB:
             logger.error(f"Error finding similar orders: {str(e)}")
             return []
 
-    def load_orders_from_json(self, json_file: str = "user_orders.json"):
-        """从JSON文件加载商单到向量数据库"""
+    def load_orders_from_json(self, json_file: str = "user_orders.json", sync_keyword_index: bool = True):
+        """从JSON文件加载商单到向量数据库
+
+        sync_keyword_index 为 True 时，把 SQLite 中还没有的商单作为仅供检索的语料写入全文索引
+        （不出现在商单列表中，也不覆盖已有商单）；重建索引时传 False，不改动 business_orders。
+        """
         try:
             with open(json_file, 'r', encoding='utf-8') as f:
-                new_orders = json.load(f)
+                new_orders = [OrderRecord.from_dict(order) for order in json.load(f)]
+            
+            # 关键词检索（FTS）必须覆盖与向量库相同的商单，否则混合检索只能看到 SQLite 中的部分商单；
+            # 已存在的商单一律跳过，经 API 修改过的商单不会被 JSON 中的旧内容覆盖
+            if sync_keyword_index:
+                try:
+                    stats = bulk_load_orders(new_orders, on_conflict="ignore", search_only=True)
+                    logger.info(f"Indexed {json_file} for keyword search: inserted={stats['inserted']}, skipped={stats['skipped']}")
+                except Exception as e:
+                    logger.error(f"Error indexing {json_file} for keyword search: {str(e)}")
             
             # 获取现有商单
             existing_orders = self.get_all_orders()
             
             # 找出新增的商单
-            existing_order_ids = set(f"{_get_field(order, 'user_id')}_{_get_field(order, 'wish_title')}" for order in existing_orders)
+            existing_order_ids = set(order.key for order in existing_orders)
             orders_to_add = [
                 order for order in new_orders 
-                if f"{_get_field(order, 'user_id')}_{_get_field(order, 'wish_title')}" not in existing_order_ids
+                if order.key not in existing_order_ids
             ]
             
             if not orders_to_add:
@@ -229,35 +478,371 @@ class BusinessVectorDB:
             logger.error(f"Error loading orders from JSON: {str(e)}")
             return False
 
-    def get_all_orders(self) -> List[Dict[str, Any]]:
+    def export_entries(self) -> Dict[str, Any]:
+        """导出集合中的全部记录（含向量），用于重建索引时复用"""
+        return self.collection.get(include=["embeddings", "documents", "metadatas"])
+
+    def import_entries(self, ids: List[str], embeddings, documents: List[str],
+                       metadatas: List[Dict[str, Any]], batch_size: int = 1000):
+        """按批写入已有向量的记录，不经过模型编码；元数据按规范字段名重新写入"""
+        records = [OrderRecord.from_metadata(metadata) for metadata in metadatas]
+        self._assign_canonical_ids(records, list(documents))
+        metadatas = [record.to_metadata() for record in records]
+        for i in range(0, len(ids), batch_size):
+            self.collection.add(
+                ids=list(ids[i:i + batch_size]),
+                embeddings=[list(e) for e in embeddings[i:i + batch_size]],
+                documents=list(documents[i:i + batch_size]),
+                metadatas=list(metadatas[i:i + batch_size])
+            )
+
+    def get_all_orders(self) -> List[OrderRecord]:
         """获取所有商单"""
         try:
             results = self.collection.get()
-            return results['metadatas'] if results and results['metadatas'] else []
+            metadatas = results['metadatas'] if results and results['metadatas'] else []
+            return [OrderRecord.from_metadata(metadata) for metadata in metadatas]
         except Exception as e:
             logger.error(f"Error getting all orders: {str(e)}")
             return []
 
-    def get_orders_by_role(self, role: str, n_results: int = 5) -> List[Dict[str, Any]]:
+    def get_orders_by_role(self, role: str, n_results: int = 5) -> List[OrderRecord]:
         """根据角色获取相关商单"""
         try:
             # 创建一个只包含角色信息的查询对象
-            query_order = {"corresponding_role": role}
+            query_order = OrderRecord(corresponding_role=role)
             return self.find_similar_orders(query_order, n_results)
         except Exception as e:
             logger.error(f"Error getting orders by role: {str(e)}")
             return []
 
+class ShardedBusinessVectorDB(BusinessVectorDB):
+    """分片的商单向量库
+
+    商单按分类（classification 模式，每个分类一个集合）或按 (user_id, 标题) 的哈希（hash 模式，
+    固定 num_shards 个集合）分布到名为 "<collection_name>__<分片>" 的多个集合中。查询时只编码一次，
+    在线程池中并发查询各分片，再用堆归并各分片按距离排好序的结果；classification 模式下指定分类的
+    查询直接路由到该分类的分片。
+    """
+
+    def __init__(self, collection_name: str = DEFAULT_COLLECTION, shard_mode: str = "hash",
+                 num_shards: int = VECTOR_SHARDS, model: SentenceTransformer = None, client=None,
+                 embedding_cache: Dict[str, List[float]] = None, max_workers: int = None):
+        if shard_mode not in SHARD_MODES:
+            raise ValueError(f"Unsupported shard mode: {shard_mode}")
+        self.shard_mode = shard_mode
+        self.num_shards = num_shards
+        self.shards = {}
+        self._shard_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or min(32, max(num_shards, 4)),
+                                            thread_name_prefix="vector-shard")
+        super().__init__(collection_name, model=model, client=client, embedding_cache=embedding_cache)
+
+    @property
+    def _prefix(self) -> str:
+        return f"{self.collection_name}__"
+
+    def _open_collections(self):
+        self.collection = None
+        for collection in self.client.list_collections():
+            # 不同版本的 chromadb 返回集合对象或集合名称
+            name = getattr(collection, "name", collection)
+            if name.startswith(self._prefix):
+                self.shards[name] = self.client.get_collection(name=name)
+        if self.shard_mode == "hash":
+            for i in range(self.num_shards):
+                self._get_shard(f"{self._prefix}h{i:02d}")
+        logger.info(f"Opened {len(self.shards)} shards for {self.collection_name} ({self.shard_mode})")
+
+    def _get_shard(self, name: str, metadata: Dict[str, Any] = None):
+        shard = self.shards.get(name)
+        if shard is None:
+            with self._shard_lock:
+                shard = self.shards.get(name)
+                if shard is None:
+                    shard = self.shards[name] = self.client.get_or_create_collection(name=name, metadata=metadata)
+        return shard
+
+    def _classification_shard_name(self, classification: str) -> str:
+        return f"{self._prefix}c{hashlib.md5((classification or '').encode('utf-8')).hexdigest()[:10]}"
+
+    def _shard_for(self, record: OrderRecord):
+        """商单所在的分片（不存在时创建）"""
+        if self.shard_mode == "classification":
+            classification = record.classification or ''
+            return self._get_shard(self._classification_shard_name(classification), {"classification": classification})
+        index = zlib.crc32(record.key.encode('utf-8')) % self.num_shards
+        return self._get_shard(f"{self._prefix}h{index:02d}")
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in list(self.shards.values()))
+
+    def _stored_entries(self) -> Tuple[List[str], List[Dict[str, Any]]]:
+        documents, metadatas = [], []
+        for shard in list(self.shards.values()):
+            results = shard.get(include=["documents", "metadatas"])
+            documents.extend(results["documents"] or [])
+            metadatas.extend(results["metadatas"] or [])
+        return documents, metadatas
+
+    def drop(self):
+        for name in list(self.shards):
+            self.client.delete_collection(name)
+        self.shards.clear()
+        self._executor.shutdown(wait=False)
+
+    def _add_to_shards(self, embeddings, documents: List[str], records: List[OrderRecord]):
+        """按分片分组写入"""
+        groups = {}
+        for i, record in enumerate(records):
+            groups.setdefault(self._shard_for(record).name, []).append(i)
+        for name, positions in groups.items():
+            shard = self.shards[name]
+            shard.add(
+                ids=_new_ids(len(positions)),
+                embeddings=[list(embeddings[i]) for i in positions],
+                documents=[documents[i] for i in positions],
+                metadatas=[records[i].to_metadata() for i in positions]
+            )
+
+    def _delete_orders(self, records: List[OrderRecord]):
+        # 分类模式下商单的分类可能已经改变，旧记录不一定在新记录所在的分片中
+        for shard in list(self.shards.values()):
+            for record in records:
+                shard.delete(where=_key_where(record))
+
+    def add_orders(self, orders: List[Dict[str, Any]]):
+        """添加商单到各自的分片"""
+        try:
+            records = [OrderRecord.from_dict(order) for order in orders]
+            texts = [self._prepare_order_text(record) for record in records]
+            embeddings = self._encode_texts(texts)
+            self._assign_canonical_ids(records, texts)
+            self._add_to_shards(embeddings, texts, records)
+            logger.info(f"Successfully added {len(orders)} orders to {self.collection_name} shards")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding orders to sharded vector database: {str(e)}")
+            # 写入失败的商单已登记到近似重复索引，下次写入时按集合内容重建
+            self.duplicates = None
+            return False
+
+    def import_entries(self, ids: List[str], embeddings, documents: List[str],
+                       metadatas: List[Dict[str, Any]], batch_size: int = 1000):
+        """按批写入已有向量的记录；ID 由各分片重新分配"""
+        records = [OrderRecord.from_metadata(metadata) for metadata in metadatas]
+        self._assign_canonical_ids(records, list(documents))
+        for i in range(0, len(records), batch_size):
+            self._add_to_shards(embeddings[i:i + batch_size], list(documents[i:i + batch_size]),
+                                records[i:i + batch_size])
+
+    def export_entries(self) -> Dict[str, Any]:
+        entries = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        for name, shard in list(self.shards.items()):
+            part = shard.get(include=["embeddings", "documents", "metadatas"])
+            entries["ids"].extend(f"{name}/{entry_id}" for entry_id in part["ids"])
+            entries["embeddings"].extend(part["embeddings"])
+            entries["documents"].extend(part["documents"])
+            entries["metadatas"].extend(part["metadatas"])
+        return entries
+
+    def get_all_orders(self) -> List[OrderRecord]:
+        try:
+            orders = []
+            for shard in list(self.shards.values()):
+                orders.extend(OrderRecord.from_metadata(metadata) for metadata in shard.get()["metadatas"] or [])
+            return orders
+        except Exception as e:
+            logger.error(f"Error getting all orders: {str(e)}")
+            return []
+
+    def _target_shards(self, classification: str = None):
+        if classification and self.shard_mode == "classification":
+            shard = self.shards.get(self._classification_shard_name(classification))
+            return [shard] if shard is not None else []
+        return list(self.shards.values())
+
+    def _vector_candidates(self, query_text: str, n_results: int, where: Dict[str, Any] = None,
+                           classification: str = None, exclude_user_id: str = None) -> List[OrderRecord]:
+        """并发查询各分片，按距离归并出全局 top-n"""
+        query_embedding = self._get_embedding(query_text)
+        shards = self._target_shards(classification)
+        if classification and self.shard_mode != "classification":
+            where = _and_where(where, _classification_where(classification))
+
+        fetch_size = self._fetch_size(n_results)
+
+        def query_shard(shard):
+            # 空分片（如 hash 模式下尚未分到商单的集合）不查询，请求数量不超过分片大小
+            size = shard.count()
+            if not size:
+                return []
+            results = shard.query(query_embeddings=[query_embedding], n_results=min(fetch_size, size), where=where,
+                                  include=["metadatas", "distances"])
+            if not results or not results['metadatas']:
+                return []
+            return list(zip(results['distances'][0], results['metadatas'][0]))
+
+        with metrics.timed("vector_query"):
+            per_shard = list(self._executor.map(query_shard, shards))
+        # 各分片结果已按距离升序排列，堆归并只取前 n 个
+        merged = heapq.merge(*per_shard, key=lambda hit: hit[0])
+        return self._collapse_duplicates(
+            [OrderRecord.from_metadata(metadata) for _, metadata in islice(merged, fetch_size)], n_results,
+            exclude_user_id=exclude_user_id
+        )
+
+def create_business_vector_db(collection_name: str = DEFAULT_COLLECTION, **kwargs) -> BusinessVectorDB:
+    """按 VECTOR_SHARD_MODE 创建单集合或分片的向量库"""
+    if VECTOR_SHARD_MODE:
+        return ShardedBusinessVectorDB(collection_name, shard_mode=VECTOR_SHARD_MODE, **kwargs)
+    return BusinessVectorDB(collection_name, **kwargs)
+
+def _load_active_collection() -> str:
+    """读取当前提供服务的集合名称"""
+    try:
+        with open(ACTIVE_COLLECTION_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get("active", DEFAULT_COLLECTION)
+    except (OSError, ValueError):
+        return DEFAULT_COLLECTION
+
+def _save_active_collection(active: str, previous: str = None):
+    """持久化当前和上一版本的集合名称"""
+    os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+    tmp_file = ACTIVE_COLLECTION_FILE + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({"active": active, "previous": previous}, f)
+    os.replace(tmp_file, ACTIVE_COLLECTION_FILE)
+
+class VectorIndexPointer:
+    """向量库读指针
+
+    请求处理只读取 current；重建索引在后台构建新集合，完成后在写锁内原子切换，
+    上一版本保留在 previous 中用于回滚。
+    """
+
+    def __init__(self, vector_db: BusinessVectorDB):
+        self.current = vector_db
+        self.previous = None
+        self.version = 0
+        # 写入与切换互斥，保证切换期间写入的新商单不会丢失
+        self.write_lock = threading.Lock()
+        self.reindex_status = {"state": "idle"}
+
+    def add_orders(self, orders: List[Dict[str, Any]]):
+        """向当前集合写入商单"""
+        with self.write_lock:
+            success = self.current.add_orders(orders)
+            if success:
+                # 索引内容发生变化，依赖版本号的缓存随之失效
+                self.version += 1
+            return success
+
+    def upsert_orders(self, orders: List[Dict[str, Any]]):
+        """向当前集合写入商单，已存在的商单替换为新内容"""
+        with self.write_lock:
+            success = self.current.upsert_orders(orders)
+            if success:
+                self.version += 1
+            return success
+
+    def _swap(self, new_db: BusinessVectorDB):
+        stale = self.previous
+        self.previous, self.current = self.current, new_db
+        self.version += 1
+        _save_active_collection(self.current.collection_name, self.previous.collection_name)
+        # 只保留一个回滚版本
+        if stale is not None and stale.collection_name not in (self.current.collection_name, self.previous.collection_name):
+            try:
+                stale.drop()
+            except Exception as e:
+                logger.warning(f"Failed to drop stale collection {stale.collection_name}: {str(e)}")
+
+    def rollback(self) -> bool:
+        """切换回上一版本的集合"""
+        with self.write_lock:
+            if self.previous is None:
+                return False
+            self.previous, self.current = self.current, self.previous
+            self.version += 1
+            _save_active_collection(self.current.collection_name, self.previous.collection_name)
+        logger.info(f"Rolled back vector index to {self.current.collection_name}")
+        return True
+
+    def export_snapshot(self, path: str) -> Dict[str, Any]:
+        """导出当前集合的快照：只在写锁内复制记录，保证与某一时刻的索引内容一致；写文件和计算校验和在锁外进行"""
+        with self.write_lock:
+            current = self.current
+            entries = current.export_entries()
+        return write_snapshot(entries, current.collection_name, path)
+
+    def reindex(self, json_files=ORDER_JSON_FILES) -> bool:
+        """在新集合中重建索引并原子切换（阻塞调用，应在后台线程中执行）"""
+        current = self.current
+        collection_name = f"{DEFAULT_COLLECTION}_{int(time.time() * 1000)}"
+        self.reindex_status = {"state": "building", "collection": collection_name, "started_at": time.time()}
+        new_db = None
+        try:
+            # 复用已加载的模型和客户端，以现有集合中的向量作为编码缓存
+            entries = current.export_entries()
+            embedding_cache = dict(zip(entries["documents"], entries["embeddings"]))
+            new_db = create_business_vector_db(collection_name, model=current._model, client=current.client,
+                                               embedding_cache=embedding_cache)
+            for json_file in json_files:
+                if not new_db.load_orders_from_json(json_file, sync_keyword_index=False):
+                    raise RuntimeError(f"failed to load {json_file}")
+
+            with self.write_lock:
+                # 补齐不在商单文件中的记录（例如通过接口新建、构建期间写入的商单）
+                entries = self.current.export_entries()
+                built_keys = set(order.key for order in new_db.get_all_orders())
+                carry = [i for i, metadata in enumerate(entries["metadatas"])
+                         if OrderRecord.from_metadata(metadata).key not in built_keys]
+                if carry:
+                    new_db.import_entries(
+                        _new_ids(len(carry)),
+                        [entries["embeddings"][i] for i in carry],
+                        [entries["documents"][i] for i in carry],
+                        [entries["metadatas"][i] for i in carry]
+                    )
+                new_db.embedding_cache = None
+                self._swap(new_db)
+
+            self.reindex_status = {
+                "state": "done",
+                "collection": collection_name,
+                "orders": new_db.count(),
+                "carried_over": len(carry),
+                "elapsed_seconds": round(time.time() - self.reindex_status["started_at"], 3)
+            }
+            logger.info(f"Switched vector index to {collection_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error reindexing vector database: {str(e)}")
+            logger.error(traceback.format_exc())
+            self.reindex_status = {"state": "failed", "collection": collection_name, "error": str(e)}
+            try:
+                if new_db is not None:
+                    new_db.drop()
+            except Exception:
+                pass
+            return False
+
 def init_business_vector_db():
     """初始化商单向量数据库，依次加载 orders.json 和 user_orders.json"""
     try:
-        vector_db = BusinessVectorDB()
-        logger.info("开始从 orders.json 加载商单到向量库...")
-        success_orders = vector_db.load_orders_from_json("orders.json")
-        logger.info(f"orders.json 加载结果: {success_orders}")
-        logger.info("开始从 user_orders.json 加载商单到向量库...")
-        success_user_orders = vector_db.load_orders_from_json("user_orders.json")
-        logger.info(f"user_orders.json 加载结果: {success_user_orders}")
+        vector_db = create_business_vector_db(_load_active_collection())
+        if SNAPSHOT_DIR and not vector_db.count():
+            # 新节点直接导入快照中的向量，之后只对快照之后新增的商单编码
+            try:
+                logger.info(f"开始从快照 {SNAPSHOT_DIR} 导入向量库...")
+                import_snapshot(vector_db, SNAPSHOT_DIR)
+            except Exception as e:
+                logger.error(f"Error importing vector snapshot {SNAPSHOT_DIR}: {str(e)}")
+        for json_file in ORDER_JSON_FILES:
+            logger.info(f"开始从 {json_file} 加载商单到向量库...")
+            success = vector_db.load_orders_from_json(json_file)
+            logger.info(f"{json_file} 加载结果: {success}")
         return vector_db
     except Exception as e:
         logger.error(f"Error initializing business vector database: {str(e)}")
@@ -2,9 +2,18 @@ import os
 import logging
 import socket
 import json
+import asyncio
+import threading
 from quart import Quart, render_template, request, jsonify
-from business_db import init_business_db, save_business_order, get_all_business_orders, get_business_orders_by_user, load_orders_from_json
-from business_vector_db import init_business_vector_db
+from business_db import init_business_db, save_business_order, get_all_business_orders, get_business_orders_by_user, bulk_load_orders_from_json
+from business_vector_db import init_business_vector_db, VectorIndexPointer, SEARCH_MODES
+from vector_outbox import VectorOutboxConsumer
+from request_cache import CoalescingCache
+from index_snapshot import SNAPSHOT_ROOT
+from order_record import OrderRecord
+from near_duplicates import first_per_cluster
+from business_db import get_outbox_stats
+import metrics
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,30 +27,65 @@ os.makedirs("output", exist_ok=True)
 
 # 初始化数据库
 init_business_db()
-vector_db = init_business_vector_db()
-
-FIELD_MAP = {
-    "user_id": ["user_id", "User ID"],
-    "wish_title": ["wish_title", "Wish title"],
-    "corresponding_role": ["corresponding_role", "Corresponding role"],
-    "classification": ["classification", "Classification of wishes"],
-    "wish_details": ["wish_details", "Details of the wish"],
-}
-
-def _get_field(order, key):
-    for k in FIELD_MAP.get(key, [key]):
-        if k in order:
-            return order[k]
-    return None
-
-def normalize_order_fields(order):
-    return {
-        "user_id": _get_field(order, "user_id"),
-        "wish_title": _get_field(order, "wish_title"),
-        "corresponding_role": _get_field(order, "corresponding_role"),
-        "classification": _get_field(order, "classification"),
-        "wish_details": _get_field(order, "wish_details"),
-    }
+# 请求通过读指针访问向量库，重建索引时原子切换
+vector_index = VectorIndexPointer(init_business_vector_db())
+reindex_task = None
+# 批量导入在工作线程中执行，期间拒绝新的导入请求
+load_orders_lock = asyncio.Lock()
+
+# 推荐结果缓存：按 (user_id, 检索模式, 索引版本) 合并并发请求并缓存响应
+recommendation_cache = CoalescingCache(maxsize=2048, ttl=300)
+
+# 新商单通过发件箱异步写入向量库
+outbox_consumer = VectorOutboxConsumer(lambda: vector_index)
+
+@app.before_serving
+async def start_background_tasks():
+    outbox_consumer.start()
+
+@app.after_serving
+async def stop_background_tasks():
+    await outbox_consumer.stop()
+
+# Prometheus 指标（/metrics）以及按请求开启的 Server-Timing 耗时分解
+metrics.install(app)
+metrics.REGISTRY.gauge("vector_collection_size", "Orders in the active vector collection",
+                       func=lambda: vector_index.current.count())
+metrics.REGISTRY.gauge("vector_index_version", "Version of the active vector index",
+                       func=lambda: vector_index.version)
+metrics.REGISTRY.gauge("vector_outbox_entries", "Vector outbox entries by state", ("state",),
+                       func=lambda: {state: (get_outbox_stats() or {}).get(state, 0) for state in ("pending", "failed")})
+metrics.REGISTRY.gauge("recommendation_cache_requests_total", "Recommendation cache lookups by result", ("result",),
+                       func=lambda: {"hit": recommendation_cache.hits, "miss": recommendation_cache.misses,
+                                     "coalesced": recommendation_cache.coalesced}, kind="counter")
+metrics.REGISTRY.gauge("recommendation_cache_size", "Entries in the recommendation cache",
+                       func=lambda: len(recommendation_cache.cache))
+metrics.REGISTRY.gauge("recommendation_cache_in_flight", "Recommendation computations in flight",
+                       func=lambda: recommendation_cache.stats()["in_flight"])
+
+USER_ORDERS_FILE = 'user_orders.json'
+# user_orders.json 解析结果：(文件修改时间, {user_id: [OrderRecord, ...]})，文件变化时重新加载
+_user_orders_snapshot = (None, {})
+_user_orders_lock = threading.Lock()
+
+def _load_user_order_records():
+    """按用户分组的 user_orders.json 商单，只在文件变化时重新解析和规范化"""
+    global _user_orders_snapshot
+    mtime = os.path.getmtime(USER_ORDERS_FILE)
+    loaded_mtime, orders_by_user = _user_orders_snapshot
+    if loaded_mtime == mtime:
+        return orders_by_user
+    # 在 to_thread 的工作线程中调用，文件变化时只由一个线程重新加载，其他线程等待后复用结果
+    with _user_orders_lock:
+        loaded_mtime, orders_by_user = _user_orders_snapshot
+        if loaded_mtime != mtime:
+            with open(USER_ORDERS_FILE, 'r', encoding='utf-8') as f:
+                records = [OrderRecord.from_dict(order) for order in json.load(f)]
+            orders_by_user = {}
+            for record in records:
+                orders_by_user.setdefault(record.user_id, []).append(record)
+            _user_orders_snapshot = (mtime, orders_by_user)
+    return orders_by_user
 
 @app.route('/')
 async def index():
@@ -66,53 +110,81 @@ async def get_orders():
         logger.error(f"Error getting orders: {str(e)}")
         return jsonify({"success": False, "error": str(e)})
 
+def _compute_user_recommendations(user_id, mode, vector_db):
+    """获取指定用户的商单及推荐结果（阻塞调用，在线程中执行）"""
+    # 直接从 user_orders.json 读取用户商单
+    with metrics.timed("load_user_orders"):
+        user_orders = _load_user_order_records().get(user_id, [])
+    if not user_orders:
+        return {"success": False, "error": "未找到该用户的商单"}
+
+    # 获取推荐商单；用户自己的商单在向量库折叠近似重复之前排除，不会挤掉同簇中其他用户的商单
+    recommended_orders = []
+    for order in user_orders:
+        similar_orders = vector_db.find_similar_orders(order, n_results=20, mode=mode, exclude_user_id=user_id)
+        recommended_orders.extend(similar_orders)
+
+    # 去重并限制返回5个推荐：近似重复的商单内容相同，同一簇在全部查询中只推荐一条
+    unique_orders = first_per_cluster(
+        recommended_orders, lambda order: order.canonical_id or order.key, limit=5,
+        skip=lambda order: order.user_id == user_id
+    )
+
+    return {
+        "success": True,
+        "user_orders": [o.to_dict() for o in user_orders],
+        "recommended_orders": [o.to_dict() for o in unique_orders]
+    }
+
 @app.route('/api/business/orders/<user_id>', methods=['GET'])
 async def get_user_orders(user_id):
     """获取指定用户的商单并返回推荐（直接从 user_orders.json 读取）"""
     try:
-        # 直接从 user_orders.json 读取用户商单
-        with open('user_orders.json', 'r', encoding='utf-8') as f:
-            all_user_orders = json.load(f)
-        user_orders = [order for order in all_user_orders if _get_field(order, 'user_id') == user_id]
-        if not user_orders:
-            return jsonify({"success": False, "error": "未找到该用户的商单"})
-
-        # 获取推荐商单
-        recommended_orders = []
-        for order in user_orders:
-            similar_orders = vector_db.find_similar_orders(order, n_results=20)
-            # 过滤掉用户自己的商单
-            similar_orders = [o for o in similar_orders if _get_field(o, 'user_id') != user_id]
-            recommended_orders.extend(similar_orders)
-
-        # 去重并限制数量
-        seen = set()
-        unique_orders = []
-        for order in recommended_orders:
-            order_id = f"{_get_field(order, 'user_id')}_{_get_field(order, 'wish_title')}"
-            if order_id not in seen:
-                seen.add(order_id)
-                unique_orders.append(order)
-                if len(unique_orders) >= 5:  # 限制返回5个推荐
-                    break
-
-        return jsonify({
-            "success": True,
-            "user_orders": [normalize_order_fields(o) for o in user_orders],
-            "recommended_orders": [normalize_order_fields(o) for o in unique_orders]
-        })
+        mode = request.args.get('mode', 'vector')
+        if mode not in SEARCH_MODES:
+            return jsonify({"success": False, "error": f"不支持的检索模式: {mode}"})
+
+        # 整个请求使用同一版本的向量库；相同请求合并为一次计算
+        vector_db = vector_index.current
+        result = await recommendation_cache.get_or_compute(
+            (user_id, mode, vector_index.version),
+            lambda: asyncio.to_thread(_compute_user_recommendations, user_id, mode, vector_db),
+            cacheable=lambda result: result["success"]
+        )
+        with metrics.timed("serialization"):
+            return jsonify(result)
     except Exception as e:
         logger.error(f"Error getting user orders: {str(e)}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/business/search', methods=['GET'])
+async def search_orders():
+    """按关键词检索商单（默认混合检索：BM25 + 向量）"""
+    try:
+        query = request.args.get('q', '').strip()
+        mode = request.args.get('mode', 'hybrid')
+        n_results = request.args.get('n', 10, type=int)
+        prefilter = request.args.get('prefilter', '0') == '1'
+        classification = request.args.get('classification') or None
+        if not query:
+            return jsonify({"success": False, "error": "请提供检索关键词"})
+        if mode not in SEARCH_MODES:
+            return jsonify({"success": False, "error": f"不支持的检索模式: {mode}"})
+        orders = vector_index.current.search_orders(query, n_results=n_results, mode=mode, prefilter=prefilter,
+                                                    classification=classification)
+        return jsonify({"success": True, "orders": [o.to_dict() for o in orders]})
+    except Exception as e:
+        logger.error(f"Error searching orders: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
+
 @app.route('/api/business/orders', methods=['POST'])
 async def create_order():
     """创建新商单"""
     try:
         data = await request.get_json()
-        if save_business_order(data):
-            # 更新向量数据库
-            vector_db.add_orders([data])
+        # 商单与向量索引发件箱在同一事务中写入，由后台任务批量写入向量库
+        if save_business_order(data, enqueue_vector=True):
+            outbox_consumer.notify()
             return jsonify({"success": True})
         return jsonify({"success": False, "error": "保存商单失败"})
     except Exception as e:
@@ -121,24 +193,80 @@ async def create_order():
 
 @app.route('/api/business/load-orders', methods=['POST'])
 async def load_orders():
-    """从JSON文件加载商单数据"""
+    """从JSON文件加载商单数据，并在后台重建向量索引"""
     try:
-        if load_orders_from_json():
-            # 重新初始化向量数据库
-            global vector_db
-            vector_db = init_business_vector_db()
-            return jsonify({"success": True})
+        global reindex_task
+        if load_orders_lock.locked() or (reindex_task is not None and not reindex_task.done()):
+            return jsonify({"success": False, "error": "向量索引正在重建中", "reindex": vector_index.reindex_status})
+        async with load_orders_lock:
+            # 解析和写入大文件耗时较长，放到工作线程中执行，不阻塞事件循环
+            stats = await asyncio.to_thread(bulk_load_orders_from_json)
+            if stats is not None:
+                # 在后台构建新集合，完成后切换读指针，期间旧集合继续提供服务
+                reindex_task = asyncio.create_task(asyncio.to_thread(vector_index.reindex))
+                return jsonify({"success": True, "stats": stats, "reindex": {"state": "building"}})
         return jsonify({"success": False, "error": "加载商单数据失败"})
     except Exception as e:
         logger.error(f"Error loading orders: {str(e)}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/business/reindex', methods=['GET'])
+async def get_reindex_status():
+    """获取向量索引重建状态"""
+    return jsonify({
+        "success": True,
+        "reindex": vector_index.reindex_status,
+        "active_collection": vector_index.current.collection_name,
+        "previous_collection": vector_index.previous.collection_name if vector_index.previous else None,
+        "version": vector_index.version
+    })
+
+@app.route('/api/business/reindex/rollback', methods=['POST'])
+async def rollback_reindex():
+    """切换回上一版本的向量索引"""
+    try:
+        if reindex_task is not None and not reindex_task.done():
+            return jsonify({"success": False, "error": "向量索引正在重建中"})
+        if await asyncio.to_thread(vector_index.rollback):
+            return jsonify({"success": True, "active_collection": vector_index.current.collection_name})
+        return jsonify({"success": False, "error": "没有可回滚的索引版本"})
+    except Exception as e:
+        logger.error(f"Error rolling back reindex: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/business/snapshot', methods=['POST'])
+async def export_vector_snapshot():
+    """导出当前向量索引的快照，供新节点冷启动或复制使用"""
+    try:
+        data = await request.get_json(silent=True) or {}
+        name = os.path.basename(data.get('name') or f"{vector_index.current.collection_name}_v{vector_index.version}")
+        path = os.path.join(SNAPSHOT_ROOT, name)
+        os.makedirs(SNAPSHOT_ROOT, exist_ok=True)
+        manifest = await asyncio.to_thread(vector_index.export_snapshot, path)
+        return jsonify({"success": True, "path": path, "manifest": manifest})
+    except Exception as e:
+        logger.error(f"Error exporting vector snapshot: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/business/cache-stats', methods=['GET'])
+async def get_cache_stats():
+    """获取推荐结果缓存的命中、未命中和合并次数"""
+    return jsonify({"success": True, "recommendations": recommendation_cache.stats(), "index_version": vector_index.version,
+                    "near_duplicates": vector_index.current.duplicate_stats()})
+
+@app.route('/api/business/indexing-lag', methods=['GET'])
+async def get_indexing_lag():
+    """获取向量索引发件箱的积压和延迟"""
+    try:
+        return jsonify({"success": True, "outbox": outbox_consumer.stats()})
+    except Exception as e:
+        logger.error(f"Error getting indexing lag: {str(e)}")
+        return jsonify({"success": False, "error": str(e)})
+
 @app.route('/api/business/user_ids_from_json', methods=['GET'])
 async def get_user_ids_from_json():
     try:
-        with open('user_orders.json', 'r', encoding='utf-8') as f:
-            orders = json.load(f)
-        user_ids = list({order['user_id'] for order in orders})
+        user_ids = [user_id for user_id in _load_user_order_records() if user_id is not None]
         return jsonify({"success": True, "user_ids": user_ids})
     except Exception as e:
         logger.error(f"Error reading user_orders.json: {str(e)}")
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = ".heatmap_manifest.json"
+# 清单变更后延迟写盘，合并同一时间段内的多次变更（一次 /analyze 会登记三张图）
+MANIFEST_SAVE_DELAY = 1.0
+
+def _render(kind, args, filename):
+    """在子进程中渲染热力图，避免 matplotlib 阻塞事件循环"""
+    from visualization import create_heatmap, create_comparison_heatmap
+    if kind == "heatmap":
+        create_heatmap(*args, filename)
+    elif kind == "comparison":
+        create_comparison_heatmap(*args, filename)
+    else:
+        raise ValueError(f"Unknown heatmap kind: {kind}")
+
+def _digest(kind, args):
+    """按图类型、分数字典和标题计算渲染指纹"""
+    payload = json.dumps([kind, args], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class HeatmapRenderCache:
+    """热力图渲染缓存
+
+    schedule 只登记渲染参数；参数指纹与已渲染文件一致时不再渲染。缓存未命中时在进程池中渲染，
+    /output/<filename> 被请求时按需等待或补做渲染。登记信息持久化在 output 目录的清单文件中，
+    写盘在后台线程中合并进行，不阻塞事件循环。
+    """
+
+    def __init__(self, output_dir="output", max_workers=2):
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        self.manifest = self._load_manifest()
+        self.hits = 0
+        self.renders = 0
+        self._executor = None
+        self._pending = {}
+        self._dirty = False
+        self._save_task = None
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        """原子写入清单：写临时文件并落盘后整体替换"""
+        tmp_path = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _save_manifest(self):
+        """标记清单已变更，由后台任务延迟写盘"""
+        self._dirty = True
+        if self._save_task is None:
+            self._save_task = asyncio.get_running_loop().create_task(self._save_later())
+
+    async def _save_later(self):
+        try:
+            await asyncio.sleep(MANIFEST_SAVE_DELAY)
+            # 写盘期间的新变更会在下一轮写入
+            while self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(self._write_manifest, dict(self.manifest))
+        except Exception as e:
+            logger.error(f"Error saving heatmap manifest: {str(e)}")
+        finally:
+            self._save_task = None
+
+    def _is_fresh(self, filename):
+        entry = self.manifest.get(filename)
+        return (entry is not None and entry.get("rendered") == entry["digest"]
+                and os.path.exists(os.path.join(self.output_dir, filename)))
+
+    def schedule(self, filename, kind, *args, eager=True):
+        """登记一张热力图；eager 为 True 时在后台预先渲染。返回是否命中缓存"""
+        digest = _digest(kind, args)
+        entry = self.manifest.get(filename)
+        if entry is None or entry["digest"] != digest:
+            self.manifest[filename] = {
+                "kind": kind,
+                "args": json.loads(json.dumps(args, ensure_ascii=False, default=str)),
+                "digest": digest,
+                "rendered": entry.get("rendered") if entry else None
+            }
+            self._save_manifest()
+        if self._is_fresh(filename):
+            self.hits += 1
+            return True
+        if eager:
+            asyncio.get_running_loop().create_task(self._prerender(filename))
+        return False
+
+    async def _prerender(self, filename):
+        try:
+            await self.ensure(filename)
+        except Exception:
+            # 错误已记录，请求该文件时会再次尝试渲染
+            pass
+
+    async def ensure(self, filename):
+        """确保文件已按最新参数渲染；未登记的文件直接返回"""
+        # 等待中的渲染可能基于旧参数，完成后需再检查一次
+        for _ in range(2):
+            entry = self.manifest.get(filename)
+            if entry is None or self._is_fresh(filename):
+                return
+            # 同一文件的并发请求共享同一次渲染
+            task = self._pending.get(filename)
+            if task is None:
+                task = asyncio.ensure_future(self._render(filename, entry))
+                self._pending[filename] = task
+                task.add_done_callback(lambda _: self._pending.pop(filename, None))
+            await asyncio.shield(task)
+
+    async def _render(self, filename, entry):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        loop = asyncio.get_running_loop()
+        digest = entry["digest"]
+        try:
+            await loop.run_in_executor(self._executor, _render, entry["kind"], tuple(entry["args"]), filename)
+        except Exception as e:
+            logger.error(f"Error rendering heatmap {filename}: {str(e)}")
+            raise
+        self.renders += 1
+        current = self.manifest.get(filename)
+        # 渲染期间参数可能再次变化，只有指纹仍一致时才标记为已渲染
+        if current is not None and current["digest"] == digest:
+            current["rendered"] = digest
+            self._save_manifest()
+
+    def shutdown(self):
+        if self._dirty:
+            try:
+                self._write_manifest(dict(self.manifest))
+                self._dirty = False
+            except Exception as e:
+                logger.error(f"Error saving heatmap manifest: {str(e)}")
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {"hits": self.hits, "renders": self.renders, "pending": len(self._pending), "entries": len(self.manifest)}
@@ -0,0 +1,215 @@
+"""向量索引快照：在节点之间复制索引、冷启动时免重新编码
+
+快照是一个目录：
+    embeddings.npy   float32 向量矩阵 (N, D)，可用 np.load(mmap_mode='r') 直接映射
+    ids.json         行号到原始记录 id 的映射
+    documents.json   每行对应的编码文本
+    metadata.json    按列存储的商单元数据 {"fields": [...], "columns": {字段: [值或 null]}}
+    manifest.json    格式版本、编码模型、向量维度以及各文件的 sha256
+
+    python index_snapshot.py export snapshots/business_orders
+    python index_snapshot.py import snapshots/business_orders
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.json"
+DOCUMENTS_FILE = "documents.json"
+METADATA_FILE = "metadata.json"
+# 启动时若向量库为空且设置了该目录，则从快照导入而不是重新编码商单文件
+SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR") or None
+# 通过接口导出的快照统一存放在该目录下
+SNAPSHOT_ROOT = "snapshots"
+IMPORT_BATCH_SIZE = 5000
+
+def _file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def model_identity(model_path):
+    """编码模型标识；导入快照时与本节点的模型比对，避免混用不同模型的向量"""
+    return {"name": os.path.basename(os.path.normpath(model_path)), "path": model_path}
+
+def to_columns(metadatas):
+    """行式元数据转为列式，缺失字段记为 None"""
+    fields = list(dict.fromkeys(field for metadata in metadatas for field in metadata))
+    return {"fields": fields, "columns": {field: [metadata.get(field) for metadata in metadatas] for field in fields}}
+
+def from_columns(table, start=0, stop=None):
+    """列式元数据还原为行，跳过值为 None 的字段"""
+    fields = table["fields"]
+    columns = [table["columns"][field] for field in fields]
+    if stop is None:
+        stop = len(columns[0]) if columns else 0
+    return [
+        {field: column[row] for field, column in zip(fields, columns) if column[row] is not None}
+        for row in range(start, stop)
+    ]
+
+class IndexSnapshot:
+    """已加载的快照；向量以内存映射方式读取"""
+    __slots__ = ("path", "manifest", "ids", "embeddings", "documents", "metadata")
+
+    def __init__(self, path, manifest, ids, embeddings, documents, metadata):
+        self.path = path
+        self.manifest = manifest
+        self.ids = ids
+        self.embeddings = embeddings
+        self.documents = documents
+        self.metadata = metadata
+
+    def __len__(self):
+        return len(self.ids)
+
+    def metadatas(self, start=0, stop=None):
+        return from_columns(self.metadata, start, stop)
+
+def export_snapshot(vector_db, path, model_path=None):
+    """将向量库导出为快照目录"""
+    return write_snapshot(vector_db.export_entries(), vector_db.collection_name, path, model_path)
+
+def write_snapshot(entries, collection_name, path, model_path=None):
+    """将 export_entries() 导出的记录写为快照目录，先写入临时目录再整体替换，读者不会看到写了一半的快照"""
+    from business_vector_db import MODEL_PATH
+    ids = [str(entry_id) for entry_id in entries["ids"]]
+    embeddings = np.asarray(entries["embeddings"], dtype=np.float32)
+    if not len(ids):
+        embeddings = embeddings.reshape(0, 0)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), embeddings)
+        _write_json(os.path.join(tmp_path, IDS_FILE), ids)
+        _write_json(os.path.join(tmp_path, DOCUMENTS_FILE), list(entries["documents"]))
+        _write_json(os.path.join(tmp_path, METADATA_FILE), to_columns(entries["metadatas"]))
+        files = {
+            name: {"sha256": _file_sha256(os.path.join(tmp_path, name)),
+                   "bytes": os.path.getsize(os.path.join(tmp_path, name))}
+            for name in (EMBEDDINGS_FILE, IDS_FILE, DOCUMENTS_FILE, METADATA_FILE)
+        }
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "created_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+            "collection": collection_name,
+            "count": len(ids),
+            "dimension": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+            "dtype": str(embeddings.dtype),
+            "model": model_identity(model_path or MODEL_PATH),
+            "files": files
+        }
+        _write_json(os.path.join(tmp_path, MANIFEST_FILE), manifest)
+
+        if os.path.exists(path):
+            old_path = f"{path}.old-{os.getpid()}"
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    logger.info(f"Exported {len(ids)} entries from {collection_name} to snapshot {path}")
+    return manifest
+
+def load_snapshot(path, verify=True, model_path=None, dimension=None):
+    """加载快照；verify 时校验各文件的 sha256，编码模型或向量维度（dimension）与本节点不一致时拒绝加载"""
+    from business_vector_db import MODEL_PATH
+    manifest = _read_json(os.path.join(path, MANIFEST_FILE))
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+    expected_model = model_identity(model_path or MODEL_PATH)["name"]
+    if manifest["model"]["name"] != expected_model:
+        raise ValueError(f"Snapshot was built with model {manifest['model']['name']}, expected {expected_model}")
+    # 同名模型也可能是不同的版本或配置，向量维度必须一致
+    if dimension is not None and manifest["count"] and manifest["dimension"] != dimension:
+        raise ValueError(f"Snapshot vectors have dimension {manifest['dimension']}, expected {dimension}")
+    if verify:
+        for name, info in manifest["files"].items():
+            if _file_sha256(os.path.join(path, name)) != info["sha256"]:
+                raise ValueError(f"Checksum mismatch for {name} in snapshot {path}")
+
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode='r')
+    ids = _read_json(os.path.join(path, IDS_FILE))
+    if (len(ids) != manifest["count"] or embeddings.shape[0] != manifest["count"]
+            or (manifest["count"] and embeddings.shape[1] != manifest["dimension"])):
+        raise ValueError(f"Snapshot {path} is inconsistent with its manifest")
+    return IndexSnapshot(path, manifest, ids, embeddings,
+                         _read_json(os.path.join(path, DOCUMENTS_FILE)),
+                         _read_json(os.path.join(path, METADATA_FILE)))
+
+def import_snapshot(vector_db, path, verify=True, batch_size=IMPORT_BATCH_SIZE):
+    """将快照写入空的向量库；直接使用快照中的向量，不重新编码，也不为核对向量维度而加载编码模型
+
+    向量维度登记到 vector_db，模型已加载时立即核对，否则在首次加载模型时核对。
+    """
+    if vector_db.count():
+        raise ValueError(f"Collection {vector_db.collection_name} is not empty")
+    snapshot = load_snapshot(path, verify=verify)
+    if len(snapshot):
+        vector_db.expect_dimension(snapshot.manifest["dimension"])
+    start = time.perf_counter()
+    for i in range(0, len(snapshot), batch_size):
+        stop = min(i + batch_size, len(snapshot))
+        vector_db.import_entries(
+            snapshot.ids[i:stop],
+            # 每批只把映射中的对应行读入内存
+            snapshot.embeddings[i:stop].tolist(),
+            snapshot.documents[i:stop],
+            snapshot.metadatas(i, stop),
+            batch_size=batch_size
+        )
+    elapsed = time.perf_counter() - start
+    logger.info(f"Imported {len(snapshot)} entries from snapshot {path} in {elapsed:.2f}s")
+    return {"entries": len(snapshot), "elapsed_seconds": round(elapsed, 3), "manifest": snapshot.manifest}
+
+def main():
+    parser = argparse.ArgumentParser(description="向量索引快照导出与导入")
+    parser.add_argument("action", choices=("export", "import", "verify"))
+    parser.add_argument("path", help="快照目录")
+    parser.add_argument("--collection", default=None, help="集合名称，默认为当前提供服务的集合")
+    parser.add_argument("--no-verify", action="store_true", help="导入时跳过校验和检查")
+    args = parser.parse_args()
+
+    if args.action == "verify":
+        snapshot = load_snapshot(args.path)
+        print(json.dumps(snapshot.manifest, ensure_ascii=False, indent=2))
+        return
+
+    from business_vector_db import create_business_vector_db, _load_active_collection
+    vector_db = create_business_vector_db(args.collection or _load_active_collection())
+    if args.action == "export":
+        result = export_snapshot(vector_db, args.path)
+    else:
+        result = import_snapshot(vector_db, args.path, verify=not args.no_verify)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    sys.exit(main())
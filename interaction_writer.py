@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SPILL_FILE = os.path.join("cache", "interaction_spill.jsonl")
+
+def init_interaction_log():
+    """初始化交互事件表（按写入顺序自增，便于按水位线增量消费）"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS interaction_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                content_id TEXT NOT NULL,
+                interaction_type TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                significant_traits TEXT,
+                created_at REAL NOT NULL
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_interaction_log_user ON interaction_log (user_id, seq)')
+        conn.commit()
+        conn.close()
+        logger.info("Interaction log initialized successfully")
+    except Exception as e:
+        logger.error(f"Error initializing interaction log: {str(e)}")
+
+def write_interactions(events):
+    """在一个事务中批量写入交互事件"""
+    conn = sqlite3.connect("user.db")
+    try:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executemany('''
+            INSERT INTO interaction_log
+            (user_id, content_id, interaction_type, content_type, significant_traits, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (
+                str(event['user_id']),
+                str(event['content_id']),
+                event['interaction_type'],
+                event['content_type'],
+                json.dumps(event.get('significant_traits') or [], ensure_ascii=False),
+                event['created_at']
+            )
+            for event in events
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+class BufferedInteractionWriter:
+    """交互事件的异步缓冲写入（group commit）
+
+    请求只把事件放入有界队列；后台任务在攒够 batch_size 条或距首条事件超过 flush_interval 秒时
+    一次性写入 interaction_log，随后依次调用 on_flush 回调。队列满时 submit 在 put_timeout 内
+    等待，仍无空位则拒绝（背压）。停止时写完队列中剩余事件，写入失败的事件落盘到 spill_file，
+    下次启动时补写。
+    """
+
+    def __init__(self, on_flush=(), max_queue=10000, batch_size=500, flush_interval=0.2,
+                 put_timeout=0.05, spill_file=SPILL_FILE):
+        self.on_flush = list(on_flush)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.spill_file = spill_file
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flush_count = 0
+        self.spilled = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self._queue = None
+        self._stopping = None
+        self._task = None
+
+    async def submit(self, event):
+        """提交一个交互事件，返回是否被接受"""
+        event = dict(event, created_at=event.get('created_at') or time.time())
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(event), timeout=self.put_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+        self.accepted += 1
+        return True
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        write_interactions(batch)
+        # 事件已持久化，回调失败只记录日志
+        for callback in self.on_flush:
+            try:
+                callback(batch)
+            except Exception as e:
+                logger.error(f"Error in interaction flush callback: {str(e)}")
+        elapsed = time.perf_counter() - start
+        self.flushed += len(batch)
+        self.flush_count += 1
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _spill(self, batch):
+        os.makedirs(os.path.dirname(self.spill_file) or '.', exist_ok=True)
+        with open(self.spill_file, 'a', encoding='utf-8') as f:
+            for event in batch:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.spilled += len(batch)
+        logger.warning(f"Spilled {len(batch)} interactions to {self.spill_file}")
+
+    def _recover_spill(self):
+        """补写上次停止时落盘的事件"""
+        if not os.path.exists(self.spill_file):
+            return 0
+        with open(self.spill_file, 'r', encoding='utf-8') as f:
+            events = [json.loads(line) for line in f if line.strip()]
+        for i in range(0, len(events), self.batch_size):
+            self._flush(events[i:i + self.batch_size])
+        os.remove(self.spill_file)
+        logger.info(f"Recovered {len(events)} spilled interactions")
+        return len(events)
+
+    async def _collect(self):
+        """收集一批事件：等待首条事件，然后在 flush_interval 内尽量攒满一批"""
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval))
+        except asyncio.TimeoutError:
+            return batch
+        deadline = loop.time() + (0 if self._stopping.is_set() else self.flush_interval)
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if batch:
+                try:
+                    await asyncio.to_thread(self._flush, batch)
+                except Exception as e:
+                    logger.error(f"Error flushing {len(batch)} interactions: {str(e)}")
+                    await asyncio.to_thread(self._spill, batch)
+            if self._stopping.is_set() and self._queue.empty():
+                return
+
+    async def start(self):
+        """补写落盘事件并启动后台写入任务"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = asyncio.Event()
+        try:
+            await asyncio.to_thread(self._recover_spill)
+        except Exception as e:
+            logger.error(f"Error recovering spilled interactions: {str(e)}")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info("Buffered interaction writer started")
+
+    async def stop(self, timeout=10.0):
+        """写完剩余事件后停止；超时未写完的事件落盘"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            remaining = []
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            if remaining:
+                self._spill(remaining)
+        self._task = None
+        logger.info("Buffered interaction writer stopped")
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "flush_count": self.flush_count,
+            "spilled": self.spilled,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+            "avg_flush_seconds": round(self.total_flush_seconds / self.flush_count, 4) if self.flush_count else 0.0,
+            "max_flush_seconds": round(self.max_flush_seconds, 4)
+        }
@@ -0,0 +1,227 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 设置 METRICS_ENABLED=0 关闭指标采集；请求级耗时分解仍可按请求开启
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# 请求头带上 X-Timing: 1（或查询参数 timing=1）时，在响应的 Server-Timing 头中返回各阶段耗时
+TIMING_HEADER = "X-Timing"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value, *extra in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, key, *extra)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(_Metric):
+    """数值型指标；提供 func 时在采集时调用 func() 取值
+
+    func 可返回单个数值，或 {标签值: 数值} 字典。已有统计计数（如缓存命中次数）可通过 kind="counter"
+    以计数器类型导出，热路径上不增加任何开销。
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), func=None, kind=None):
+        super().__init__(name, help_text, labelnames)
+        self.func = func
+        if kind:
+            self.kind = kind
+
+    def set(self, value, **labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self.func is None:
+            return super().samples()
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.error(f"Error collecting metric {self.name}: {str(e)}")
+            return []
+        if isinstance(value, dict):
+            # {标签值（多个标签时为元组）: 数值}
+            return [
+                (self.name, tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))), val)
+                for key, val in value.items()
+            ]
+        return [(self.name, (), value)]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            entries = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append((f"{self.name}_bucket", key, cumulative, (("le", le),)))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=(), func=None, kind=None):
+        """注册 gauge；同名指标重复注册时以新的 func 为准"""
+        metric = self._get_or_create(Gauge, name, help_text, labelnames, kind=kind)
+        if func is not None:
+            metric.func = func
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("stage_duration_seconds", "Latency of hot-path stages", ("stage",))
+LLM_FALLBACKS = REGISTRY.counter("llm_fallbacks_total", "LLM calls that fell back to default scores", ("operation",))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "endpoint", "status")
+)
+
+def record_stage(stage, seconds):
+    """记录一个阶段的耗时（直方图，以及开启时的请求级耗时分解）"""
+    if ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage):
+    """统计代码块耗时；指标关闭且当前请求未开启耗时分解时不计时"""
+    if not ENABLED and _request_timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def install(app):
+    """为 Quart 应用注册 /metrics 端点、请求耗时直方图和 Server-Timing 响应头"""
+    from quart import Response, g, request
+
+    @app.before_request
+    async def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        if request.headers.get(TIMING_HEADER) == "1" or request.args.get("timing") == "1":
+            _request_timings.set({})
+
+    @app.after_request
+    async def finish_request_metrics(response):
+        start = getattr(g, "metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+        timings = _request_timings.get()
+        if timings is not None:
+            parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items()]
+            parts.append(f"total;dur={elapsed * 1000:.2f}")
+            response.headers["Server-Timing"] = ", ".join(parts)
+            _request_timings.set(None)
+        return response
+
+    @app.route('/metrics')
+    async def prometheus_metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
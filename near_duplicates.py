@@ -0,0 +1,153 @@
+import re
+import threading
+import zlib
+import numpy as np
+
+# 估计 Jaccard 相似度不低于该值的商单视为近似重复
+DUPLICATE_THRESHOLD = 0.8
+# 128 个哈希分为 16 个 band（每个 8 行），候选召回的 S 曲线拐点约为 (1/16)^(1/8) ≈ 0.71
+NUM_PERM = 128
+NUM_BANDS = 16
+SHINGLE_SIZE = 3
+
+# 小于 2^32 的最大素数；a、b 和 shingle 哈希都小于 2^32，a * x + b 不会超出 uint64
+_PRIME = (1 << 32) - 5
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_NORMALIZE_PATTERN = re.compile(r'[\s\W_]+', re.UNICODE)
+
+def shingles(text, size=SHINGLE_SIZE):
+    """去掉空白和标点后的字符 k-gram 集合"""
+    text = _NORMALIZE_PATTERN.sub('', (text or '').lower())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def first_per_cluster(items, cluster_of, limit=None, skip=None):
+    """按顺序保留每个簇的第一条，最多 limit 条
+
+    skip(item) 为真的条目在折叠前排除，不占用所在的簇：例如排除用户自己的商单后，
+    与之近似重复的其他用户的商单仍可保留。
+    """
+    seen = set()
+    kept = []
+    for item in items:
+        if skip is not None and skip(item):
+            continue
+        cluster = cluster_of(item)
+        if cluster in seen:
+            continue
+        seen.add(cluster)
+        kept.append(item)
+        if limit is not None and len(kept) >= limit:
+            break
+    return kept
+
+class NearDuplicateIndex:
+    """基于 MinHash + LSH 的近似重复检测
+
+    每条文本按字符 shingle 计算 MinHash 签名，签名分 band 后写入哈希桶。新文本只与共享至少一个
+    桶的已有文本比较（与总量无关的亚线性查找），估计相似度达到 threshold 时归入该文本所在的簇，
+    以簇中最早出现的记录作为规范 id。已登记的记录内容变化时，先从原有的桶中移除旧签名再重新归簇；
+    以它为规范 id 的其他记录仍保留原簇 id。
+    """
+
+    def __init__(self, threshold=DUPLICATE_THRESHOLD, num_perm=NUM_PERM, bands=NUM_BANDS,
+                 shingle_size=SHINGLE_SIZE, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._signatures = {}
+        # 记录文本的校验值，内容未变化的重复登记不再计算签名
+        self._fingerprints = {}
+        self._buckets = [{} for _ in range(bands)]
+        self._canonical = {}
+        self.duplicates = 0
+
+    def signature(self, text):
+        values = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(text, self.shingle_size)),
+            dtype=np.uint64
+        )
+        if not len(values):
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashed = (np.outer(self._a, values) + self._b[:, None]) % np.uint64(_PRIME)
+        return hashed.min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _remove(self, key):
+        """从桶中移除记录的旧签名（调用方持有锁）"""
+        signature = self._signatures.pop(key)
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.remove(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+        if self._canonical.pop(key) != key:
+            self.duplicates -= 1
+        del self._fingerprints[key]
+
+    def add(self, key, text, canonical=None):
+        """登记或更新一条记录，返回其规范 id（没有近似重复时为 key 本身）
+
+        canonical 用于恢复已持久化的聚类结果，此时只登记签名，不再查找重复。
+        """
+        fingerprint = zlib.crc32((text or '').encode('utf-8'))
+        with self._lock:
+            if self._fingerprints.get(key) == fingerprint:
+                return self._canonical[key]
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            if self._fingerprints.get(key) == fingerprint:
+                return self._canonical[key]
+            if key in self._canonical:
+                # 内容已修改：按新签名重新归簇
+                self._remove(key)
+            if canonical is None:
+                candidates = set()
+                for band, band_key in enumerate(band_keys):
+                    candidates.update(self._buckets[band].get(band_key, ()))
+                canonical = key
+                best = self.threshold
+                for candidate in candidates:
+                    similarity = float(np.mean(self._signatures[candidate] == signature))
+                    if similarity >= best:
+                        best = similarity
+                        canonical = self._canonical[candidate]
+            if canonical != key:
+                self.duplicates += 1
+            self._canonical[key] = canonical
+            self._signatures[key] = signature
+            self._fingerprints[key] = fingerprint
+            for band, band_key in enumerate(band_keys):
+                self._buckets[band].setdefault(band_key, []).append(key)
+            return canonical
+
+    def canonical_of(self, key):
+        """记录的规范 id；未登记的记录返回其自身"""
+        return self._canonical.get(key, key)
+
+    def __contains__(self, key):
+        return key in self._canonical
+
+    def __len__(self):
+        return len(self._canonical)
+
+    def stats(self):
+        return {
+            "orders": len(self._canonical),
+            "duplicates": self.duplicates,
+            "clusters": len(set(self._canonical.values())),
+            "threshold": self.threshold
+        }
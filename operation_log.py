@@ -0,0 +1,211 @@
+import sqlite3
+import json
+import os
+import hashlib
+import logging
+import threading
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 历史操作日志缓存文件（按顺序查找第一个存在的文件）
+OPERATIONS_JSON_FILES = ("user_operations.json", os.path.join("cache", "user_operations.json"))
+
+# 已导入的操作日志文件版本（修改时间:大小），文件未变化时读取前的同步只需一次 stat
+_synced_versions = {}
+_sync_lock = threading.Lock()
+
+def init_operation_log():
+    """初始化用户操作日志表
+
+    只追加不修改；(user_id, op_time, seq) 索引使"最近 N 条"和时间范围查询为 O(log n + k)。
+    """
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS user_operation_log (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                op_time TEXT NOT NULL,
+                action TEXT NOT NULL,
+                detail TEXT,
+                fingerprint TEXT NOT NULL UNIQUE
+            )
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_operation_log_user_time
+            ON user_operation_log (user_id, op_time, seq)
+        ''')
+        # 各操作日志文件最近一次导入时的版本，作为增量导入的水位线
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS operation_log_sources (
+                path TEXT PRIMARY KEY,
+                version TEXT NOT NULL
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+        logger.info("Operation log initialized successfully")
+    except Exception as e:
+        logger.error(f"Error initializing operation log: {str(e)}")
+
+def _operation_row(op):
+    """将操作记录转换为写入参数，指纹用于导入时去重"""
+    user_id = str(op['user_id'])
+    detail = json.dumps(op.get('detail'), ensure_ascii=False, sort_keys=True)
+    fingerprint = hashlib.sha1(
+        f"{user_id}\x1f{op['time']}\x1f{op['action']}\x1f{detail}".encode('utf-8')
+    ).hexdigest()
+    return (user_id, op['time'], op['action'], detail, fingerprint)
+
+def _operation_dict(row):
+    user_id, op_time, action, detail = row
+    return {
+        'user_id': user_id,
+        'action': action,
+        'time': op_time,
+        'detail': json.loads(detail) if detail is not None else None
+    }
+
+def append_operations(operations, batch_size=5000):
+    """批量追加操作记录，已存在的记录会被跳过；返回新写入的条数"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        before = conn.total_changes
+        batch = []
+        for op in operations:
+            batch.append(_operation_row(op))
+            if len(batch) >= batch_size:
+                c.executemany('''
+                    INSERT OR IGNORE INTO user_operation_log (user_id, op_time, action, detail, fingerprint)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', batch)
+                batch = []
+        if batch:
+            c.executemany('''
+                INSERT OR IGNORE INTO user_operation_log (user_id, op_time, action, detail, fingerprint)
+                VALUES (?, ?, ?, ?, ?)
+            ''', batch)
+        conn.commit()
+        inserted = conn.total_changes - before
+        conn.close()
+        return inserted
+    except Exception as e:
+        logger.error(f"Error appending operations: {str(e)}")
+        return 0
+
+def get_recent_operations(user_id, limit=10):
+    """获取用户最近的 limit 条操作，按时间倒序"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        c.execute('''
+            SELECT user_id, op_time, action, detail FROM user_operation_log
+            WHERE user_id = ?
+            ORDER BY op_time DESC, seq DESC
+            LIMIT ?
+        ''', (str(user_id), limit))
+        operations = [_operation_dict(row) for row in c.fetchall()]
+        conn.close()
+        return operations
+    except Exception as e:
+        logger.error(f"Error getting recent operations for user {user_id}: {str(e)}")
+        return []
+
+def iter_operations(batch_size=5000, after_seq=0):
+    """按写入顺序分批遍历 seq 大于 after_seq 的操作记录，每条记录附带其 seq"""
+    conn = sqlite3.connect("user.db")
+    try:
+        last_seq = after_seq
+        while True:
+            rows = conn.execute('''
+                SELECT seq, user_id, op_time, action, detail FROM user_operation_log
+                WHERE seq > ? ORDER BY seq LIMIT ?
+            ''', (last_seq, batch_size)).fetchall()
+            if not rows:
+                break
+            last_seq = rows[-1][0]
+            for row in rows:
+                op = _operation_dict(row[1:])
+                op['seq'] = row[0]
+                yield op
+    finally:
+        conn.close()
+
+def count_operations():
+    """统计操作日志总条数"""
+    try:
+        conn = sqlite3.connect("user.db")
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM user_operation_log')
+        count = c.fetchone()[0]
+        conn.close()
+        return count
+    except Exception as e:
+        logger.error(f"Error counting operations: {str(e)}")
+        return 0
+
+def _find_operations_json():
+    return next((path for path in OPERATIONS_JSON_FILES if os.path.exists(path)), None)
+
+def _load_operations_json(json_file):
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    operations = data['operations'] if isinstance(data, dict) else data
+    return append_operations(operations)
+
+def import_operations_json(json_file=None):
+    """从 user_operations.json 批量导入操作日志（可重复执行），返回新导入的条数"""
+    if json_file is None:
+        json_file = _find_operations_json()
+        if json_file is None:
+            logger.info("No user operations JSON file found, skipping import")
+            return 0
+    try:
+        inserted = _load_operations_json(json_file)
+        logger.info(f"Imported {inserted} operations from {json_file}")
+        return inserted
+    except Exception as e:
+        logger.error(f"Error importing operations from {json_file}: {str(e)}")
+        return 0
+
+def sync_operations_json(json_file=None):
+    """操作日志文件发生变化（修改时间或大小）时重新导入，返回新导入的条数
+
+    文件仍由原有流程写入，日志存储只是它的索引副本；导入按指纹去重，可重复执行。
+    导入成功后才记录文件版本，失败时下次读取会重试。
+    """
+    json_file = json_file or _find_operations_json()
+    if json_file is None:
+        return 0
+    try:
+        stat = os.stat(json_file)
+    except OSError:
+        return 0
+    version = f"{stat.st_mtime_ns}:{stat.st_size}"
+    if _synced_versions.get(json_file) == version:
+        return 0
+    with _sync_lock:
+        if _synced_versions.get(json_file) == version:
+            return 0
+        try:
+            conn = sqlite3.connect("user.db")
+            row = conn.execute('SELECT version FROM operation_log_sources WHERE path = ?', (json_file,)).fetchone()
+            inserted = 0
+            if row is None or row[0] != version:
+                inserted = _load_operations_json(json_file)
+                conn.execute('INSERT OR REPLACE INTO operation_log_sources (path, version) VALUES (?, ?)',
+                             (json_file, version))
+                conn.commit()
+                logger.info(f"Synced {inserted} new operations from {json_file}")
+            conn.close()
+            _synced_versions[json_file] = version
+            return inserted
+        except Exception as e:
+            logger.error(f"Error syncing operations from {json_file}: {str(e)}")
+            return 0
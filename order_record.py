@@ -0,0 +1,89 @@
+# 规范字段名，以及导入数据（orders.json、user_orders.json、旧版向量库元数据）中出现过的其他写法；
+# 字段顺序与 business_orders 的写入列顺序一致
+FIELD_ALIASES = {
+    "user_id": ("user_id", "User ID"),
+    "corresponding_role": ("corresponding_role", "Corresponding role"),
+    "classification": ("classification", "Classification of wishes"),
+    "wish_title": ("wish_title", "Wish title"),
+    "wish_details": ("wish_details", "Details of the wish"),
+}
+ORDER_FIELDS = tuple(FIELD_ALIASES)
+
+class OrderRecord:
+    """规范化的商单记录
+
+    在导入时（JSON 文件、接口写入、向量库元数据）只做一次字段名归一，之后检索、去重和序列化直接读取属性，
+    不再逐个字段探测不同写法。使用 __slots__ 保持紧凑；canonical_id 为近似重复簇的规范 id。
+    """
+    __slots__ = ORDER_FIELDS + ("canonical_id",)
+
+    def __init__(self, user_id=None, wish_title=None, corresponding_role=None, classification=None,
+                 wish_details=None, canonical_id=None):
+        self.user_id = user_id
+        self.wish_title = wish_title
+        self.corresponding_role = corresponding_role
+        self.classification = classification
+        self.wish_details = wish_details
+        self.canonical_id = canonical_id
+
+    @property
+    def key(self):
+        """商单标识 "用户_标题"，随字段修改而变化"""
+        return f"{self.user_id}_{self.wish_title}"
+
+    @classmethod
+    def from_dict(cls, order):
+        """从任意字段写法的商单字典构造；已是 OrderRecord 时原样返回"""
+        if isinstance(order, cls):
+            return order
+        if not isinstance(order, dict):
+            raise TypeError(f"Unsupported order type: {type(order).__name__}")
+        fields = {}
+        for field, aliases in FIELD_ALIASES.items():
+            for alias in aliases:
+                if alias in order:
+                    fields[field] = order[alias]
+                    break
+        return cls(canonical_id=order.get("canonical_id"), **fields)
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """从向量库元数据构造；规范格式直接读取，旧版集合中的混合写法按 from_dict 归一"""
+        if "wish_title" not in metadata:
+            return cls.from_dict(metadata)
+        return cls(
+            metadata.get("user_id"),
+            metadata.get("wish_title"),
+            metadata.get("corresponding_role"),
+            metadata.get("classification"),
+            metadata.get("wish_details"),
+            metadata.get("canonical_id")
+        )
+
+    def to_dict(self):
+        """接口返回的商单字段"""
+        return {
+            "user_id": self.user_id,
+            "wish_title": self.wish_title,
+            "corresponding_role": self.corresponding_role,
+            "classification": self.classification,
+            "wish_details": self.wish_details,
+        }
+
+    def to_metadata(self):
+        """向量库元数据（规范字段名）；chromadb 不接受 None 值，缺失字段不写入"""
+        metadata = {field: getattr(self, field) for field in ORDER_FIELDS if getattr(self, field) is not None}
+        if self.canonical_id:
+            metadata["canonical_id"] = self.canonical_id
+        return metadata
+
+    def to_row(self):
+        """写入 business_orders 的参数元组，按 ORDER_FIELDS 的顺序；缺少字段时抛出 KeyError"""
+        row = tuple(getattr(self, field) for field in ORDER_FIELDS)
+        for field, value in zip(ORDER_FIELDS, row):
+            if value is None:
+                raise KeyError(field)
+        return row
+
+    def __repr__(self):
+        return f"OrderRecord(key={self.key!r}, classification={self.classification!r})"
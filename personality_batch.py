@@ -0,0 +1,163 @@
+import sqlite3
+import json
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+from behavior_aggregates import INTERACTION_WEIGHTS
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WATERMARK_NAME = "personality_scores"
+# 每次加权交互对相关特征分数的调整步长
+TRAIT_STEP = 0.1
+# 分数下限；上限只在分数原本不超过 SCORE_MAX 时生效，避免截断既有的更高分数
+SCORE_MIN = 0.0
+SCORE_MAX = 10.0
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+class PersonalityBatchUpdater:
+    """按水位线增量地批量更新性格分数
+
+    每次按 seq 顺序读取 interaction_log 中水位线之后的一段事件，用 NumPy 一次性累加这段事件涉及的
+    全部用户的特征增量；只读取和写回这些用户，按特征列 executemany 更新 personality 表、写入
+    personality_changes，并在同一事务中把水位线推进到这段事件的最后一条。
+    """
+
+    def __init__(self, personality_matrix, chunk_size=100000):
+        self.matrix = personality_matrix
+        self.chunk_size = chunk_size
+        # 并发调用时同一段事件只处理一次
+        self._lock = threading.Lock()
+
+    def init(self):
+        try:
+            conn = sqlite3.connect("user.db")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS batch_watermarks (
+                    name TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL
+                )
+            ''')
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error initializing batch watermarks: {str(e)}")
+
+    def _compute(self, events, trait_index):
+        """计算一批事件的特征增量，返回 (用户列表, 特征增量矩阵)"""
+        users = {}
+        rows, cols, weights = [], [], []
+        for user_id, interaction_type, significant_traits in events:
+            traits = [trait for trait in json.loads(significant_traits or '[]') if trait in trait_index]
+            if not traits:
+                continue
+            row = users.setdefault(str(user_id), len(users))
+            weight = INTERACTION_WEIGHTS.get(interaction_type, 1.0) * TRAIT_STEP
+            for trait in traits:
+                rows.append(row)
+                cols.append(trait_index[trait])
+                weights.append(weight)
+        deltas = np.zeros((len(users), len(trait_index)), dtype=np.float64)
+        if rows:
+            np.add.at(deltas, (np.array(rows), np.array(cols)), np.array(weights))
+        return list(users), deltas
+
+    def run(self):
+        """处理水位线之后的全部新事件，返回 (是否成功, {user_id: {特征: {old_score, new_score, change}}})"""
+        with self._lock:
+            conn = sqlite3.connect("user.db")
+            try:
+                traits = [column[1] for column in conn.execute('PRAGMA table_info(personality)')][1:]
+                trait_index = {trait: j for j, trait in enumerate(traits)}
+                has_changes = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'personality_changes'"
+                ).fetchone() is not None
+                row = conn.execute('SELECT seq FROM batch_watermarks WHERE name = ?', (WATERMARK_NAME,)).fetchone()
+                watermark = row[0] if row else 0
+                changes = {}
+                while True:
+                    rows = conn.execute('''
+                        SELECT seq, user_id, interaction_type, significant_traits FROM interaction_log
+                        WHERE seq > ? ORDER BY seq LIMIT ?
+                    ''', (watermark, self.chunk_size)).fetchall()
+                    if not rows:
+                        break
+                    # 水位线取自本批实际处理的最后一条事件
+                    new_watermark = rows[-1][0]
+                    user_ids, deltas = self._compute([r[1:] for r in rows], trait_index)
+                    self._apply(conn, traits, user_ids, deltas, new_watermark, has_changes, changes)
+                    watermark = new_watermark
+                logger.info(f"Updated personality scores for {len(changes)} users (interactions up to {watermark})")
+                return True, changes
+            except Exception as e:
+                logger.error(f"Error updating personality scores: {str(e)}")
+                return False, None
+            finally:
+                conn.close()
+
+    def _apply(self, conn, traits, user_ids, deltas, watermark, has_changes, changes):
+        """将增量写回受影响用户的分数，记录变化并推进水位线；之后同步性格分数矩阵"""
+        trait_columns = ', '.join(_quote(trait) for trait in traits)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 在写事务中读取受影响用户的当前分数，避免覆盖其他写入；还没有分数行的用户先补建
+            old = np.full((len(user_ids), len(traits)), np.nan)
+            position = {user_id: i for i, user_id in enumerate(user_ids)}
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                conn.executemany('INSERT OR IGNORE INTO personality (id) VALUES (?)', [(user_id,) for user_id in chunk])
+                for score_row in conn.execute(
+                    f"SELECT id, {trait_columns} FROM personality WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ):
+                    old[position[str(score_row[0])]] = [np.nan if val is None else val for val in score_row[1:]]
+
+            upper = np.maximum(SCORE_MAX, np.nan_to_num(old, nan=SCORE_MAX))
+            new = np.clip(np.nan_to_num(old, nan=0.0) + deltas, SCORE_MIN, upper)
+            changed = (deltas != 0) & (new != old)
+
+            for col in np.flatnonzero(changed.any(axis=0)):
+                user_rows = np.flatnonzero(changed[:, col])
+                conn.executemany(
+                    f'UPDATE personality SET {_quote(traits[col])} = ? WHERE id = ?',
+                    [(float(new[r, col]), user_ids[r]) for r in user_rows]
+                )
+            user_rows, cols = np.nonzero(changed)
+            if has_changes and len(user_rows):
+                change_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                conn.executemany('''
+                    INSERT INTO personality_changes (user_id, trait_name, old_value, new_value, change_time)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [
+                    (user_ids[r], traits[c], None if np.isnan(old[r, c]) else float(old[r, c]), float(new[r, c]),
+                     change_time)
+                    for r, c in zip(user_rows, cols)
+                ])
+            conn.execute('''
+                INSERT INTO batch_watermarks (name, seq) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET seq = excluded.seq
+            ''', (WATERMARK_NAME, watermark))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        for r in np.flatnonzero(changed.any(axis=1)):
+            user_id = user_ids[r]
+            cols = np.flatnonzero(changed[r])
+            user_changes = changes.setdefault(user_id, {})
+            for col in cols:
+                trait = traits[col]
+                old_score = user_changes.get(trait, {}).get(
+                    'old_score', None if np.isnan(old[r, col]) else float(old[r, col])
+                )
+                user_changes[trait] = {
+                    'old_score': old_score,
+                    'new_score': float(new[r, col]),
+                    'change': round(float(new[r, col]) - (old_score or 0.0), 4)
+                }
+            self.matrix.update_user(user_id, {traits[col]: float(new[r, col]) for col in cols})
@@ -0,0 +1,184 @@
+import sqlite3
+import logging
+import threading
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PersonalityMatrix:
+    """用户 × 性格特征的分数矩阵
+
+    启动时从宽表 personality 一次性载入，缺失值记为 NaN；分数更新时按用户同步。
+    在此基础上提供批量 top 特征查询和相似用户查询。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.user_ids = []
+        self.user_index = {}
+        self.traits = []
+        self.trait_index = {}
+        self.scores = np.empty((0, 0), dtype=np.float64)
+        self._centered = None
+
+    def load(self):
+        """从 personality 表载入全部用户的分数"""
+        try:
+            conn = sqlite3.connect("user.db")
+            c = conn.cursor()
+            cursor = c.execute("SELECT * FROM personality")
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error loading personality matrix: {str(e)}")
+            return False
+
+        # 第一列为用户 id，其余为特征列
+        scores = np.array(
+            [[np.nan if val is None else val for val in row[1:]] for row in rows],
+            dtype=np.float64
+        ).reshape(len(rows), len(columns) - 1)
+        with self._lock:
+            self.user_ids = [str(row[0]) for row in rows]
+            self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+            self.traits = columns[1:]
+            self.trait_index = {trait: j for j, trait in enumerate(self.traits)}
+            self.scores = scores
+            self._centered = None
+        logger.info(f"Loaded personality matrix: {len(self.user_ids)} users x {len(self.traits)} traits")
+        return True
+
+    def refresh_user(self, user_id):
+        """从数据库重新读取单个用户的分数，返回是否找到该用户"""
+        try:
+            conn = sqlite3.connect("user.db")
+            c = conn.cursor()
+            cursor = c.execute("SELECT * FROM personality WHERE id = ?", (user_id,))
+            columns = [description[0] for description in cursor.description]
+            row = cursor.fetchone()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error refreshing personality for user {user_id}: {str(e)}")
+            return False
+        if row is None:
+            return False
+        self.update_user(user_id, dict(zip(columns[1:], row[1:])))
+        return True
+
+    def refresh_users(self, user_ids, chunk_size=500):
+        """批量从数据库重新读取多个用户的分数，返回找到的用户数"""
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        found = 0
+        try:
+            conn = sqlite3.connect("user.db")
+            c = conn.cursor()
+            for i in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[i:i + chunk_size]
+                cursor = c.execute(
+                    f"SELECT * FROM personality WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                columns = [description[0] for description in cursor.description]
+                for row in cursor.fetchall():
+                    self.update_user(row[0], dict(zip(columns[1:], row[1:])))
+                    found += 1
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error refreshing personality for {len(user_ids)} users: {str(e)}")
+        return found
+
+    def update_user(self, user_id, scores):
+        """用 {特征: 分数} 更新单个用户；新用户和新特征会扩展矩阵"""
+        user_id = str(user_id)
+        with self._lock:
+            new_traits = [trait for trait in scores if trait not in self.trait_index]
+            if new_traits:
+                for trait in new_traits:
+                    self.trait_index[trait] = len(self.traits)
+                    self.traits.append(trait)
+                padding = np.full((self.scores.shape[0], len(new_traits)), np.nan)
+                self.scores = np.hstack([self.scores, padding])
+            row = self.user_index.get(user_id)
+            if row is None:
+                row = len(self.user_ids)
+                self.user_ids.append(user_id)
+                self.user_index[user_id] = row
+                self.scores = np.vstack([self.scores, np.full((1, len(self.traits)), np.nan)])
+            for trait, val in scores.items():
+                self.scores[row, self.trait_index[trait]] = np.nan if val is None else float(val)
+            self._centered = None
+
+    def get(self, user_id):
+        """获取用户的 {特征: 分数}（不含缺失值），用户不存在时返回 None"""
+        with self._lock:
+            row = self.user_index.get(str(user_id))
+            if row is None:
+                return None
+            values = self.scores[row]
+            return {trait: float(values[j]) for j, trait in enumerate(self.traits) if not np.isnan(values[j])}
+
+    def top_traits(self, user_ids, k=10):
+        """批量获取多个用户分数最高的 k 个特征，返回 {user_id: [(特征, 分数), ...]}"""
+        with self._lock:
+            found = [str(user_id) for user_id in user_ids if str(user_id) in self.user_index]
+            if not found or not self.traits or k <= 0:
+                return {user_id: [] for user_id in found}
+            block = self.scores[[self.user_index[user_id] for user_id in found]]
+            traits = self.traits
+
+        filled = np.where(np.isnan(block), -np.inf, block)
+        k = min(k, filled.shape[1])
+        # argpartition 选出前 k 个，再只对这 k 个排序
+        top = np.argpartition(-filled, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(filled, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        result = {}
+        for i, user_id in enumerate(found):
+            result[user_id] = [
+                (traits[j], float(score)) for j, score in zip(top[i], top_scores[i]) if np.isfinite(score)
+            ]
+        return result
+
+    def _centered_scores(self):
+        """按行减去该用户已有分数的均值，缺失值置 0 并返回观测掩码，结果缓存到下一次更新"""
+        if self._centered is None:
+            observed = ~np.isnan(self.scores)
+            counts = observed.sum(axis=1, keepdims=True)
+            means = np.where(observed, self.scores, 0.0).sum(axis=1, keepdims=True) / np.maximum(counts, 1)
+            centered = np.where(observed, self.scores - means, 0.0)
+            self._centered = (centered, observed.astype(np.float64))
+        return self._centered
+
+    def similar_users(self, user_id, k=10, min_overlap=2):
+        """按性格分数的相关系数查找最相似的 k 个用户，返回 [(user_id, 相似度), ...]
+
+        每个用户的分数先减去自身均值，消除整体打分偏高或偏低的影响；只在双方都有分数的特征上计算
+        相似度（缺失值不按 0 参与），共同特征少于 min_overlap 个的用户不参与排序。
+        """
+        with self._lock:
+            row = self.user_index.get(str(user_id))
+            if row is None or len(self.user_ids) < 2 or k <= 0:
+                return []
+            centered, observed = self._centered_scores()
+            user_ids = self.user_ids
+
+        target, target_observed = centered[row], observed[row]
+        # 缺失值已置 0，点积只累加共同特征；范数同样只在共同特征上计算
+        dots = centered @ target
+        norms = np.sqrt((centered ** 2) @ target_observed) * np.sqrt(observed @ (target ** 2))
+        overlap = observed @ target_observed
+        valid = (norms > 0) & (overlap >= min_overlap)
+        valid[row] = False
+        candidates = np.flatnonzero(valid)
+        if not len(candidates):
+            return []
+        similarities = dots[candidates] / norms[candidates]
+        k = min(k, len(candidates))
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [(user_ids[candidates[i]], float(similarities[i])) for i in top]
@@ -0,0 +1,85 @@
+import asyncio
+import inspect
+import logging
+import time
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_REQUIRED = object()
+
+class Stage:
+    """流水线中的一个阶段
+
+    func 接收依赖阶段结果组成的字典；blocking 为 True 时在线程池中执行。
+    超时或出错时，若提供了 default 则以 default 作为结果继续，否则整个流水线失败。
+    """
+    __slots__ = ("name", "func", "deps", "timeout", "blocking", "default")
+
+    def __init__(self, name, func, deps=(), timeout=None, blocking=False, default=_REQUIRED):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.blocking = blocking
+        self.default = default
+
+async def run_stages(stages):
+    """按依赖关系并发执行各阶段，返回 (结果字典, 各阶段耗时)
+
+    每个阶段在其依赖全部完成后立即开始，互不依赖的阶段通过 asyncio.gather 并发执行，
+    总耗时接近关键路径而不是各阶段之和。
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {missing}")
+
+    results = {}
+    timings = {}
+    tasks = {}
+
+    async def run(stage):
+        if stage.deps:
+            await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+        inputs = {dep: results[dep] for dep in stage.deps}
+        start = time.perf_counter()
+        try:
+            if stage.blocking:
+                call = asyncio.to_thread(stage.func, inputs)
+            else:
+                call = stage.func(inputs)
+                if not inspect.isawaitable(call):
+                    results[stage.name] = call
+                    return
+            results[stage.name] = await asyncio.wait_for(call, timeout=stage.timeout)
+        except Exception as e:
+            if stage.default is _REQUIRED:
+                raise
+            if isinstance(e, asyncio.TimeoutError):
+                logger.warning(f"Stage {stage.name} timed out after {stage.timeout}s, using default")
+            else:
+                logger.error(f"Stage {stage.name} failed: {str(e)}, using default")
+            results[stage.name] = stage.default
+        finally:
+            timings[stage.name] = round(time.perf_counter() - start, 4)
+
+    # 按依赖顺序创建任务，保证依赖任务先于使用者创建
+    pending = list(stages)
+    while pending:
+        ready = [stage for stage in pending if all(dep in tasks for dep in stage.deps)]
+        if not ready:
+            raise ValueError(f"Cyclic stage dependencies: {[stage.name for stage in pending]}")
+        for stage in ready:
+            tasks[stage.name] = asyncio.ensure_future(run(stage))
+            pending.remove(stage)
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except Exception:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return results, timings
@@ -0,0 +1,131 @@
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from sentence_transformers import SentenceTransformer
+from db_operation import create_chroma_db
+from business_vector_db import MODEL_PATH
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 单个分块的最大字符数，超长段落按此长度切分
+CHUNK_SIZE = 500
+# 每次写入（并由集合的编码函数批量编码）的分块数
+EMBED_BATCH_SIZE = 64
+
+def chunk_text(text, chunk_size=CHUNK_SIZE):
+    """按段落确定性地分块
+
+    分块边界只取决于段落本身，修改某一段只会影响该段对应的分块，不会使后续分块整体错位。
+    """
+    chunks = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        for start in range(0, len(paragraph), chunk_size):
+            chunks.append(paragraph[start:start + chunk_size])
+    return chunks
+
+def chunk_id(source, chunk):
+    """分块 id 即内容哈希，内容不变则 id 不变"""
+    return hashlib.sha1(f"{source}\0{chunk}".encode('utf-8')).hexdigest()
+
+class RagIndex:
+    """RAG 向量库的后台增量构建
+
+    仍由 db_operation.create_chroma_db 建库，answer_user_query 读取的路径和编码函数由它决定。
+    建库移到工作线程中执行，服务启动不再被阻塞。create_chroma_db 返回集合时，
+    语料按段落分块、以内容哈希作为分块 id 与集合比对：只写入新增或修改的分块（由集合自身的编码函数
+    分批编码），删除已不存在的分块，未变化的分块保持不动，耗时与语料的改动量成正比。
+    首次同步时集合中按其他方式切分的分块会被替换为哈希分块。
+    """
+
+    def __init__(self, collection_name, source_file, model=None):
+        self.collection_name = collection_name
+        self.source_file = source_file
+        self._model = model
+        self._ready = threading.Event()
+        self._task = None
+        self.last_build = None
+        self.error = None
+
+    @property
+    def model(self):
+        """画像语义缓存使用的编码模型，首次使用时加载"""
+        if self._model is None:
+            self._model = SentenceTransformer(MODEL_PATH)
+        return self._model
+
+    def _sync_chunks(self, collection):
+        """按内容哈希将语料分块同步到集合，返回 (分块数, 新增数, 删除数)"""
+        with open(self.source_file, 'r', encoding='utf-8') as f:
+            current = {chunk_id(self.source_file, chunk): chunk for chunk in chunk_text(f.read())}
+        existing = set(collection.get(include=[])['ids'])
+        added = [cid for cid in current if cid not in existing]
+        removed = [cid for cid in existing if cid not in current]
+        for i in range(0, len(added), EMBED_BATCH_SIZE):
+            batch = added[i:i + EMBED_BATCH_SIZE]
+            collection.upsert(
+                ids=batch,
+                documents=[current[cid] for cid in batch],
+                metadatas=[{"source": self.source_file} for _ in batch]
+            )
+        if removed:
+            collection.delete(ids=removed)
+        return len(current), len(added), len(removed)
+
+    def build(self):
+        """检查并构建 RAG 向量库，增量同步语料的改动，返回本次构建的统计信息"""
+        start = time.perf_counter()
+        collection = create_chroma_db(self.collection_name, self.source_file)
+        stats = {"incremental": all(hasattr(collection, name) for name in ("get", "upsert", "delete"))}
+        if stats["incremental"]:
+            chunks, added, removed = self._sync_chunks(collection)
+            stats.update(chunks=chunks, added=added, removed=removed, unchanged=chunks - added)
+        else:
+            logger.warning(f"create_chroma_db did not return a collection, skipping incremental sync "
+                           f"of {self.source_file}")
+        stats.update(
+            elapsed_seconds=round(time.perf_counter() - start, 3),
+            finished_at=time.strftime('%Y-%m-%d %H:%M:%S')
+        )
+        self.last_build = stats
+        logger.info(f"RAG index {self.collection_name} ready: {self.last_build}")
+        return self.last_build
+
+    def _run(self):
+        try:
+            self.build()
+            self.error = None
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Error building RAG index {self.collection_name}: {str(e)}")
+        finally:
+            # 构建失败时沿用已有的向量库继续提供服务
+            self._ready.set()
+
+    def start(self):
+        """在工作线程中构建向量库，不阻塞服务启动"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._run))
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        """等待首次构建完成，返回是否已就绪"""
+        return self._ready.wait(timeout)
+
+    def status(self):
+        return {
+            "collection": self.collection_name,
+            "source": self.source_file,
+            "ready": self.is_ready(),
+            "building": self._task is not None and not self._task.done(),
+            "last_build": self.last_build,
+            "error": self.error
+        }
@@ -0,0 +1,106 @@
+import heapq
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 旧版文本格式中各字段的行前缀
+_TEXT_FIELDS = (
+    ('   描述：', 'description'),
+    ('   推荐理由：', 'reason'),
+    ('   推荐分数：', 'score'),
+    ('   图片链接：', 'image_url'),
+)
+
+class Recommendation:
+    """一条推荐结果
+
+    使用 __slots__ 保持紧凑。由字典构造时保留原字典（source），序列化时按原有的键名和顺序输出；
+    由旧版文本解析时按文本中的字段顺序输出。
+    """
+    __slots__ = ("name", "description", "reason", "score", "image_url", "source")
+
+    def __init__(self, name, score=None, description=None, reason=None, image_url=None, source=None):
+        self.name = name
+        self.description = description
+        self.reason = reason
+        self.score = score
+        self.image_url = image_url
+        self.source = source
+
+    @classmethod
+    def from_dict(cls, item):
+        return cls(
+            name=item.get("name", item.get("title")),
+            score=item.get("score"),
+            description=item.get("description"),
+            reason=item.get("reason"),
+            image_url=item.get("image_url"),
+            source=item
+        )
+
+    def to_dict(self):
+        if self.source is not None:
+            return dict(self.source)
+        result = {}
+        for slot in ("name", "description", "reason", "score", "image_url"):
+            value = getattr(self, slot)
+            if value is not None:
+                result[slot] = value
+        return result
+
+    def __repr__(self):
+        return f"Recommendation(name={self.name!r}, score={self.score})"
+
+def parse_recommendation_text(text):
+    """解析旧版按行排版的推荐文本"""
+    recommendations = []
+    current = None
+    for line in text.split('\n'):
+        if not line.strip():
+            continue
+        for prefix, field in _TEXT_FIELDS:
+            if line.startswith(prefix):
+                if current is not None:
+                    value = line[len(prefix):].strip()
+                    if field == 'score':
+                        try:
+                            current.score = float(value)
+                        except ValueError:
+                            logger.warning(f"Invalid recommendation score: {value}")
+                    else:
+                        setattr(current, field, value)
+                break
+        else:
+            if not line.startswith('   '):
+                current = Recommendation(name=line.strip())
+                recommendations.append(current)
+    return recommendations
+
+def _score_key(recommendation):
+    try:
+        return float(recommendation.score)
+    except (TypeError, ValueError):
+        # 没有分数或分数无法解析的推荐排在最后
+        return float('-inf')
+
+def top_k(recommendations, k):
+    """用堆选出分数最高的 k 条推荐（O(n log k)），按分数从高到低返回；分数相同时保持原有顺序"""
+    indexed = heapq.nlargest(
+        k, enumerate(recommendations), key=lambda item: (_score_key(item[1]), -item[0])
+    )
+    return [recommendation for _, recommendation in indexed]
+
+def to_recommendations(raw, k=None):
+    """将内容管理器返回的结果（记录、字典列表或旧版文本）统一转换为 Recommendation 列表
+
+    k 为 None 时保持内容管理器给出的顺序和条数；指定 k 时只保留分数最高的 k 条。
+    """
+    if not raw:
+        return []
+    if isinstance(raw, str):
+        recommendations = parse_recommendation_text(raw)
+    else:
+        recommendations = [item if isinstance(item, Recommendation) else Recommendation.from_dict(item) for item in raw]
+    return recommendations if k is None else top_k(recommendations, k)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """有容量上限的 LRU 缓存，条目超过 ttl 秒后失效"""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class CoalescingCache:
+    """请求合并（single-flight）+ TTL 响应缓存
+
+    相同 key 的并发请求共享同一次计算；计算结果写入 TTLCache，供后续请求直接复用。
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_compute(self, key, compute, cacheable=lambda result: True):
+        """返回 key 对应的结果；compute 为返回可等待对象的无参函数"""
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # 计算以独立任务运行，不归属于任何一个请求：发起请求被取消（例如客户端断开）时，
+            # 计算继续进行，其他等待方照常拿到结果
+            task = asyncio.get_running_loop().create_task(self._compute(key, compute, cacheable))
+            # 所有等待方都已取消时，避免 "exception was never retrieved" 警告
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._in_flight[key] = task
+        # 每个等待方（包括发起方）都通过 shield 等待，取消只影响自己
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, compute, cacheable):
+        try:
+            result = await compute()
+            if cacheable(result):
+                self.cache.set(key, result)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def invalidate(self):
+        """清空缓存（正在进行的计算不受影响）"""
+        self.cache.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            "size": len(self.cache),
+            "maxsize": self.cache.maxsize,
+            "ttl_seconds": self.cache.ttl,
+            "in_flight": len(self._in_flight)
+        }
+
+class SemanticCache:
+    """语义响应缓存
+
+    以输入文本的向量为键：查询时与未过期条目做余弦相似度比较，最高相似度不低于 threshold
+    时直接复用已有结果。scope 为必须完全相同的部分（如用户和分数），只在同一 scope 的条目中
+    做相似度比较。容量满时淘汰最久未命中的条目。encode 接收文本列表并返回向量数组。
+    """
+
+    def __init__(self, encode, threshold=0.95, maxsize=1024, ttl=3600.0):
+        self.encode = encode
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._values = [None] * maxsize
+        self._scopes = [None] * maxsize
+        self._scope_hashes = np.zeros(maxsize, dtype=np.int64)
+        self._expires_at = np.full(maxsize, -np.inf)
+        self._last_used = np.zeros(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.similarity_sum = 0.0
+
+    def _embed(self, text):
+        vector = np.asarray(self.encode([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _lookup(self, vector, scope, now):
+        """返回同一 scope 内的 (槽位, 相似度)，没有未过期条目时返回 (None, 0.0)"""
+        if self._vectors is None:
+            return None, 0.0
+        similarities = self._vectors @ vector
+        similarities[(self._expires_at < now) | (self._scope_hashes != hash(scope))] = -np.inf
+        slot = int(np.argmax(similarities))
+        # 哈希相同只是候选，scope 必须完全相等
+        if not np.isfinite(similarities[slot]) or self._scopes[slot] != scope:
+            return None, 0.0
+        return slot, float(similarities[slot])
+
+    def _store(self, vector, scope, value, now):
+        if self._vectors is None:
+            self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+        # 优先使用已过期的槽位，否则淘汰最久未使用的条目
+        expired = np.flatnonzero(self._expires_at < now)
+        slot = int(expired[0]) if len(expired) else int(np.argmin(self._last_used))
+        self._vectors[slot] = vector
+        self._values[slot] = value
+        self._scopes[slot] = scope
+        self._scope_hashes[slot] = hash(scope)
+        self._expires_at[slot] = now + self.ttl
+        self._last_used[slot] = now
+
+    def get_or_compute(self, text, compute, cacheable=lambda result: True, scope=None):
+        """返回同一 scope 内与 text 语义相近的已缓存结果，否则调用 compute() 计算并缓存"""
+        try:
+            vector = self._embed(text)
+        except Exception as e:
+            # 编码失败时退化为直接计算
+            self.errors += 1
+            logger.error(f"Error embedding semantic cache key: {str(e)}")
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            slot, similarity = self._lookup(vector, scope, now)
+            if slot is not None and similarity >= self.threshold:
+                self.hits += 1
+                self.similarity_sum += similarity
+                self._last_used[slot] = now
+                return self._values[slot]
+            self.misses += 1
+
+        result = compute()
+        if cacheable(result):
+            with self._lock:
+                self._store(vector, scope, result, time.monotonic())
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._values = [None] * self.maxsize
+            self._scopes = [None] * self.maxsize
+            self._expires_at[:] = -np.inf
+
+    def __len__(self):
+        return int(np.count_nonzero(self._expires_at >= time.monotonic()))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_hit_similarity": round(self.similarity_sum / self.hits, 4) if self.hits else 0.0,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl
+        }
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import business_db
+
+def _order(user_id, title, details):
+    return {
+        'user_id': user_id,
+        'wish_title': title,
+        'corresponding_role': '创作者',
+        'classification': '视频',
+        'wish_details': details
+    }
+
+@pytest.fixture(autouse=True)
+def business_database(tmp_path, monkeypatch):
+    # business_db 使用工作目录下的 user.db，每个用例使用独立目录
+    monkeypatch.chdir(tmp_path)
+    business_db.init_business_db()
+    return tmp_path
+
+def test_single_character_query_matches():
+    business_db.save_business_order(_order("1", "药品短视频", "为药店拍摄宣传片"))
+    business_db.save_business_order(_order("2", "茶饮包装设计", "设计全套包装"))
+    assert [order.wish_title for order in business_db.search_business_orders_fts("药")] == ["药品短视频"]
+    assert [order.wish_title for order in business_db.search_business_orders_fts("包装")] == ["茶饮包装设计"]
+
+def test_search_only_load_keeps_existing_orders_and_listing():
+    business_db.save_business_order(_order("1", "拍视频", "修改后的详情"))
+    stats = business_db.bulk_load_orders(
+        [_order("1", "拍视频", "旧详情"), _order("2", "设计标志", "标志设计")],
+        on_conflict="ignore", search_only=True
+    )
+    assert (stats["inserted"], stats["skipped"]) == (1, 1)
+    # 已有商单不被覆盖，语料商单不出现在列表中，但可以被检索到
+    assert [order["wish_details"] for order in business_db.get_all_business_orders()] == ["修改后的详情"]
+    assert [order.wish_details for order in business_db.search_business_orders_fts("拍视频")] == ["修改后的详情"]
+    assert [order.wish_title for order in business_db.search_business_orders_fts("标志")] == ["设计标志"]
+
+def test_bulk_update_reindexes_changed_orders_only():
+    business_db.bulk_load_orders([_order("1", "拍视频", "美食探店")])
+    stats = business_db.bulk_load_orders([_order("1", "拍视频", "茶饮品牌")])
+    assert stats["updated"] == 1
+    assert business_db.search_business_orders_fts("美食") == []
+    assert [order.wish_details for order in business_db.search_business_orders_fts("茶饮")] == ["茶饮品牌"]
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import interaction_writer
+from interaction_writer import BufferedInteractionWriter, init_interaction_log
+
+def _event(i):
+    return {
+        'user_id': str(i % 3 + 1),
+        'content_id': f"c{i}",
+        'interaction_type': 'like',
+        'content_type': 'Article',
+        'significant_traits': []
+    }
+
+def _logged_count():
+    conn = sqlite3.connect("user.db")
+    try:
+        return conn.execute("SELECT COUNT(*) FROM interaction_log").fetchone()[0]
+    finally:
+        conn.close()
+
+async def _wait_for(condition, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+@pytest.fixture(autouse=True)
+def interaction_db(tmp_path, monkeypatch):
+    # 写入器使用工作目录下的 user.db，每个用例使用独立目录
+    monkeypatch.chdir(tmp_path)
+    init_interaction_log()
+    return tmp_path
+
+def test_flushes_when_batch_is_full():
+    batches = []
+
+    async def scenario():
+        # 间隔远大于等待时间，只有攒满一批才会提交
+        writer = BufferedInteractionWriter(on_flush=[batches.append], batch_size=5, flush_interval=5.0,
+                                           spill_file="spill.jsonl")
+        await writer.start()
+        for i in range(5):
+            assert await writer.submit(_event(i))
+        flushed = await _wait_for(lambda: writer.flushed == 5, timeout=1.0)
+        await writer.stop(timeout=0.1)
+        return flushed, writer
+
+    flushed, writer = asyncio.run(scenario())
+    assert flushed
+    assert writer.flush_count == 1
+    assert [len(batch) for batch in batches] == [5]
+    assert _logged_count() == 5
+
+def test_flushes_partial_batch_after_interval():
+    batches = []
+
+    async def scenario():
+        writer = BufferedInteractionWriter(on_flush=[batches.append], batch_size=100, flush_interval=0.05,
+                                           spill_file="spill.jsonl")
+        await writer.start()
+        for i in range(3):
+            assert await writer.submit(_event(i))
+        flushed = await _wait_for(lambda: writer.flushed == 3)
+        await writer.stop()
+        return flushed, writer
+
+    flushed, writer = asyncio.run(scenario())
+    assert flushed
+    assert writer.flush_count == 1
+    assert [len(batch) for batch in batches] == [3]
+    assert _logged_count() == 3
+
+def test_spills_failed_batches_and_replays_them_on_start(monkeypatch):
+    write_interactions = interaction_writer.write_interactions
+
+    def failing_write(events):
+        raise sqlite3.OperationalError("database is locked")
+
+    async def spill():
+        writer = BufferedInteractionWriter(batch_size=4, flush_interval=0.05, spill_file="spill.jsonl")
+        await writer.start()
+        for i in range(4):
+            assert await writer.submit(_event(i))
+        spilled = await _wait_for(lambda: writer.spilled == 4)
+        await writer.stop()
+        return spilled
+
+    monkeypatch.setattr(interaction_writer, "write_interactions", failing_write)
+    assert asyncio.run(spill())
+    assert os.path.exists("spill.jsonl")
+    assert _logged_count() == 0
+
+    async def replay():
+        writer = BufferedInteractionWriter(batch_size=4, flush_interval=0.05, spill_file="spill.jsonl")
+        await writer.start()
+        await writer.stop()
+        return writer
+
+    monkeypatch.setattr(interaction_writer, "write_interactions", write_interactions)
+    writer = asyncio.run(replay())
+    assert writer.flushed == 4
+    assert not os.path.exists("spill.jsonl")
+    assert _logged_count() == 4
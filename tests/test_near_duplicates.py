@@ -0,0 +1,62 @@
+import os
+import sys
+import warnings
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_duplicates import NearDuplicateIndex, first_per_cluster, shingles, _PRIME
+
+BASE = "需要在上海拍摄一组美食探店短视频，要求三天内完成剪辑并交付成片，预算五千元，按成片数量结算"
+NEAR = "需要在上海拍摄一组美食探店短视频！要求三天内完成剪辑并交付成片，预算五千元，按成片数量结算。"
+OTHER = "为新成立的茶饮品牌设计标志和全套包装，提供三套方案供选择，需附带品牌视觉规范手册"
+
+def test_signature_matches_exact_integer_arithmetic():
+    index = NearDuplicateIndex()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        signature = index.signature(BASE)
+    # 用 Python 任意精度整数计算同一签名，uint64 溢出时两者会不一致
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(BASE)]
+    expected = [
+        min((int(a) * x + int(b)) % _PRIME for x in hashes)
+        for a, b in zip(index._a, index._b)
+    ]
+    assert [int(value) for value in signature] == expected
+
+def test_identical_and_near_identical_texts_share_a_cluster():
+    index = NearDuplicateIndex()
+    assert index.add("a", BASE) == "a"
+    assert index.add("b", BASE) == "a"
+    assert index.add("c", NEAR) == "a"
+    assert index.stats()["clusters"] == 1
+
+def test_distinct_texts_are_not_clustered():
+    index = NearDuplicateIndex()
+    assert index.add("a", BASE) == "a"
+    assert index.add("d", OTHER) == "d"
+    assert index.canonical_of("d") == "d"
+    assert index.stats()["duplicates"] == 0
+
+def test_edited_text_moves_record_to_new_cluster():
+    index = NearDuplicateIndex()
+    assert index.add("a", BASE) == "a"
+    assert index.add("b", NEAR) == "a"
+    assert index.add("c", OTHER) == "c"
+    # b 的内容改为与 c 近似，旧签名从桶中移除后归入 c 所在的簇
+    assert index.add("b", OTHER + "。") == "c"
+    assert index.stats()["duplicates"] == 1
+    assert index.add("d", NEAR) == "a"
+    # 内容未变化时沿用已有的簇
+    assert index.add("b", OTHER + "。") == "c"
+    assert index.stats()["duplicates"] == 2
+
+def test_mixed_owner_cluster_keeps_other_users_duplicate():
+    index = NearDuplicateIndex()
+    orders = [("own", "u1", BASE), ("dup", "u2", NEAR), ("dup2", "u3", BASE + "。"), ("other", "u2", OTHER)]
+    for key, _, text in orders:
+        index.add(key, text)
+    # 用户自己的商单排在最前，排除后同簇中其他用户的商单仍保留；同簇的其余商单只推荐一条
+    kept = first_per_cluster(orders, lambda order: index.canonical_of(order[0]), skip=lambda order: order[1] == "u1")
+    assert [order[0] for order in kept] == ["dup", "other"]
+    assert [order[0] for order in first_per_cluster(orders, lambda order: index.canonical_of(order[0]), limit=1)] == ["own"]
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interaction_writer import init_interaction_log, write_interactions
+from personality_batch import PersonalityBatchUpdater
+from personality_matrix import PersonalityMatrix
+
+def _event(user_id, interaction_type, traits):
+    return {
+        'user_id': user_id,
+        'content_id': 'c1',
+        'interaction_type': interaction_type,
+        'content_type': 'Article',
+        'significant_traits': traits,
+        'created_at': '2026-10-01 10:00:00'
+    }
+
+@pytest.fixture(autouse=True)
+def personality_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect("user.db")
+    conn.execute('CREATE TABLE personality (id TEXT PRIMARY KEY, "开放性" REAL, "外向性" REAL)')
+    conn.execute("INSERT INTO personality VALUES ('1', 5.0, NULL)")
+    conn.execute("INSERT INTO personality VALUES ('9', 8.0, 8.0)")
+    conn.commit()
+    conn.close()
+    init_interaction_log()
+    return tmp_path
+
+def _updater():
+    matrix = PersonalityMatrix()
+    matrix.load()
+    updater = PersonalityBatchUpdater(matrix, chunk_size=2)
+    updater.init()
+    return updater
+
+def test_applies_deltas_to_affected_users_only():
+    write_interactions([
+        _event('1', 'like', ['开放性']),
+        _event('1', 'share', ['开放性', '外向性']),
+        _event('2', 'click', ['外向性'])
+    ])
+    updater = _updater()
+    updated, changes = updater.run()
+    assert updated
+    assert changes['1']['开放性'] == {'old_score': 5.0, 'new_score': pytest.approx(5.7), 'change': 0.7}
+    assert changes['1']['外向性']['new_score'] == pytest.approx(0.4)
+    # 没有分数行的用户会被补建，没有新事件的用户不受影响
+    assert changes['2']['外向性']['new_score'] == pytest.approx(0.2)
+    assert '9' not in changes
+    assert updater.matrix.get('2') == {'外向性': pytest.approx(0.2)}
+
+    conn = sqlite3.connect("user.db")
+    rows = dict((row[0], row[1:]) for row in conn.execute('SELECT * FROM personality'))
+    conn.close()
+    assert rows['9'] == (8.0, 8.0)
+    assert rows['1'] == (pytest.approx(5.7), pytest.approx(0.4))
+
+def test_watermark_skips_processed_events():
+    write_interactions([_event('1', 'like', ['开放性'])])
+    updater = _updater()
+    assert updater.run()[1]['1']['开放性']['new_score'] == pytest.approx(5.3)
+    assert updater.run() == (True, {})
+    write_interactions([_event('1', 'like', ['开放性'])])
+    assert updater.run()[1]['1']['开放性'] == {'old_score': pytest.approx(5.3), 'new_score': pytest.approx(5.6),
+                                              'change': 0.3}
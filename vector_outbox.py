@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from business_db import fetch_outbox_batch, complete_outbox_entries, fail_outbox_entries, get_outbox_stats
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class VectorOutboxConsumer:
+    """后台消费向量索引发件箱，将新商单按小批量写入向量库"""
+
+    def __init__(self, get_vector_db, batch_size=32, poll_interval=1.0, max_attempts=5, retry_backoff=2.0):
+        # get_vector_db 每次调用返回当前提供服务的向量库，保证重建索引后写入新集合
+        self.get_vector_db = get_vector_db
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.processed = 0
+        self.failed_batches = 0
+        self.last_batch_seconds = 0.0
+        self._wakeup = None
+        self._task = None
+
+    def drain_once(self):
+        """处理一批发件箱记录，返回本批处理的数量"""
+        entries = fetch_outbox_batch(self.batch_size)
+        if not entries:
+            return 0
+
+        entry_ids = [entry_id for entry_id, _, _ in entries]
+        orders = [order for _, order, _ in entries]
+        vector_db = self.get_vector_db()
+        start = time.perf_counter()
+        # 同一商单多次修改会产生多条发件箱记录，按商单替换而不是追加
+        if vector_db is not None and vector_db.upsert_orders(orders):
+            complete_outbox_entries(entry_ids)
+            self.processed += len(entries)
+        else:
+            self.failed_batches += 1
+            fail_outbox_entries(entry_ids, "upsert_orders failed", self.max_attempts, self.retry_backoff)
+            logger.warning(f"Failed to index {len(entries)} outbox orders, will retry")
+        self.last_batch_seconds = time.perf_counter() - start
+        return len(entries)
+
+    def notify(self):
+        """有新记录写入时唤醒消费任务"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                drained = await asyncio.to_thread(self.drain_once)
+            except Exception as e:
+                logger.error(f"Error draining vector outbox: {str(e)}")
+                drained = 0
+            # 本批已满说明仍有积压，立即继续；否则等待唤醒或轮询间隔
+            if drained < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    def start(self):
+        """在当前事件循环中启动消费任务"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info("Vector outbox consumer started")
+
+    async def stop(self):
+        """停止消费任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Vector outbox consumer stopped")
+
+    def stats(self):
+        """返回索引延迟和消费统计"""
+        stats = get_outbox_stats() or {}
+        stats.update({
+            "running": self._task is not None,
+            "processed": self.processed,
+            "failed_batches": self.failed_batches,
+            "last_batch_seconds": round(self.last_batch_seconds, 3)
+        })
+        return stats
@@ -1,15 +1,25 @@
 import os
+import inspect
 from app import process_user_analysis, query_personality_score, query_columns, get_user_operations
-from db_operation import create_chroma_db, answer_user_query
+from db_operation import answer_user_query
 import socket
 import logging
 import sqlite3
 import json
-from user_feedback import user_feedback
 from behavior_analyzer import BehaviorAnalyzer
 from personality_score import PersonalityScoreCalculator
-from visualization import create_heatmap, create_comparison_heatmap
 from content_manager import ContentManager
+from recommendation import to_recommendations
+from operation_log import init_operation_log, sync_operations_json, get_recent_operations, iter_operations
+from behavior_aggregates import BehaviorAggregates
+from request_cache import TTLCache, SemanticCache
+from interaction_writer import BufferedInteractionWriter, init_interaction_log
+from heatmap_cache import HeatmapRenderCache
+from pipeline import Stage, run_stages
+from rag_index import RagIndex
+import metrics
+from personality_matrix import PersonalityMatrix
+from personality_batch import PersonalityBatchUpdater
 import asyncio
 from quart import Quart, render_template, jsonify, send_from_directory, request
 
@@ -27,8 +37,66 @@ content_manager = ContentManager()
 if not os.path.exists('output'):
     os.makedirs('output')
 
-# 检查是否存在rag向量数据库
-create_chroma_db("rag_shqp", "shqp_rag.txt")
+# 热力图渲染缓存：分数未变化时不重复渲染，缓存未命中时在进程池中渲染
+heatmap_cache = HeatmapRenderCache('output')
+
+@app.after_serving
+async def shutdown_executors():
+    heatmap_cache.shutdown()
+
+# 检查是否存在rag向量数据库（在工作线程中构建，不阻塞服务启动）
+rag_index = RagIndex("rag_shqp", "shqp_rag.txt")
+
+@app.before_serving
+async def start_rag_index():
+    rag_index.start()
+
+# RAG 画像结果的语义缓存：行为分析和分数变化相近的用户复用已生成的画像
+PROFILE_CACHE_THRESHOLD = 0.97
+profile_cache = SemanticCache(
+    lambda texts: rag_index.model.encode(texts),
+    threshold=PROFILE_CACHE_THRESHOLD,
+    maxsize=2048,
+    ttl=6 * 3600
+)
+
+# 缓存的画像与用户无关：提示词中的用户 id 以占位符代替，分数只给出按桶取整的变化量，
+# 命中后再填入当前用户的 id 和实际分数
+PROFILE_DELTA_BUCKET = 0.5
+PROFILE_USER_PLACEHOLDER = "<USER_ID>"
+
+def _profile_changes(update_reasons):
+    """各特征与用户无关的分数变化：变化量按 PROFILE_DELTA_BUCKET 取整，附带变化原因"""
+    return {
+        trait: {
+            'change': round(round(float(reasons['change']) / PROFILE_DELTA_BUCKET) * PROFILE_DELTA_BUCKET, 1),
+            'reasons': reasons.get('reasons')
+        }
+        for trait, reasons in update_reasons.items()
+    }
+
+def _profile_cache_key(trait_analysis, changes):
+    """画像缓存的键，返回 (语义比较的文本, 必须完全相同的 scope)
+
+    scope 为各特征按桶取整的变化量，不含用户 id 和绝对分数，变化相近的不同用户可以复用同一画像；
+    行为分析和变化原因按语义相似度比较。
+    """
+    scope = json.dumps({trait: change['change'] for trait, change in changes.items()}, sort_keys=True)
+    text = json.dumps(
+        {'trait_analysis': trait_analysis,
+         'reasons': {trait: change['reasons'] for trait, change in changes.items()}},
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return text, scope
+
+@app.route('/rag/status')
+async def get_rag_status():
+    """获取 RAG 索引的构建状态"""
+    return jsonify({
+        'success': True,
+        'rag_index': rag_index.status(),
+        'profile_cache': profile_cache.stats()
+    })
 
 def init_database():
     """初始化数据库表"""
@@ -78,6 +146,75 @@ def init_database():
 # 在应用启动时初始化数据库
 init_database()
 
+# 载入性格分数矩阵（用户 × 特征），用于批量 top 特征和相似用户查询
+personality_matrix = PersonalityMatrix()
+personality_matrix.load()
+
+# 初始化操作日志存储；user_operations.json 每次变化后都会增量导入（读取前检查文件版本）
+init_operation_log()
+
+# 用户滚动行为聚合，按水位线计入操作日志中的新记录（首次启用时即为全量回填）
+behavior_aggregates = BehaviorAggregates()
+behavior_aggregates.init()
+
+def sync_operation_log():
+    """导入 user_operations.json 中的新记录，并将其计入行为聚合"""
+    sync_operations_json()
+    behavior_aggregates.catch_up(lambda after_seq: iter_operations(after_seq=after_seq))
+
+sync_operation_log()
+
+def _update_behavior_aggregates(events):
+    behavior_aggregates.record_many(
+        (event['user_id'], event['interaction_type'], event['content_type'], event['created_at'])
+        for event in events
+    )
+
+def _accepts(func, name):
+    """func 是否接受名为 name 的参数（行为分析器和分数计算器的旧版本不接受滚动聚合）"""
+    try:
+        return name in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+# 交互事件缓冲写入：请求只入队，后台按批量或时间间隔一次性提交
+init_interaction_log()
+interaction_writer = BufferedInteractionWriter(
+    on_flush=[_update_behavior_aggregates]
+)
+
+# 性格分数按水位线由 interaction_log 中的新事件批量更新，只读写受影响用户
+personality_updater = PersonalityBatchUpdater(personality_matrix)
+personality_updater.init()
+
+@app.before_serving
+async def start_interaction_writer():
+    await interaction_writer.start()
+
+@app.after_serving
+async def stop_interaction_writer():
+    await interaction_writer.stop()
+
+# 行为分析结果按 (user_id, 聚合版本) 缓存，用户没有新交互时不再重复分析
+behavior_summary_cache = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+# Prometheus 指标（/metrics）以及按请求开启的 Server-Timing 耗时分解
+metrics.install(app)
+behavior_cache_requests = metrics.REGISTRY.counter(
+    "behavior_summary_cache_requests_total", "Behavior summary cache lookups by result", ("result",)
+)
+metrics.REGISTRY.gauge("interaction_queue_depth", "Interactions waiting to be written",
+                       func=lambda: interaction_writer.stats()["queue_depth"])
+metrics.REGISTRY.gauge("interaction_writer_events_total", "Interactions handled by the buffered writer", ("result",),
+                       func=lambda: {result: interaction_writer.stats()[result]
+                                     for result in ("accepted", "rejected", "flushed", "spilled")}, kind="counter")
+metrics.REGISTRY.gauge("profile_cache_requests_total", "RAG profile semantic cache lookups by result", ("result",),
+                       func=lambda: {"hit": profile_cache.hits, "miss": profile_cache.misses}, kind="counter")
+metrics.REGISTRY.gauge("heatmap_cache_requests_total", "Heatmap render cache lookups by result", ("result",),
+                       func=lambda: {"hit": heatmap_cache.hits, "render": heatmap_cache.renders}, kind="counter")
+metrics.REGISTRY.gauge("personality_matrix_users", "Users in the personality matrix",
+                       func=lambda: len(personality_matrix.user_ids))
+
 @app.route('/')
 async def index():
     logger.debug("Accessing index page")
@@ -112,36 +249,19 @@ async def analyze():
                 'success': False,
                 'error': '请提供用户ID'
             })
+        
+        # 可选：只返回分数最高的 top_k 条推荐，不传时返回全部推荐
+        top_k = data.get('top_k')
+        if top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool) or top_k <= 0):
+            return jsonify({
+                'success': False,
+                'error': 'top_k 必须是正整数'
+            })
             
         logger.debug(f"Processing analysis for user_id: {user_id}")
         
         # 处理用户分析
-        results = await process_user_analysis(user_id)
-        
-        # 确保推荐内容格式正确
-        if 'recommendations' in results:
-            if isinstance(results['recommendations'], str):
-                # 如果推荐内容是字符串，转换为数组格式
-                recommendations = []
-                lines = results['recommendations'].split('\n')
-                current_item = {}
-                for line in lines:
-                    if line.strip():
-                        if line.startswith('   描述：'):
-                            current_item['description'] = line.replace('   描述：', '').strip()
-                        elif line.startswith('   推荐理由：'):
-                            current_item['reason'] = line.replace('   推荐理由：', '').strip()
-                        elif line.startswith('   推荐分数：'):
-                            current_item['score'] = float(line.replace('   推荐分数：', '').strip())
-                        elif line.startswith('   图片链接：'):
-                            current_item['image_url'] = line.replace('   图片链接：', '').strip()
-                        elif not line.startswith('   '):
-                            if current_item:
-                                recommendations.append(current_item)
-                            current_item = {'name': line.strip()}
-                if current_item:
-                    recommendations.append(current_item)
-                results['recommendations'] = recommendations
+        results = await process_user_analysis(user_id, top_k=top_k)
         
         return jsonify({
             'success': True,
@@ -158,52 +278,36 @@ async def analyze():
 @app.route('/output/<path:filename>')
 async def serve_image(filename):
     logger.debug(f"Serving image: {filename}")
+    try:
+        # 按需生成尚未渲染或已过期的热力图
+        await heatmap_cache.ensure(filename)
+    except Exception as e:
+        logger.error(f"Error rendering image {filename}: {str(e)}")
     return await send_from_directory('output', filename)
 
 @app.route('/get_personality/<user_id>')
 async def get_personality(user_id):
     logger.debug(f"Getting personality data for user_id: {user_id}")
     try:
-        # 连接数据库
-        conn = sqlite3.connect("user.db")
-        c = conn.cursor()
-        
-        # 查询用户性格数据
-        cursor = c.execute("SELECT * FROM personality WHERE id = ?", (user_id,))
-        columns = [description[0] for description in cursor.description]
-        row = cursor.fetchone()
-        
-        if row:
-            # 创建特征和分数的字典，过滤掉None值
-            personality_data = {}
-            for col, val in zip(columns[1:], row[1:]):  # 跳过id列
-                if val is not None:  # 只添加非None值
-                    personality_data[col] = val
-            
-            if personality_data:  # 确保有数据
-                # 按分数排序并获取前10个特征
-                sorted_traits = sorted(personality_data.items(), key=lambda x: x[1], reverse=True)
-                top_traits = sorted_traits[:10]
-                
-                # 分离特征名和分数
-                traits = [trait for trait, _ in top_traits]
-                scores = [score for _, score in top_traits]
-                
-                return jsonify({
-                    'success': True,
-                    'traits': traits,
-                    'scores': scores
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': '用户性格数据为空'
-                })
-        else:
+        # 不在矩阵中的用户（例如由其他进程新增）从数据库补读
+        if personality_matrix.get(user_id) is None and not personality_matrix.refresh_user(user_id):
             return jsonify({
                 'success': False,
                 'error': '用户不存在'
             })
+        
+        # 获取分数最高的前10个特征（已过滤None值）
+        top_traits = personality_matrix.top_traits([user_id], k=10).get(str(user_id), [])
+        if top_traits:
+            return jsonify({
+                'success': True,
+                'traits': [trait for trait, _ in top_traits],
+                'scores': [score for _, score in top_traits]
+            })
+        return jsonify({
+            'success': False,
+            'error': '用户性格数据为空'
+        })
             
     except Exception as e:
         logger.error(f"Error getting personality data: {str(e)}")
@@ -211,8 +315,45 @@ async def get_personality(user_id):
             'success': False,
             'error': str(e)
         })
-    finally:
-        conn.close()
+
+@app.route('/top_traits', methods=['POST'])
+async def get_top_traits():
+    """批量获取多个用户分数最高的特征"""
+    try:
+        data = await request.get_json()
+        user_ids = data.get('user_ids') or []
+        k = int(data.get('k', 10))
+        top_traits = personality_matrix.top_traits(user_ids, k=k)
+        return jsonify({
+            'success': True,
+            'users': {
+                user_id: {'traits': [trait for trait, _ in traits], 'scores': [score for _, score in traits]}
+                for user_id, traits in top_traits.items()
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error getting top traits: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@app.route('/similar_users/<user_id>')
+async def get_similar_users(user_id):
+    """按性格分数查找最相似的用户"""
+    try:
+        k = request.args.get('k', 10, type=int)
+        similar = personality_matrix.similar_users(user_id, k=k)
+        return jsonify({
+            'success': True,
+            'similar_users': [{'user_id': other_id, 'similarity': similarity} for other_id, similarity in similar]
+        })
+    except Exception as e:
+        logger.error(f"Error getting similar users: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
 
 @app.route('/get_recent_changes/<user_id>')
 async def get_recent_changes(user_id):
@@ -271,18 +412,11 @@ async def get_recent_changes(user_id):
                 })
                 
         except sqlite3.OperationalError:
-            # 如果表不存在，从JSON文件获取数据
-            logger.info(f"Database tables not found, using JSON file for user {user_id}")
+            # 如果表不存在，从操作日志存储获取数据（按 user_id 和时间索引）
+            logger.info(f"Database tables not found, using operation log for user {user_id}")
             
-            # 读取JSON文件
-            with open('user_operations.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 过滤出指定用户的操作
-            user_operations = [
-                op for op in data['operations']
-                if op['user_id'] == str(user_id)
-            ]
+            await asyncio.to_thread(sync_operation_log)
+            user_operations = get_recent_operations(user_id, limit=10)
             
             if user_operations:
                 # 格式化操作日志
@@ -354,28 +488,29 @@ async def handle_feedback():
                 'error': error_msg
             }), 400
         
-        success = user_feedback.record_interaction(
-            user_id=user_id,
-            content_id=content_id,
-            interaction_type=interaction_type,
-            content_type=content_type,
-            significant_traits=data.get('significant_traits', [])
-        )
+        # 事件进入缓冲队列，由后台批量写入（同时更新滚动行为聚合）
+        accepted = await interaction_writer.submit({
+            'user_id': user_id,
+            'content_id': content_id,
+            'interaction_type': interaction_type,
+            'content_type': content_type,
+            'significant_traits': data.get('significant_traits', [])
+        })
         
-        if success:
+        if accepted:
             response_data = {
                 'success': True,
                 'message': 'Interaction recorded successfully'
             }
-            logger.info(f"Successfully recorded interaction for user {user_id}")
+            logger.debug(f"Queued interaction for user {user_id}")
             return jsonify(response_data)
         else:
-            error_msg = f"Failed to record interaction for user {user_id}"
-            logger.error(error_msg)
+            error_msg = "Interaction queue is full, please retry later"
+            logger.warning(error_msg)
             return jsonify({
                 'success': False,
                 'error': error_msg
-            }), 500
+            }), 503
             
     except Exception as e:
         error_msg = f"Error handling feedback: {str(e)}"
@@ -385,16 +520,23 @@ async def handle_feedback():
             'error': error_msg
         }), 500
 
+@app.route('/feedback/stats')
+async def get_feedback_stats():
+    """获取交互写入队列深度和批量提交延迟"""
+    return jsonify({
+        'success': True,
+        'writer': interaction_writer.stats()
+    })
+
 @app.route('/update_user_data', methods=['POST'])
 async def update_user_data():
     """更新用户数据"""
     try:
         logger.debug("Starting user data update")
         
-        # 更新性格分数
-        if user_feedback.update_personality_scores():
-            # 获取分数变化
-            changes = user_feedback.get_score_changes()
+        # 批量更新有新交互的用户的性格分数（同时同步性格分数矩阵），返回各用户的分数变化
+        updated, changes = await asyncio.to_thread(personality_updater.run)
+        if updated:
             logger.info(f"User data updated successfully. Changes: {changes}")
             
             return jsonify({
@@ -426,77 +568,15 @@ def get_server_info():
         logger.error(f"Error getting server info: {str(e)}")
         return "unknown", "unknown"
 
-async def process_user_analysis(user_id):
-    """Process user analysis and return results"""
-    try:
-        profile = query_personality_score(user_id)
-
-        if profile is None:
-            return {
-                'success': False,
-                'error': f'未找到用户ID {user_id} 的性格数据，请确保该用户已存在于数据库中。'
-            }
-
-        # Create initial personality scores dictionary
-        initial_scores = {}
-        columns = query_columns()
-        print(f"Processing profile: {profile}")  # 添加日志
-        print(f"Using columns: {columns}")  # 添加日志
-
-        for col, val in zip(columns, profile):
-            if col != 'id':  # Skip the id column
-                initial_scores[col] = val
+# 各分析阶段的超时时间（秒）
+STAGE_TIMEOUTS = {
+    'behavior': 60,
+    'scores': 30,
+    'profile': 120,
+    'recommendations': 60
+}
 
-        # 获取用户特定的操作日志
-        user_operations = get_user_operations(user_id)
-        
-        # 限制操作日志的长度
-        max_operations = 50  # 减少处理的操作记录数量
-        if len(user_operations['ops']) > max_operations:
-            user_operations['ops'] = user_operations['ops'][:max_operations]
-            logger.warning(f"操作日志超过{max_operations}条，只处理前{max_operations}条")
-        
-        # 使用行为分析器分析用户行为
-        behavior_analyzer = BehaviorAnalyzer()
-        behavior_summary = await behavior_analyzer.analyze_user_behavior(user_id, user_operations['ops'])
-        
-        # 使用性格分数计算器计算新分数
-        calculator = PersonalityScoreCalculator()
-        new_scores = calculator.update_personality_scores(
-            behavior_summary=behavior_summary,
-            current_scores=initial_scores,
-            user_id=user_id
-        )
-        logger.debug(f"Updated scores: {new_scores}")
-        
-        # 生成更新原因
-        update_reasons = {}
-        for trait in new_scores:
-            # 计算分数变化，确保处理 None 值
-            old_score = float(initial_scores.get(trait, 0) or 0)
-            new_score = float(new_scores.get(trait, 0) or 0)
-            score_change = new_score - old_score
-            
-            # 获取变化原因
-            reasons = calculator.get_score_change_reasons(behavior_summary, trait)
-            if reasons:
-                update_reasons[trait] = {
-                    'old_score': old_score,
-                    'new_score': new_score,
-                    'change': score_change,
-                    'reasons': reasons
-                }
-        logger.debug(f"Update reasons: {update_reasons}")
-
-        # 构建用户画像字符串
-        user_profile = f"用户的性格特征画像：id = {user_id}"
-        for trait, scores in update_reasons.items():
-            user_profile += f"\n{trait}: {scores['old_score']:.1f} -> {scores['new_score']:.1f} (变化: {scores['change']:.1f})"
-        user_profile += "."
-        logger.debug(f"User profile string: {user_profile}")
-
-        # 生成新的画像
-        prompt_profile = """
+PROFILE_PROMPT = """
         请分析以下用户信息并生成更新后的用户画像：
 
         [用户基本信息]
@@ -540,69 +620,230 @@ async def process_user_analysis(user_id):
         请根据以上分析生成更新后的用户画像。
         """
 
-        # 格式化prompt
-        logger.debug("Formatting prompt with trait analysis")
-        try:
-            # 确保 trait_analysis 存在且格式正确
-            trait_analysis = behavior_summary.get('trait_analysis', {})
-            logger.debug(f"Retrieved trait_analysis: {trait_analysis}")
+async def process_user_analysis(user_id, top_k=None):
+    """Process user analysis and return results"""
+    try:
+        profile = query_personality_score(user_id)
+
+        if profile is None:
+            return {
+                'success': False,
+                'error': f'未找到用户ID {user_id} 的性格数据，请确保该用户已存在于数据库中。'
+            }
+
+        # Create initial personality scores dictionary
+        initial_scores = {}
+        columns = query_columns()
+        print(f"Processing profile: {profile}")  # 添加日志
+        print(f"Using columns: {columns}")  # 添加日志
+
+        for col, val in zip(columns, profile):
+            if col != 'id':  # Skip the id column
+                initial_scores[col] = val
+
+        # 各阶段按依赖关系并发执行：评分更新后，RAG画像、热力图和推荐互不依赖
+        def load_operations(inputs):
+            # 获取用户最近的操作日志（限制长度以减少处理的操作记录数量）
+            max_operations = 50
+            # user_operations.json 中的新记录已在 analyze_behavior 开始时导入
+            recent_operations = get_recent_operations(user_id, limit=max_operations)
+            if recent_operations:
+                # 按时间正序交给行为分析器
+                return recent_operations[::-1]
+            # 日志中没有该用户的记录时使用原有的数据源
+            user_operations = get_user_operations(user_id)
+            if len(user_operations['ops']) > max_operations:
+                logger.warning(f"操作日志超过{max_operations}条，只处理前{max_operations}条")
+            return user_operations['ops'][:max_operations]
+
+        async def analyze_behavior(inputs):
+            # 先导入 user_operations.json 中的新记录并计入聚合，日志存储和缓存键都不会停留在旧快照
+            await asyncio.to_thread(sync_operation_log)
+            aggregates = behavior_aggregates.get(user_id)
+            # 聚合未变化（没有新交互）时直接复用上次的分析结果
+            cache_key = (str(user_id), aggregates['total_events'], aggregates['last_seen']) if aggregates else None
+            if cache_key is not None:
+                cached_summary = behavior_summary_cache.get(cache_key)
+                behavior_cache_requests.inc(result="hit" if cached_summary is not None else "miss")
+                if cached_summary is not None:
+                    return cached_summary
+
+            # 使用行为分析器分析用户最近的行为；覆盖全部历史的滚动聚合一并交给分析器，
+            # 分析器不必再为历史规模重新处理操作日志
+            operations = await asyncio.to_thread(load_operations, inputs)
+            behavior_analyzer = BehaviorAnalyzer()
+            if aggregates and _accepts(behavior_analyzer.analyze_user_behavior, 'aggregates'):
+                behavior_summary = await behavior_analyzer.analyze_user_behavior(
+                    user_id, operations, aggregates=aggregates
+                )
+            else:
+                behavior_summary = await behavior_analyzer.analyze_user_behavior(user_id, operations)
+            if aggregates and isinstance(behavior_summary, dict):
+                behavior_summary['aggregates'] = aggregates
+            if cache_key is not None:
+                behavior_summary_cache.set(cache_key, behavior_summary)
+            return behavior_summary
+
+        def update_scores(inputs):
+            behavior_summary = inputs['behavior']
+            # 使用性格分数计算器计算新分数，滚动聚合作为全部历史的行为信号传入
+            calculator = PersonalityScoreCalculator()
+            extra = {}
+            aggregates = behavior_summary.get('aggregates') if isinstance(behavior_summary, dict) else None
+            if aggregates and _accepts(calculator.update_personality_scores, 'aggregates'):
+                extra['aggregates'] = aggregates
+            new_scores = calculator.update_personality_scores(
+                behavior_summary=behavior_summary,
+                current_scores=initial_scores,
+                user_id=user_id,
+                **extra
+            )
+            logger.debug(f"Updated scores: {new_scores}")
             
-            # 确保 trait_analysis 可以被序列化为 JSON
+            # 生成更新原因
+            update_reasons = {}
+            for trait in new_scores:
+                # 计算分数变化，确保处理 None 值
+                old_score = float(initial_scores.get(trait, 0) or 0)
+                new_score = float(new_scores.get(trait, 0) or 0)
+                score_change = new_score - old_score
+                
+                # 获取变化原因
+                reasons = calculator.get_score_change_reasons(behavior_summary, trait)
+                if reasons:
+                    update_reasons[trait] = {
+                        'old_score': old_score,
+                        'new_score': new_score,
+                        'change': score_change,
+                        'reasons': reasons
+                    }
+            logger.debug(f"Update reasons: {update_reasons}")
+            # 以数据库中的最新分数同步性格分数矩阵
+            personality_matrix.refresh_user(user_id)
+            return {'new_scores': new_scores, 'update_reasons': update_reasons}
+
+        def build_profile(inputs):
+            behavior_summary = inputs['behavior']
+            update_reasons = inputs['scores']['update_reasons']
+
+            # 构建用户画像字符串（含用户 id 和实际分数，在生成的画像前展示）
+            user_profile = f"用户的性格特征画像：id = {user_id}"
+            for trait, scores in update_reasons.items():
+                user_profile += f"\n{trait}: {scores['old_score']:.1f} -> {scores['new_score']:.1f} (变化: {scores['change']:.1f})"
+            user_profile += "."
+            logger.debug(f"User profile string: {user_profile}")
+
+            # 交给 RAG 的提示词只包含与用户无关的内容，生成的画像可以被变化相近的其他用户复用
+            changes = _profile_changes(update_reasons)
+            generic_profile = "用户的性格特征画像："
+            for trait, change in changes.items():
+                generic_profile += f"\n{trait}: 变化约 {change['change']:+.1f}"
+            generic_profile += "."
+
+            # 格式化prompt
+            logger.debug("Formatting prompt with trait analysis")
             try:
-                json.dumps(trait_analysis, ensure_ascii=False)
+                # 确保 trait_analysis 存在且格式正确
+                trait_analysis = behavior_summary.get('trait_analysis', {})
+                logger.debug(f"Retrieved trait_analysis: {trait_analysis}")
+                
+                # 确保 trait_analysis 可以被序列化为 JSON
+                try:
+                    json.dumps(trait_analysis, ensure_ascii=False)
+                except Exception as e:
+                    logger.error(f"Error serializing trait_analysis: {str(e)}")
+                    trait_analysis = {'error': '无法序列化特征分析'}
+                
+                formatted_prompt = PROFILE_PROMPT.format(
+                    user_id=PROFILE_USER_PLACEHOLDER,
+                    user_profile=generic_profile,
+                    trait_analysis=json.dumps(trait_analysis, ensure_ascii=False),
+                    score_changes=json.dumps(changes, ensure_ascii=False)
+                )
+                logger.debug(f"Formatted prompt: {formatted_prompt}")
             except Exception as e:
-                logger.error(f"Error serializing trait_analysis: {str(e)}")
-                trait_analysis = {'error': '无法序列化特征分析'}
-            
-            formatted_prompt = prompt_profile.format(
-                user_id=user_id,
-                user_profile=user_profile,
-                trait_analysis=json.dumps(trait_analysis, ensure_ascii=False),
-                score_changes=json.dumps(update_reasons, ensure_ascii=False)
+                logger.error(f"Error formatting prompt: {str(e)}", exc_info=True)
+                # 使用默认值格式化 prompt
+                trait_analysis = {'error': '无法格式化特征分析'}
+                formatted_prompt = PROFILE_PROMPT.format(
+                    user_id=PROFILE_USER_PLACEHOLDER,
+                    user_profile=generic_profile,
+                    trait_analysis=json.dumps(trait_analysis, ensure_ascii=False),
+                    score_changes=json.dumps(changes, ensure_ascii=False)
+                )
+
+            # 使用RAG进行分析（索引首次构建完成前等待，超时由阶段默认值兜底）
+            if not rag_index.wait_ready(timeout=STAGE_TIMEOUTS['profile']):
+                raise RuntimeError("RAG index is not ready")
+            cache_text, cache_scope = _profile_cache_key(trait_analysis, changes)
+            profile_text = profile_cache.get_or_compute(
+                cache_text,
+                lambda: ''.join(answer_user_query("rag_shqp", formatted_prompt)),
+                cacheable=bool,
+                scope=cache_scope
             )
-            logger.debug(f"Formatted prompt: {formatted_prompt}")
-        except Exception as e:
-            logger.error(f"Error formatting prompt: {str(e)}", exc_info=True)
-            # 使用默认值格式化 prompt
-            formatted_prompt = prompt_profile.format(
-                user_id=user_id,
-                user_profile=user_profile,
-                trait_analysis=json.dumps({'error': '无法格式化特征分析'}, ensure_ascii=False),
-                score_changes=json.dumps(update_reasons, ensure_ascii=False)
+            if not profile_text:
+                return profile_text
+            # 命中或生成后再填入当前用户的 id 和实际分数
+            return f"{user_profile}\n\n{profile_text.replace(PROFILE_USER_PLACEHOLDER, str(user_id))}"
+
+        def schedule_heatmaps(inputs):
+            new_scores = inputs['scores']['new_scores']
+            # 登记热力图（分数和标题未变化时不会重新渲染，渲染在后台进程池中进行）
+            heatmap_cache.schedule(f"initial_heatmap_{user_id}.png", "heatmap",
+                                   initial_scores, f"Initial Personality Heatmap for User {user_id}")
+            heatmap_cache.schedule(f"updated_heatmap_{user_id}.png", "heatmap",
+                                   new_scores, f"Updated Personality Heatmap for User {user_id}")
+            heatmap_cache.schedule(f"comparison_heatmap_{user_id}.png", "comparison",
+                                   initial_scores, new_scores,
+                                   f"Personality Scores Comparison for User {user_id}")
+
+        def find_similar_users(inputs):
+            # 性格相近的用户，作为推荐的协同信号
+            return [
+                {'user_id': other_id, 'similarity': similarity}
+                for other_id, similarity in personality_matrix.similar_users(user_id, k=10)
+            ]
+
+        def recommend(inputs):
+            # 获取推荐内容
+            logger.debug("Getting recommendations")
+            update_reasons = inputs['scores']['update_reasons']
+            # 将 update_reasons 添加到 personality_data 中
+            personality_data_with_reasons = {
+                **inputs['scores']['new_scores'],  # 包含所有性格特征分数
+                'update_reasons': update_reasons  # 添加更新原因
+            }
+            logger.debug(f"Personality data with reasons: {personality_data_with_reasons}")
+            logger.debug(f"Update reasons before passing to get_recommendations: {update_reasons}")
+            return to_recommendations(
+                content_manager.get_recommendations(
+                    personality_data=personality_data_with_reasons,
+                    user_id=user_id
+                ),
+                k=top_k
             )
 
-        # 使用RAG进行分析
-        result_profile = ''.join(
-            answer_user_query("rag_shqp", formatted_prompt))
-
-        # 生成热力图
-        create_heatmap(initial_scores, f"Initial Personality Heatmap for User {user_id}",
-                    f"initial_heatmap_{user_id}.png")
-        create_heatmap(new_scores, f"Updated Personality Heatmap for User {user_id}",
-                    f"updated_heatmap_{user_id}.png")
-        create_comparison_heatmap(initial_scores, new_scores,
-                                f"Personality Scores Comparison for User {user_id}",
-                                f"comparison_heatmap_{user_id}.png")
-
-        # 获取推荐内容
-        logger.debug("Getting recommendations")
-        # 将 update_reasons 添加到 personality_data 中
-        personality_data_with_reasons = {
-            **new_scores,  # 包含所有性格特征分数
-            'update_reasons': update_reasons  # 添加更新原因
-        }
-        logger.debug(f"Personality data with reasons: {personality_data_with_reasons}")
-        logger.debug(f"Update reasons before passing to get_recommendations: {update_reasons}")
-        recommended_items = content_manager.get_recommendations(
-            personality_data=personality_data_with_reasons,
-            user_id=user_id
-        )
+        results, timings = await run_stages([
+            Stage('behavior', analyze_behavior, timeout=STAGE_TIMEOUTS['behavior']),
+            Stage('scores', update_scores, deps=['behavior'], blocking=True, timeout=STAGE_TIMEOUTS['scores']),
+            Stage('profile', build_profile, deps=['behavior', 'scores'], blocking=True,
+                  timeout=STAGE_TIMEOUTS['profile'], default=''),
+            Stage('heatmaps', schedule_heatmaps, deps=['scores']),
+            Stage('recommendations', recommend, deps=['scores'], blocking=True,
+                  timeout=STAGE_TIMEOUTS['recommendations'], default=[]),
+            Stage('similar_users', find_similar_users, deps=['scores'], default=[]),
+        ])
+        logger.debug(f"Analysis stage timings for user {user_id}: {timings}")
+        for stage, seconds in timings.items():
+            metrics.record_stage(f"analysis_{stage}", seconds)
 
         return {
             'success': True,
-            'summary': behavior_summary,
-            'profile': result_profile,
-            'recommendations': recommended_items,
+            'summary': results['behavior'],
+            'profile': results['profile'],
+            'recommendations': [rec.to_dict() for rec in results['recommendations']],
+            'similar_users': results['similar_users'],
             'images': {
                 'initial': f"initial_heatmap_{user_id}.png",
                 'updated': f"updated_heatmap_{user_id}.png",